@@ -0,0 +1,154 @@
+import torch
+import numpy as np
+import argparse
+import json
+import os
+import shutil
+import struct
+
+"""
+Checkpoint layout that keeps weights separate from training stats:
+
+    <path>          magic | header length | JSON header | tensor blob
+    <path>.stats    pickled [train_stats, test_stats]
+
+The JSON header holds the metadata (num_classes, network) and the dtype, shape and offset of every tensor. Every
+tensor starts on an ALIGNMENT byte boundary so the blob can be memory-mapped and wrapped as tensors without
+copying or unpickling anything. Old pickled .mod files can be upgraded with
+
+    python -m architectures.checkpoint models/network1/first_model.mod
+"""
+
+MAGIC = b"DDCKPT01"
+ALIGNMENT = 64
+STATS_SUFFIX = ".stats"
+
+
+def aligned(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def is_checkpoint(path):
+    """
+    True if path is in this format, False for the older pickled checkpoints.
+    """
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def save_checkpoint(path, state_dict, metadata, stats = None):
+    """
+    Args:
+        path (string): file to write the weights to, the stats go to path + ".stats"
+        state_dict (dict): tensors to store
+        metadata (dict): JSON serializable information, e.g. num_classes
+        stats (object, optional): training stats, pickled into the sidecar
+    """
+    tensors, offset = {}, 0
+    arrays = []
+    for name, tensor in state_dict.items():
+        array = tensor.detach().cpu().contiguous().numpy()
+        offset = aligned(offset)
+        tensors[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        arrays.append((offset, array))
+        offset += array.nbytes
+
+    header = json.dumps({"metadata": metadata, "tensors": tensors}).encode("utf-8")
+    data_start = aligned(len(MAGIC) + 8 + len(header))
+
+    # write next to the target and rename, so an interrupted save never leaves half a checkpoint
+    with open(path + ".tmp", 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        for tensor_offset, array in arrays:
+            f.seek(data_start + tensor_offset)
+            f.write(array.tobytes())
+        f.truncate(data_start + offset)
+    os.replace(path + ".tmp", path)
+
+    if stats is not None:
+        torch.save(stats, path + STATS_SUFFIX + ".tmp")
+        os.replace(path + STATS_SUFFIX + ".tmp", path + STATS_SUFFIX)
+
+
+def read_header(path):
+    """
+    Returns the decoded JSON header and the file offset the tensor blob starts at.
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(path + " is not a weights checkpoint")
+        header_length, = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_length).decode("utf-8"))
+    return header, aligned(len(MAGIC) + 8 + header_length)
+
+
+def load_checkpoint(path, device = "cpu"):
+    """
+    Memory-maps the tensor blob. On the CPU the returned tensors share memory with the (copy-on-write) mapping,
+    so pages are only read from disk when they are touched.
+
+    Returns:
+        (dict, dict): the metadata and the state dict
+    """
+    header, data_start = read_header(path)
+    blob = np.memmap(path, dtype = np.uint8, mode = 'c')
+    state_dict = {}
+    for name, info in header["tensors"].items():
+        dtype = np.dtype(info["dtype"])
+        count = int(np.prod(info["shape"]))
+        start = data_start + info["offset"]
+        array = blob[start:start + count * dtype.itemsize].view(dtype).reshape(info["shape"])
+        state_dict[name] = torch.from_numpy(array).to(device)
+    return header["metadata"], state_dict
+
+
+def load_stats(path, device = "cpu"):
+    """
+    Returns the pickled stats sidecar of a checkpoint, or None if there is none.
+    """
+    if not os.path.exists(path + STATS_SUFFIX):
+        return None
+    with open(path + STATS_SUFFIX, 'rb') as f:
+        return torch.load(f, map_location = device)
+
+
+def convert_legacy(load_dir, save_dir):
+    """
+    Rewrites a pickled checkpoint ([state_dict, train_stats, test_stats, num_classes], or a bare state dict from
+    before the representation update) in this format.
+    """
+    with open(load_dir, 'rb') as f:
+        contents = torch.load(f, map_location = "cpu")
+
+    if isinstance(contents, (list, tuple)):
+        state_dict, train_stats, test_stats, num_classes = contents
+        stats = [train_stats, test_stats]
+    else:
+        state_dict, stats = contents, None
+        num_classes = state_dict["classify_layer.weight"].shape[0]
+
+    save_checkpoint(save_dir, state_dict, {"num_classes": int(num_classes)}, stats)
+    return num_classes
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Upgrade pickled .mod checkpoints to the memory-mappable format')
+    parser.add_argument('checkpoints', type = str, nargs = "+", help = "checkpoints to convert, in place unless --out is given")
+    parser.add_argument('--out', '-o', type = str, default = None, help = "output file, only valid with a single checkpoint")
+    parser.add_argument('--no-backup', dest = "backup", action = "store_false", help = "do not keep the original as <file>.bak")
+    args = parser.parse_args()
+
+    if args.out and len(args.checkpoints) > 1:
+        raise RuntimeError("--out can only be used when converting a single checkpoint")
+
+    for checkpoint in args.checkpoints:
+        if is_checkpoint(checkpoint):
+            print(checkpoint + " is already converted")
+            continue
+        out = args.out or checkpoint
+        if out == checkpoint and args.backup:
+            shutil.copyfile(checkpoint, checkpoint + ".bak")
+        num_classes = convert_legacy(checkpoint, out)
+        print("Converted {} ({} classes) to {}".format(checkpoint, num_classes, out))
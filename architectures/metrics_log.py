@@ -0,0 +1,107 @@
+import numpy as np
+import csv
+import os
+import queue
+import threading
+import time
+
+"""
+Append-only, columnar metrics log of a training run. Rows are queued by the trainer and written to a CSV file by
+a background thread, so logging never waits on the disk, and the history lives on disk instead of in ModelStats
+(and in every checkpoint). Columns:
+
+    time, split, step, loss, accuracy, jaccard, class_accuracy_<i>..., class_loss_<i>...
+
+step is the global training step (batches trained on since the model was created) of the model when the row was
+written, so it keeps increasing across epochs and resumed runs. Missing values are left empty. read_log loads the
+columns back as numpy arrays.
+"""
+
+BASE_COLUMNS = ["time", "split", "step", "loss", "accuracy", "jaccard"]
+
+
+def log_columns(num_classes):
+    return BASE_COLUMNS + ["class_accuracy_{}".format(i) for i in range(num_classes)] + \
+           ["class_loss_{}".format(i) for i in range(num_classes)]
+
+
+def read_log(path, split = None):
+    """
+    Returns {column: np.array} of the rows of split (all rows if None). Numeric columns are float arrays with nan
+    for missing values.
+    """
+    with open(path, newline = "") as f:
+        reader = csv.reader(f)
+        columns = next(reader, [])
+        rows = [row for row in reader if split is None or row[1] == split]
+    table = {}
+    for index, column in enumerate(columns):
+        values = [row[index] for row in rows]
+        if column == "split":
+            table[column] = np.array(values)
+        else:
+            table[column] = np.array([float(value) if value != "" else np.nan for value in values])
+    return table
+
+
+class MetricsLog:
+    """
+    Args:
+        path (string): CSV file to append to, created with a header if missing
+        num_classes (int): number of per class columns
+    """
+    def __init__(self, path, num_classes):
+        self.path = path
+        self.columns = log_columns(num_classes)
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, newline = "") as f:
+                existing = next(csv.reader(f), [])
+            if existing != self.columns:
+                raise ValueError("{} was written with columns {}, expected {}".format(path, existing, self.columns))
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok = True)
+            with open(path, "w", newline = "") as f:
+                csv.writer(f).writerow(self.columns)
+
+        self.rows = queue.Queue()
+        self.writer = threading.Thread(target = self.write_rows, name = "metrics log", daemon = True)
+        self.writer.start()
+
+    def log(self, split, step = None, loss = None, accuracy = None, jaccard = None, per_class_accuracy = None, per_class_loss = None):
+        """
+        Queues one row; returns immediately.
+        """
+        row = {"time": time.time(), "split": split, "step": step, "loss": loss, "accuracy": accuracy, "jaccard": jaccard}
+        for name, values in (("class_accuracy_{}", per_class_accuracy), ("class_loss_{}", per_class_loss)):
+            if values is not None:
+                row.update((name.format(i), float(value)) for i, value in enumerate(values))
+        self.rows.put(row)
+
+    def write_rows(self):
+        while True:
+            rows = [self.rows.get()]
+            while not self.rows.empty():  # write whatever queued up in one go
+                rows.append(self.rows.get())
+            stop = rows[-1] is None
+            with open(self.path, "a", newline = "") as f:
+                writer = csv.DictWriter(f, self.columns, restval = "")
+                writer.writerows(row for row in rows if row is not None)
+            for _ in rows:
+                self.rows.task_done()
+            if stop:
+                return
+
+    def flush(self):
+        """
+        Blocks until every queued row is on disk.
+        """
+        self.rows.join()
+
+    def close(self):
+        if self.writer.is_alive():
+            self.rows.put(None)
+            self.writer.join()
+
+    def read(self, split = None):
+        self.flush()
+        return read_log(self.path, split)
@@ -0,0 +1,107 @@
+import torch
+import torch.nn as nn
+import argparse
+import io
+import sys
+
+from architectures.registry import get_network, network_names
+
+"""
+Reports the parameter count, checkpoint size, FLOPs and activation memory of every network, and flags
+parameters that never receive a gradient (allocated, optimized and saved, but unused by forward).
+
+    python -m architectures.model_budget --max-params 50e6
+"""
+
+def count_parameters(model):
+    return sum(param.numel() for param in model.parameters())
+
+
+def checkpoint_size(model):
+    """
+    Size in bytes of the serialized state dict, which is what NetworkBase.save writes besides the stats.
+    """
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell()
+
+
+def layer_flops(module, inputs, output):
+    """
+    Floating point operations (2 per multiply-add, bias ignored) of a single leaf module call.
+    """
+    if isinstance(module, nn.Conv2d):
+        kernel_ops = module.in_channels // module.groups * module.kernel_size[0] * module.kernel_size[1]
+        return 2 * output.numel() * kernel_ops
+    if isinstance(module, nn.ConvTranspose2d):
+        kernel_ops = module.out_channels // module.groups * module.kernel_size[0] * module.kernel_size[1]
+        return 2 * inputs[0].numel() * kernel_ops
+    if isinstance(module, nn.Linear):
+        return 2 * inputs[0].numel() * module.out_features
+    return 0
+
+
+def profile_model(model, width = 1280, height = 720, batch_size = 1):
+    """
+    Runs one forward and backward pass on random data.
+
+    Returns:
+        (int, int, list): forward FLOPs, bytes of activations kept for the backward pass (the peak
+            activation memory of a training step) and names of parameters that got no gradient
+    """
+    flops = [0]
+    hooks = [module.register_forward_hook(lambda module, inputs, output: flops.__setitem__(0, flops[0] + layer_flops(module, inputs, output)))
+             for module in model.modules() if len(list(module.children())) == 0]
+
+    # count every tensor autograd saves for backward once, leaving out the weights
+    parameter_pointers = set(param.data_ptr() for param in model.parameters())
+    saved = {}
+    def pack(tensor):
+        if tensor.data_ptr() not in parameter_pointers:
+            saved[tensor.data_ptr()] = tensor.numel() * tensor.element_size()
+        return tensor
+
+    model.zero_grad()
+    data = torch.randn((batch_size, 3, width, height))
+    try:
+        with torch.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor):
+            output = model(data)
+        output.sum().backward()
+    finally:
+        for hook in hooks:
+            hook.remove()
+
+    unused = [name for name, param in model.named_parameters() if param.grad is None]
+    model.zero_grad()
+    return flops[0], sum(saved.values()), unused
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Parameter, FLOP and memory budget of every network')
+    parser.add_argument('--networks', type = str, nargs = "+", choices = network_names(), default = network_names())
+    parser.add_argument('--width', type = int, default = 1280)
+    parser.add_argument('--height', type = int, default = 720)
+    parser.add_argument('--two_class', '-2', action = "store_true", help = "inspect the 2 class models")
+    parser.add_argument('--max-params', dest = "max_params", type = float, default = None, help = "fail if a network has more parameters")
+    args = parser.parse_args()
+    num_classes = 2 if args.two_class else 3
+
+    failures = []
+    print('\n Network  |   Params   | Checkpoint (MB) | GFLOPs | Activations (MB) | Unused params')
+    for name in args.networks:
+        model = get_network(name)("", num_classes)
+        num_params = count_parameters(model)
+        flops, activation_bytes, unused = profile_model(model, args.width, args.height)
+        unused_count = sum(param.numel() for param_name, param in model.named_parameters() if param_name in unused)
+        print(' {:8s} | {:10d} | {:15.1f} | {:6.1f} | {:16.1f} | {}'.format(name, num_params, checkpoint_size(model) / 2.**20,
+              flops / 1e9, activation_bytes / 2.**20, unused_count))
+
+        if unused:
+            failures.append("{}: parameters never used by forward: {}".format(name, ", ".join(unused)))
+        if args.max_params is not None and num_params > args.max_params:
+            failures.append("{}: {} parameters exceeds the budget of {:.0f}".format(name, num_params, args.max_params))
+        del model
+
+    for failure in failures:
+        print(failure)
+    sys.exit(1 if failures else 0)
@@ -1,47 +1,89 @@
 import numpy as np
-import matplotlib
-from matplotlib import pyplot as plt
+from collections import deque
+
+HISTORY = 100  # recent values kept in memory, the full history goes to a MetricsLog
 
 """
-Maintains information about the model
+Maintains information about the model. Only the last HISTORY values of every series and the confusion matrix are
+kept in memory (and in checkpoints); with a MetricsLog attached, record() also appends every value to the log and
+the graphs read the full history back from it.
 """
 class ModelStats:
     def __init__(self, num_classes = 2):
-        self.loss = []
-        self.accuracy = []
+        self.loss = deque(maxlen = HISTORY)
+        self.accuracy = deque(maxlen = HISTORY)
         self.confusion = np.zeros((num_classes, num_classes))
-        self.per_class_loss = [] #not used
-        self.jaccard_accuracy = []
-        self.per_class_accuracy = []
+        self.per_class_loss = deque(maxlen = HISTORY)
+        self.jaccard_accuracy = deque(maxlen = HISTORY)
+        self.per_class_accuracy = deque(maxlen = HISTORY)
         self.num_classes = num_classes
         self.figure_number = 0
         self.colors = ['r', 'g', 'b']
+        self.metrics_log = None
+        self.split = None
+        self.step = 0  # global training step, only advanced on the train stats
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["metrics_log"] = None
+        return state
+
+    def __setstate__(self, state):
+        # stats pickled before the log existed hold the whole history in lists
+        for name in ("loss", "accuracy", "per_class_loss", "jaccard_accuracy", "per_class_accuracy"):
+            state[name] = deque(state.get(name, []), maxlen = HISTORY)
+        state.setdefault("metrics_log", None)
+        state.setdefault("split", None)
+        state.setdefault("step", 0)
+        self.__dict__.update(state)
+
+    def attach_log(self, metrics_log, split):
+        """
+        Appends everything recorded from now on to metrics_log as rows of split ("train" or "test").
+        """
+        self.metrics_log = metrics_log
+        self.split = split
+
+    def record(self, step = None, loss = None, accuracy = None, jaccard = None, per_class_accuracy = None, per_class_loss = None):
+        for series, value in ((self.loss, loss), (self.accuracy, accuracy), (self.jaccard_accuracy, jaccard),
+                              (self.per_class_accuracy, per_class_accuracy), (self.per_class_loss, per_class_loss)):
+            if value is not None:
+                series.append(value)
+        if self.metrics_log is not None:
+            self.metrics_log.log(self.split, step, loss, accuracy, jaccard, per_class_accuracy, per_class_loss)
+
+    def history(self, column):
+        """
+        Every logged value of column (a metrics_log column name) if a log is attached, the recent values otherwise.
+        """
+        if self.metrics_log is not None:
+            values = self.metrics_log.read(self.split)[column]
+            return values[~np.isnan(values)]
+        if column.startswith("class_accuracy_"):
+            return np.array([accuracies[int(column.rsplit("_", 1)[1])] for accuracies in self.per_class_accuracy])
+        series = {"loss": self.loss, "accuracy": self.accuracy, "jaccard": self.jaccard_accuracy}[column]
+        return np.array(series, dtype = float)
 
     def start_new_graph(self):
-        plt.figure(self.figure_number)
+        pyplot().figure(self.figure_number)
         self.figure_number+=1
 
     def graph_accuracy_with_time(self):
-        plt.plot(self.accuracy, 'orange', label = "Total Accuracy")
+        pyplot().plot(self.history("accuracy"), 'orange', label = "Total Accuracy")
     
     def graph_per_class_accuracy_with_time(self):
-        accuracies = [[] for _ in range(num_classes)]
-        for accuracy_list in self.per_class_accuracy:
-            for i in range(self.num_classes):
-                accuracies[i].append(accuracy_list[i])
-        
         for i in range(self.num_classes):
-            plt.plot(accuracies[i], self.colors[i], label = "Class {} Accuracy".format(i))
+            pyplot().plot(self.history("class_accuracy_{}".format(i)), self.colors[i], label = "Class {} Accuracy".format(i))
         
 
     def graph_loss_with_time(self):
-        plt.plot(self.loss, 'purple', label = "Total Loss")
+        pyplot().plot(self.history("loss"), 'purple', label = "Total Loss")
 
     def save_plot(self, title):
-        plt.savefig(title + ".png")
+        pyplot().savefig(title + ".png")
 
     def show(self):
-        plt.show()
+        pyplot().show()
 
     def print_summary(self):
         print('\n--------------------------------------------------------------')
@@ -90,4 +132,9 @@ class ModelStats:
         print('--------------------------------------------------------------')
 
 
-
+def pyplot():
+    """
+    matplotlib is only imported the first time a graph is drawn, since loading stats should not pay for it.
+    """
+    from matplotlib import pyplot as plt
+    return plt
@@ -31,5 +31,5 @@ class Network_1(NetworkBase):  # inherit from base class torch.nn.Module
         x = F.relu(nn.functional.interpolate(x, scale_factor = 20, mode = 'bilinear', align_corners=True))  # NOT SURE IF WE SHOULD USE RELU HERE!
         x = self.classify_layer(x)  # finish with 2d classification
 
-        return nn.LogSoftmax(dim = 1)(x)  # return softmax for probability of 2d tensor
+        return self.output_layer(x)  # return log-softmax for probability of 2d tensor (or logits)
 
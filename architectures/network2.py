@@ -1,10 +1,7 @@
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-import torch.optim as optim
-import matplotlib.pyplot as plt
 import numpy as np
-from tqdm import tqdm
 from architectures.network_base import NetworkBase 
 
 '''
@@ -94,5 +91,5 @@ class Network_2(NetworkBase):  # inherit from base class torch.nn.Module
         x = F.relu(nn.functional.interpolate(x, scale_factor = 2, mode = 'bilinear', align_corners=True))                
 
         x = self.classify_layer(x)
-        return nn.LogSoftmax(dim = 1)(x)
+        return self.output_layer(x)
 
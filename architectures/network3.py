@@ -1,10 +1,7 @@
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-import torch.optim as optim
-import matplotlib.pyplot as plt
 import numpy as np
-from tqdm import tqdm
 from architectures.network_base import NetworkBase
 '''
 Encoder based on VGG16 architecture (without final fully connected layers)
@@ -103,5 +100,5 @@ class Network_3(NetworkBase):  # inherit from base class torch.nn.Module
         x = F.relu(self.final_deconv(x))
         x = self.classify_layer(x)
 
-        return nn.LogSoftmax(dim = 1)(x)
+        return self.output_layer(x)
 
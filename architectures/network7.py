@@ -1,10 +1,7 @@
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-import torch.optim as optim
-import matplotlib.pyplot as plt
 import numpy as np
-from tqdm import tqdm
 from architectures.network_base import NetworkBase
 '''
 Encoder based on VGG16 architecture (without final fully connected layers)
@@ -13,7 +10,6 @@ class Network_7(NetworkBase):  # inherit from base class torch.nn.Module
     def __init__(self, save_dir, num_classes):
         super(Network_7, self).__init__(save_dir, num_classes)  # initialize Module characteristics
         
-        self.section_outputs = [None, None, None]
         self.sections = []
         self.section_pools = []
         
@@ -83,29 +79,42 @@ class Network_7(NetworkBase):  # inherit from base class torch.nn.Module
     Defines how we perform a forward pass of the VGG16 neural network
     """
     def forward(self, x):
-        # downsample
+        deep_features, skips = self.encode(x)
+        return self.output_layer(self.decode(deep_features, skips))
+
+    """
+    Runs the downsampling path. Returns the output of the bottom transition and the skip-connection outputs of the
+    first 3 sections. If deep_features is given (from an earlier, similar frame), only the shallow sections that
+    feed the skip connections are computed and deep_features is returned as is.
+    """
+    def encode(self, x, deep_features = None):
+        skips = []
         for index, section in enumerate(self.sections):
+            if deep_features is not None and index >= 3:
+                break
             for layer in section:
                 x = F.relu(layer(x))
             if(index < 4):
                 x = self.section_pools[index](x)
             if index < 3:
-                self.section_outputs[index] = x
-        
-        #x_old_shape = x.size()
-        #x = F.relu(self.full_transition(x.view(-1))) 
-        #x = x.view((1, 4, 80, 45)) 
-        # perform final convolution at bottom layer
-        x = F.relu(self.bottom_transition(x))
-        
+                skips.append(x)
+
+        if deep_features is None:
+            # perform final convolution at bottom layer
+            deep_features = F.relu(self.bottom_transition(x))
+        return deep_features, skips
+
+    """
+    Runs the upsampling path from the bottom transition output and the skip-connection outputs, returning the
+    class scores before the output layer.
+    """
+    def decode(self, x, skips):
         # upsample
         for index, deconv_layer in enumerate(self.deconvolutions):
             x = F.relu(deconv_layer(x))  # upsample through deconvolution
-            x = torch.cat((x, self.section_outputs[-index-1]), dim = 1)  # concatenate skiplayer to channels
+            x = torch.cat((x, skips[-index-1]), dim = 1)  # concatenate skiplayer to channels
             x = F.relu(self.skip_connections[index](x))  # compute upsample given skip-connection info
-        
-        x = F.relu(self.final_deconv(x))
-        x = self.classify_layer(x)
 
-        return nn.LogSoftmax(dim = 1)(x)
+        x = F.relu(self.final_deconv(x))
+        return self.classify_layer(x)
 
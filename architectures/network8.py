@@ -1,16 +1,17 @@
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-import torch.optim as optim
-import matplotlib.pyplot as plt
 import numpy as np
-from tqdm import tqdm
 from architectures.network_base import NetworkBase
 '''
 Encoder based on VGG16 architecture (without final fully connected layers)
+
+The fully connected bottleneck (full_transition) is ~207M parameters (~830 MB) and ties the model to a batch
+size of 1 at 1280 x 720. Pass full_transition = False to leave it out, which makes this network the same as
+Network_7. Checkpoints saved without it switch it off when loaded.
 '''
 class Network_8(NetworkBase):  # inherit from base class torch.nn.Module
-    def __init__(self, save_dir, num_classes):
+    def __init__(self, save_dir, num_classes, full_transition = True):
         super(Network_8, self).__init__(save_dir, num_classes)  # initialize Module characteristics
         
         self.section_outputs = [None, None, None]
@@ -55,7 +56,7 @@ class Network_8(NetworkBase):  # inherit from base class torch.nn.Module
         self.conv3_6_512 = nn.Conv2d(8, 4, kernel_size=3, stride = 1, padding = 1)
         self.sections.append([self.conv3_4_512, self.conv3_5_512, self.conv3_6_512])
         
-        self.full_transition = nn.Linear(80 * 4 * 45, 80* 4 * 45)
+        self.full_transition = nn.Linear(80 * 4 * 45, 80* 4 * 45) if full_transition else None
         # 6: bottom transition layer
         self.bottom_transition = nn.Conv2d(4, 32, kernel_size = 3, padding = 1, stride = 1)
 
@@ -92,9 +93,9 @@ class Network_8(NetworkBase):  # inherit from base class torch.nn.Module
             if index < 3:
                 self.section_outputs[index] = x
         
-        x_old_shape = x.size()
-        x = F.relu(self.full_transition(x.view(-1))) 
-        x = x.view((1, 4, 80, 45)) 
+        if self.full_transition is not None:
+            x = F.relu(self.full_transition(x.view(-1)))
+            x = x.view((1, 4, 80, 45))
         # perform final convolution at bottom layer
         x = F.relu(self.bottom_transition(x))
         
@@ -107,5 +108,13 @@ class Network_8(NetworkBase):  # inherit from base class torch.nn.Module
         x = F.relu(self.final_deconv(x))
         x = self.classify_layer(x)
 
-        return nn.LogSoftmax(dim = 1)(x)
+        return self.output_layer(x)
+
+    """
+    Drops the fully connected bottleneck when loading weights that were trained without it.
+    """
+    def load_state_dict(self, state_dict, strict = True, **kwargs):
+        if self.full_transition is not None and "full_transition.weight" not in state_dict:
+            self.full_transition = None
+        return super(Network_8, self).load_state_dict(state_dict, strict, **kwargs)
 
@@ -3,6 +3,7 @@ import torch.nn as nn
 import torch.nn.functional as F
 import numpy as np
 from architectures.model_stats import ModelStats
+from architectures.checkpoint import is_checkpoint, save_checkpoint, load_checkpoint, load_stats
 
 '''
 Base class that all networks inherit from
@@ -16,18 +17,61 @@ class NetworkBase(nn.Module):  # inherit from base class torch.nn.Module
                       "test": self.test_stats}
         self.save_dir = save_dir
         self.num_classes = num_classes
+        self.return_logits = False
 
     """
-    defines how we save our model, save all info about model to file
+    Final activation shared by every network. Returns log-probabilities over the classes, or the raw logits
+    in logits mode, which is all that argmax and a fused cross entropy loss need.
+    """
+    def output_layer(self, x):
+        if self.return_logits:
+            return x
+        return F.log_softmax(x, dim = 1)
+
+    """
+    Switches logits mode on or off and returns the previous setting so callers can restore it.
+    """
+    def set_logits_mode(self, return_logits):
+        previous = self.return_logits
+        self.return_logits = return_logits
+        return previous
+
+    """
+    Sends everything the train and test stats record from now on to metrics_log (see architectures/metrics_log.py).
+    Call it after load, which replaces the stats.
+    """
+    def attach_metrics_log(self, metrics_log):
+        self.train_stats.attach_log(metrics_log, "train")
+        self.test_stats.attach_log(metrics_log, "test")
+
+    """
+    defines how we save our model: weights and metadata go to save_dir, the stats to a separate sidecar
+    (see architectures/checkpoint.py)
     """
     def save(self):
-        torch.save([self.state_dict(), self.train_stats, 
-                    self.test_stats, self.num_classes], self.save_dir)
+        save_checkpoint(self.save_dir, self.state_dict(), {"num_classes": self.num_classes, "network": type(self).__name__},
+                        [self.train_stats, self.test_stats])
 
     """
-    defines how we load the model, load in all the data
+    defines how we load the model, load in all the data. With weights_only the stats are not unpickled and,
+    on the CPU, the parameters are memory-mapped straight from the checkpoint instead of copied.
     """
-    def load(self, load_dir, device):
+    def load(self, load_dir, device, weights_only = False):
+        if is_checkpoint(load_dir):
+            metadata, state_dict = load_checkpoint(load_dir, device)
+            assert(self.num_classes == metadata["num_classes"]), "wrong number of classes"
+            if weights_only and torch.device(device).type == "cpu":
+                self.load_state_dict(state_dict, assign = True)
+            else:
+                self.load_state_dict(state_dict)
+
+            stats = None if weights_only else load_stats(load_dir, device)
+            if stats is not None:
+                self.train_stats, self.test_stats = stats
+                self.stats = {"train": self.train_stats, "test": self.test_stats}
+            return
+
+        # pickled checkpoints from before the weights/stats split
         with open(load_dir, 'rb') as f:
             [state_dict, self.train_stats, 
             self.test_stats, num_classes] = torch.load(f, map_location = device)
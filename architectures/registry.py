@@ -0,0 +1,40 @@
+import importlib
+
+"""
+Lazy registry of the networks keyed by name. A network module (and everything it imports) is only loaded when
+the network is first asked for, so tools that only need one network do not pay for importing all of them.
+"""
+
+NETWORK_MODULES = {"network1": ("architectures.network1", "Network_1"),
+                   "network2": ("architectures.network2", "Network_2"),
+                   "network3": ("architectures.network3", "Network_3"),
+                   "network4": ("architectures.network4", "Network_4"),
+                   "network5": ("architectures.network5", "Network_5"),
+                   "network6": ("architectures.network6", "Network_6"),
+                   "network7": ("architectures.network7", "Network_7"),
+                   "network8": ("architectures.network8", "Network_8")}
+
+
+def network_names():
+    return sorted(NETWORK_MODULES)
+
+
+def get_network(name):
+    """
+    Returns the network class registered under name, e.g. get_network("network7") -> Network_7.
+    """
+    if name not in NETWORK_MODULES:
+        raise KeyError("Unknown network {}, expected one of {}".format(name, ", ".join(network_names())))
+    module_name, class_name = NETWORK_MODULES[name]
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def network_name_from_path(path):
+    """
+    Models are stored as models/<network name>/<file>, so the second folder of a path names its network.
+    Returns None if the path does not contain a registered network.
+    """
+    parts = path.split("/")
+    if len(parts) > 1 and parts[1] in NETWORK_MODULES:
+        return parts[1]
+    return None
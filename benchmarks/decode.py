@@ -0,0 +1,60 @@
+import numpy as np
+import argparse
+import time
+
+from utils.data_loading import make_dataset, pil_loader, pil_black_and_white_loader
+
+"""
+Measures decode time per frame of the image and label loaders at full resolution, at each draft mode
+scale and for a crop region.
+
+    python -m benchmarks.decode <image_dir>/train <label_dir>/train --frames 200
+"""
+
+SCALES = [1, 2, 4, 8]
+
+
+def time_loader(samples, loader_kwargs):
+    """
+    Returns the mean (image, label) decode time in milliseconds over samples.
+    """
+    image_time, label_time = 0., 0.
+    for sample_path, target_path in samples:
+        start = time.time()
+        np.asarray(pil_loader(sample_path, **loader_kwargs))
+        image_time += time.time() - start
+
+        start = time.time()
+        np.asarray(pil_black_and_white_loader(target_path, **loader_kwargs))
+        label_time += time.time() - start
+    return 1000 * image_time / len(samples), 1000 * label_time / len(samples)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Benchmark image and label decoding at reduced resolutions')
+    parser.add_argument('image_dir', type = str, help = "directory of .jpg frames")
+    parser.add_argument('label_dir', type = str, help = "directory of _drivable_id.png labels")
+    parser.add_argument('--frames', type = int, default = 100, help = "number of frames to decode per setting")
+    parser.add_argument('--crop', type = int, nargs = 2, metavar = ("WIDTH", "HEIGHT"), default = [640, 360],
+                        help = "size of the crop region to benchmark, in full frame pixels")
+    parser.add_argument('--width', type = int, default = 1280)
+    parser.add_argument('--height', type = int, default = 720)
+    args = parser.parse_args()
+
+    samples = make_dataset(args.image_dir, args.label_dir)[:args.frames]
+    if len(samples) == 0:
+        raise RuntimeError("Found 0 image/label pairs in " + args.image_dir)
+    pil_loader(samples[0][0])  # warm up the file cache
+
+    crop_box = ((args.width - args.crop[0]) // 2, args.height - args.crop[1], (args.width + args.crop[0]) // 2, args.height)
+    settings = [("1/{}".format(scale), {"size": (args.width // scale, args.height // scale)}) for scale in SCALES]
+    settings[0] = ("full", {})
+    settings.append(("crop {}x{}".format(*args.crop), {"box": crop_box}))
+    settings.append(("crop 1/2", {"size": (args.width // 2, args.height // 2), "box": crop_box}))
+
+    print('\n setting       | image ms/frame | label ms/frame | speedup')
+    baseline = None
+    for name, loader_kwargs in settings:
+        image_ms, label_ms = time_loader(samples, loader_kwargs)
+        baseline = baseline or image_ms + label_ms
+        print(' {:13s} | {:14.2f} | {:14.2f} | {:6.2f}x'.format(name, image_ms, label_ms, baseline / (image_ms + label_ms)))
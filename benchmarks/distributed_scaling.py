@@ -0,0 +1,85 @@
+import torch
+import torch.nn as nn
+import torch.optim as optim
+import torch.multiprocessing as mp
+from torch.utils.data import DataLoader, TensorDataset
+import argparse
+import time
+import os
+
+from training.distributed import init_distributed, cleanup_distributed, make_sampler, wrap_model, is_main_process
+from architectures.registry import get_network
+
+"""
+Measures how training throughput of Network_7/Network_8 scales with the number of gloo processes.
+Runs on random data so the numbers are not limited by image decoding.
+
+    python -m benchmarks.distributed_scaling --network network7 --procs 1 2 4
+"""
+
+SCALING_NETWORKS = ["network7", "network8"]
+
+
+def run_worker(rank, world_size, args, results):
+    init_distributed(backend = "gloo", init_method = "tcp://127.0.0.1:{}".format(args.port),
+                     rank = rank, world_size = world_size)
+    torch.manual_seed(0)
+    num_samples = args.iters * args.batch_size * world_size
+    raw = torch.zeros((num_samples, 1), dtype = torch.long)  # stands in for the raw image, unused by training
+    data = torch.randn((num_samples, 3, args.width, args.height))
+    target = torch.randint(0, args.num_classes, (num_samples, args.width, args.height))
+    dataset = TensorDataset(raw, data, target)
+    loader = DataLoader(dataset, batch_size = args.batch_size, sampler = make_sampler(dataset, shuffle = True))
+
+    model = get_network(args.network)("", args.num_classes)
+    model.set_logits_mode(True)
+    network = wrap_model(model)
+    optimizer = optim.Adam(model.parameters(), lr = .001)
+    loss_func = nn.CrossEntropyLoss()
+
+    network.train()
+    start = None
+    for batch_idx, (_, data, target) in enumerate(loader):
+        if batch_idx == args.warmup:
+            torch.distributed.barrier()
+            start = time.time()
+        optimizer.zero_grad()
+        loss = loss_func(network(data), target)
+        loss.backward()
+        optimizer.step()
+    torch.distributed.barrier()
+    elapsed = time.time() - start
+
+    if is_main_process():
+        timed_samples = (len(loader) - args.warmup) * args.batch_size * world_size
+        results[world_size] = timed_samples / elapsed
+    cleanup_distributed()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Benchmark data-parallel training across CPU processes')
+    parser.add_argument('--network', type = str, choices = SCALING_NETWORKS, default = "network7")
+    parser.add_argument('--procs', type = int, nargs = "+", default = [1, 2, 4], help = "process counts to benchmark")
+    parser.add_argument('--iters', type = int, default = 10, help = "batches per process")
+    parser.add_argument('--warmup', type = int, default = 2, help = "untimed batches per process")
+    parser.add_argument('--batch_size', type = int, default = 1)
+    parser.add_argument('--width', type = int, default = 1280)
+    parser.add_argument('--height', type = int, default = 720)
+    parser.add_argument('--two_class', '-2', action = "store_true", help = "benchmark the 2 class model")
+    parser.add_argument('--port', type = int, default = 29517)
+    args = parser.parse_args()
+    args.num_classes = 2 if args.two_class else 3
+
+    if args.network == "network8" and (args.batch_size, args.width, args.height) != (1, 1280, 720):
+        raise ValueError("network8 only supports a batch size of 1 at 1280 x 720")
+
+    results = mp.Manager().dict()
+    for num_procs in args.procs:
+        os.environ["LOCAL_WORLD_SIZE"] = str(num_procs)
+        mp.spawn(run_worker, args = (num_procs, args, results), nprocs = num_procs, join = True)
+        args.port += 1  # avoid waiting on the previous group's socket
+
+    print('\n processes | samples/sec | speedup | efficiency')
+    for num_procs in args.procs:
+        speedup = results[num_procs] / results[args.procs[0]] * args.procs[0]
+        print(' {:9d} | {:11.2f} | {:7.2f} | {:9.0f}%'.format(num_procs, results[num_procs], speedup, 100 * speedup / num_procs))
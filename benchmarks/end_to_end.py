@@ -0,0 +1,219 @@
+import torch
+import torch.nn as nn
+import torch.optim as optim
+import numpy as np
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from architectures.registry import get_network
+from benchmarks.synthetic_data import write_synthetic_dataset
+from training.metrics import confusion_matrix
+from training.segmentation_trainer import get_per_class_accuracy
+from utils.data_loading import make_dataset, load_datasets
+from utils.loader_factory import make_loader
+
+"""
+End-to-end performance suite on a synthetic BDD100K-like dataset (benchmarks/synthetic_data.py), so the numbers
+do not depend on access to the real data. It measures every step a training or evaluation run goes through:
+
+    scan        make_dataset over the train folder
+    decode      DeepDriveDataset.__getitem__ (JPEG/PNG decode and transform)
+    loader      DataLoader throughput at each worker count
+    <network>   forward and forward + backward + step per network, at 1280 x 720
+    metrics     the trainer's confusion bookkeeping and the vectorized confusion_matrix
+    crf         dense CRF on one frame (skipped without pydensecrf)
+    checkpoint  NetworkBase save and load
+
+Results are written as JSON ({name: {"value", "unit", "better"}}) and compared against a stored baseline:
+
+    python -m benchmarks.end_to_end                     # check against benchmarks/end_to_end_baseline.json
+    python -m benchmarks.end_to_end --update            # record a new baseline on this machine
+    python -m benchmarks.end_to_end --out results.json --networks network7 network8
+
+Timings depend on the machine, so no baseline is committed. Without one (or without an entry for a result) the
+check fails until a baseline is recorded with --update.
+"""
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "end_to_end_baseline.json")
+DEFAULT_NETWORKS = ["network5", "network7", "network8"]
+
+
+def timed(function, repeats, warmup = 1):
+    """
+    Returns the median seconds of function() over repeats calls, after warmup untimed calls.
+    """
+    for _ in range(warmup):
+        function()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+def result(value, unit, better = "lower"):
+    return {"value": value, "unit": unit, "better": better}
+
+
+def benchmark_data(image_dir, label_dir, repeats, worker_counts):
+    results = {}
+    results["scan"] = result(1000 * timed(lambda: make_dataset(image_dir + "/train", label_dir + "/train"), repeats), "ms")
+
+    train_dataset, _ = load_datasets(image_dir, label_dir, num_classes = 3)
+    index = iter(range(10**9))
+    results["decode"] = result(1000 * timed(lambda: train_dataset[next(index) % len(train_dataset)], repeats * 4), "ms/sample")
+
+    for num_workers in worker_counts:
+        loader = make_loader(train_dataset, batch_size = 1, shuffle = True, num_workers = num_workers)
+        start = time.perf_counter()
+        seen = sum(len(batch[0]) for batch in loader)
+        results["loader/{}_workers".format(num_workers)] = result(seen / (time.perf_counter() - start), "samples/s", "higher")
+    return results
+
+
+def benchmark_network(name, num_classes, repeats, device):
+    model = get_network(name)("", num_classes).to(device)
+    model.set_logits_mode(True)
+    data = torch.randn((1, 3, 1280, 720), device = device)
+    target = torch.randint(0, num_classes, (1, 1280, 720), device = device)
+    optimizer = optim.Adam(model.parameters(), lr = .001)
+    loss_func = nn.CrossEntropyLoss()
+
+    def synchronize():
+        if device == "cuda":
+            torch.cuda.synchronize()
+
+    def forward():
+        with torch.no_grad():
+            model(data)
+        synchronize()
+
+    def train_step():
+        optimizer.zero_grad()
+        loss_func(model(data), target).backward()
+        optimizer.step()
+        synchronize()
+
+    model.eval()
+    forward_ms = 1000 * timed(forward, repeats)
+    model.train()
+    train_ms = 1000 * timed(train_step, repeats)
+    return {name + "/forward": result(forward_ms, "ms"), name + "/train_step": result(train_ms, "ms")}, model
+
+
+def benchmark_metrics(num_classes, repeats):
+    pred = torch.randint(0, num_classes, (1, 1280, 720))
+    target = torch.randint(0, num_classes, (1, 1280, 720))
+    confusion = np.zeros((num_classes, num_classes))
+    return {"metrics/trainer_confusion": result(1000 * timed(lambda: get_per_class_accuracy(pred, target, confusion), repeats), "ms"),
+            "metrics/confusion_matrix": result(1000 * timed(lambda: confusion_matrix(pred.numpy(), target.numpy(), num_classes), repeats), "ms")}
+
+
+def benchmark_crf(num_classes, repeats):
+    try:
+        from utils.crf import crf_postprocessing
+    except ImportError:
+        return {}
+    image = np.random.randint(0, 256, (3, 1280, 720)).astype(np.uint8)
+    probabilities = np.random.dirichlet(np.ones(num_classes), (1280, 720)).transpose(2, 0, 1).astype(np.float32)
+    probabilities = np.ascontiguousarray(probabilities)
+    return {"crf": result(1000 * timed(lambda: crf_postprocessing(image, probabilities, num_classes), repeats), "ms")}
+
+
+def benchmark_checkpoint(model, repeats, work_dir):
+    model.save_dir = os.path.join(work_dir, "models", "checkpoint")
+    os.makedirs(os.path.dirname(model.save_dir), exist_ok = True)
+    save_ms = 1000 * timed(model.save, repeats)
+    load_ms = 1000 * timed(lambda: model.load(model.save_dir, "cpu"), repeats)
+    weights_ms = 1000 * timed(lambda: model.load(model.save_dir, "cpu", weights_only = True), repeats)
+    return {"checkpoint/save": result(save_ms, "ms"), "checkpoint/load": result(load_ms, "ms"),
+            "checkpoint/load_weights_only": result(weights_ms, "ms")}
+
+
+def compare(results, baseline, tolerance):
+    """
+    Returns a message for every result that is more than tolerance worse than its baseline or has no baseline.
+    """
+    failures = []
+    for name, entry in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            failures.append("{} has no baseline, record one with --update".format(name))
+            continue
+        if entry["better"] == "lower":
+            regressed = entry["value"] > reference["value"] * (1 + tolerance)
+        else:
+            regressed = entry["value"] < reference["value"] / (1 + tolerance)
+        if regressed:
+            failures.append("{}: {:.2f} {}, baseline is {:.2f}".format(name, entry["value"], entry["unit"], reference["value"]))
+    return failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'End-to-end benchmark suite on synthetic BDD-like data')
+    parser.add_argument('--data-dir', dest = "data_dir", type = str, default = None,
+                        help = "reuse a synthetic dataset here (generated if missing), a temporary one otherwise")
+    parser.add_argument('--train', type = int, default = 32, help = "synthetic train frames")
+    parser.add_argument('--val', type = int, default = 8, help = "synthetic val frames")
+    parser.add_argument('--networks', type = str, nargs = "+", default = DEFAULT_NETWORKS)
+    parser.add_argument('--workers', type = int, nargs = "+", default = [0, 2])
+    parser.add_argument('--repeats', type = int, default = 5)
+    parser.add_argument('--cuda', '-c', action = "store_true")
+    parser.add_argument('--out', type = str, default = None, help = "write the results to this JSON file")
+    parser.add_argument('--baseline', type = str, default = BASELINE_FILE)
+    parser.add_argument('--tolerance', type = float, default = .25, help = "allowed slowdown relative to the baseline")
+    parser.add_argument('--update', action = "store_true", help = "store the results as the new baseline")
+    args = parser.parse_args()
+    device = "cuda" if args.cuda else "cpu"
+    num_classes = 3
+
+    work_dir = tempfile.mkdtemp(prefix = "deepdrive_bench_")
+    data_dir = args.data_dir or os.path.join(work_dir, "data")
+    image_dir = os.path.join(data_dir, "images", "100k")
+    label_dir = os.path.join(data_dir, "drivable_maps", "labels")
+    if not os.path.isdir(os.path.join(image_dir, "train")):
+        print("Generating {} + {} synthetic frames in {}".format(args.train, args.val, data_dir))
+        write_synthetic_dataset(data_dir, (("train", args.train), ("val", args.val)))
+
+    try:
+        results = benchmark_data(image_dir, label_dir, args.repeats, args.workers)
+        model = None
+        for name in args.networks:
+            network_results, model = benchmark_network(name, num_classes, args.repeats, device)
+            results.update(network_results)
+        results.update(benchmark_metrics(num_classes, args.repeats))
+        results.update(benchmark_crf(num_classes, args.repeats))
+        if model is not None:
+            results.update(benchmark_checkpoint(model.cpu(), args.repeats, work_dir))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors = True)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    print('\n Benchmark                      |      Value | Unit      |   Baseline')
+    for name, entry in results.items():
+        reference = baseline.get(name)
+        print(' {:30s} | {:10.2f} | {:9s} | {:>10s}'.format(name, entry["value"], entry["unit"],
+              "{:.2f}".format(reference["value"]) if reference else "n/a"))
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent = 2, sort_keys = True)
+    failures = [] if args.update else compare(results, baseline, args.tolerance)
+    if args.update:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent = 2, sort_keys = True)
+        print("Wrote baseline to " + args.baseline)
+
+    for failure in failures:
+        print(failure)
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,52 @@
+import torch
+import argparse
+import tempfile
+import time
+import os
+
+from architectures.registry import get_network, network_names
+from inference.export import export_network
+from inference.runtime import ExportedModel
+
+"""
+Compares the latency of eager and exported (frozen TorchScript) networks on the CPU.
+
+    python -m benchmarks.export_latency --networks network7 network8 --batch_sizes 1 8
+"""
+
+def time_forward(forward, data, iters, warmup = 2):
+    with torch.no_grad():
+        for _ in range(warmup):
+            forward(data)
+        start = time.time()
+        for _ in range(iters):
+            forward(data)
+    return 1000 * (time.time() - start) / iters
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Benchmark eager against exported network latency')
+    parser.add_argument('--networks', type = str, nargs = "+", choices = network_names(), default = ["network5", "network7", "network8"])
+    parser.add_argument('--batch_sizes', type = int, nargs = "+", default = [1, 8])
+    parser.add_argument('--iters', type = int, default = 5)
+    parser.add_argument('--two_class', '-2', action = "store_true")
+    args = parser.parse_args()
+    num_classes = 2 if args.two_class else 3
+
+    print('\n Network  | Batch | Eager ms | Exported ms | Speedup')
+    for name in args.networks:
+        model = get_network(name)("", num_classes)
+        model.eval()
+        for batch_size in args.batch_sizes:
+            if name == "network8" and batch_size != 1:
+                print(' {:8s} | {:5d} |      n/a |         n/a | network8 only supports a batch size of 1'.format(name, batch_size))
+                continue
+            data = torch.randn((batch_size, 3, 1280, 720))
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                path = os.path.join(tmp_dir, name + ".pt")
+                export_network(model, path, {"network": name, "num_classes": num_classes}, batch_size = batch_size)
+                exported = ExportedModel(path)
+                model.set_logits_mode(False)
+                eager_ms = time_forward(model, data, args.iters)
+                exported_ms = time_forward(exported, data, args.iters)
+            print(' {:8s} | {:5d} | {:8.1f} | {:11.1f} | {:6.2f}x'.format(name, batch_size, eager_ms, exported_ms, eager_ms / exported_ms))
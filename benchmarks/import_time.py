@@ -0,0 +1,84 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+"""
+Guards process start-up time. Imports each entry point in a fresh interpreter, reports the best of several
+cold-start times, checks that heavy optional modules were not pulled in, and compares against a stored baseline.
+
+    python -m benchmarks.import_time            # check against benchmarks/import_baseline.json
+    python -m benchmarks.import_time --update   # record a new baseline on this machine
+
+Timings depend on the machine, so no baseline is committed. Without one (or without an entry for a module) the
+check fails until a baseline is recorded with --update.
+"""
+
+ENTRY_POINTS = ["training_main", "get_stats", "architectures.registry", "inference.runtime", "training.segmentation_trainer"]
+
+# modules that must only be imported at first use
+LAZY_MODULES = ["matplotlib", "pydensecrf", "IPython", "dill", "architectures.network1", "architectures.network5",
+                "architectures.network7", "architectures.network8"]
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "import_baseline.json")
+
+MEASURE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps([elapsed, [name for name in {lazy} if name in sys.modules]]))
+"""
+
+
+def measure(module, repeats):
+    """
+    Returns the fastest import time in seconds of module over repeats fresh interpreters, and the lazy
+    modules it imported.
+    """
+    best, loaded = None, []
+    for _ in range(repeats):
+        output = subprocess.check_output([sys.executable, "-c", MEASURE.format(module = module, lazy = LAZY_MODULES)],
+                                         cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        elapsed, loaded = json.loads(output.decode().strip().splitlines()[-1])
+        best = elapsed if best is None else min(best, elapsed)
+    return best, loaded
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Benchmark cold-start import time of the entry points')
+    parser.add_argument('--repeats', type = int, default = 5)
+    parser.add_argument('--tolerance', type = float, default = .25, help = "allowed slowdown relative to the baseline")
+    parser.add_argument('--update', action = "store_true", help = "store the measured times as the new baseline")
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE) as f:
+            baseline = json.load(f)
+
+    results, failures = {}, []
+    print('\n Module                         | Import (ms) | Baseline (ms) | Eager lazy modules')
+    for module in ENTRY_POINTS:
+        elapsed, loaded = measure(module, args.repeats)
+        results[module] = elapsed
+        reference = baseline.get(module)
+        print(' {:30s} | {:11.1f} | {:>13s} | {}'.format(module, 1000 * elapsed,
+              "{:.1f}".format(1000 * reference) if reference else "n/a", ", ".join(loaded) or "-"))
+
+        if loaded:
+            failures.append("{} eagerly imports {}".format(module, ", ".join(loaded)))
+        if reference is None and not args.update:
+            failures.append("{} has no baseline in {}, record one with --update".format(module, BASELINE_FILE))
+        elif reference and not args.update and elapsed > reference * (1 + args.tolerance):
+            failures.append("{} takes {:.1f} ms to import, baseline is {:.1f} ms".format(module, 1000 * elapsed, 1000 * reference))
+
+    if args.update:
+        with open(BASELINE_FILE, "w") as f:
+            json.dump(results, f, indent = 2, sort_keys = True)
+        print("Wrote baseline to " + BASELINE_FILE)
+
+    for failure in failures:
+        print(failure)
+    sys.exit(1 if failures else 0)
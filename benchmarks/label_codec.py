@@ -0,0 +1,60 @@
+import numpy as np
+import argparse
+import io
+import os
+import time
+
+from PIL import Image
+
+from utils.label_codec import METHODS, encode_label, decode_label
+from utils.data_loading import pil_label_decode
+
+"""
+Compares the size and decode time of drivable-map labels stored as PNG and in each utils/label_codec encoding.
+Decode times include the conversion to the int64 array the trainer uses.
+
+    python -m benchmarks.label_codec <drivable_maps/labels>/val --frames 200
+"""
+
+
+def time_decode(buffers, decode):
+    start = time.time()
+    for buffer in buffers:
+        decode(buffer)
+    return 1000 * (time.time() - start) / len(buffers)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Benchmark compact label encodings against PNG')
+    parser.add_argument('label_dir', type = str, help = "directory of _drivable_id.png labels")
+    parser.add_argument('--frames', type = int, default = 200)
+    parser.add_argument('--two_class', '-2', action = "store_true", help = "merge the drivable classes first, like preprocess_two_classes")
+    args = parser.parse_args()
+
+    names = sorted(name for name in os.listdir(args.label_dir) if name.endswith(".png"))[:args.frames]
+    if len(names) == 0:
+        raise RuntimeError("Found 0 labels in " + args.label_dir)
+    labels = [np.array(Image.open(os.path.join(args.label_dir, name)), dtype = np.uint8) for name in names]
+    if args.two_class:
+        labels = [(label != 0).astype(np.uint8) for label in labels]
+
+    png_buffers = []
+    for label in labels:
+        buffer = io.BytesIO()
+        Image.fromarray(label).save(buffer, format = "PNG")
+        png_buffers.append(buffer.getvalue())
+    raw_bytes = labels[0].size
+
+    print('\n format | KB/frame | ratio to raw | decode ms/frame')
+    png_ms = time_decode(png_buffers, lambda buffer: np.array(pil_label_decode(io.BytesIO(buffer)), dtype = np.int64))
+    print(' {:6s} | {:8.1f} | {:12.3f} | {:15.3f}'.format("png", np.mean([len(b) for b in png_buffers]) / 1024.,
+          np.mean([len(b) for b in png_buffers]) / raw_bytes, png_ms))
+
+    for method in [None] + METHODS:
+        if method == "bits" and max(label.max() for label in labels) > 1:
+            continue
+        buffers = [encode_label(label, method) for label in labels]
+        assert all((decode_label(buffer) == label).all() for buffer, label in zip(buffers, labels))
+        decode_ms = time_decode(buffers, lambda buffer: decode_label(buffer, np.int64))
+        size = np.mean([len(buffer) for buffer in buffers])
+        print(' {:6s} | {:8.1f} | {:12.3f} | {:15.3f}'.format(method or "auto", size / 1024., size / raw_bytes, decode_ms))
@@ -0,0 +1,72 @@
+import argparse
+import time
+
+from utils.data_loading import DeepDriveDataset, normalize_pixel_values
+from utils.loader_factory import make_loader
+from utils.shard_dataset import ShardDataset
+
+"""
+Compares samples/sec of the folder DeepDriveDataset against the tar ShardDataset for the same split. Network
+filesystems are simulated on a local disk by sleeping --open-latency ms for every file opened: two per sample for
+the folder loader, one per shard for the shard loader.
+
+    python -m utils.shard_dataset <images/100k> <labels> <shards> --splits val
+    python -m benchmarks.shard_throughput <images/100k>/val <labels>/val <shards>/val --open-latency 5 --workers 0 4
+"""
+
+
+class LatentFolderDataset(DeepDriveDataset):
+    def __init__(self, image_dir, label_dir, open_latency, **kwargs):
+        super(LatentFolderDataset, self).__init__(image_dir, label_dir, **kwargs)
+        self.open_latency = open_latency
+
+    def __getitem__(self, index):
+        time.sleep(2 * self.open_latency)
+        return super(LatentFolderDataset, self).__getitem__(index)
+
+
+class LatentShardDataset(ShardDataset):
+    def __init__(self, shard_dir, open_latency, **kwargs):
+        super(LatentShardDataset, self).__init__(shard_dir, **kwargs)
+        self.open_latency = open_latency
+
+    def read_shard(self, path):
+        time.sleep(self.open_latency)
+        return super(LatentShardDataset, self).read_shard(path)
+
+
+def throughput(dataset, num_workers, batch_size, max_samples):
+    """
+    Returns samples/sec over the first max_samples samples of a shuffled pass, including worker start up.
+    """
+    loader = make_loader(dataset, batch_size = batch_size, shuffle = isinstance(dataset, DeepDriveDataset), num_workers = num_workers)
+    seen = 0
+    start = time.time()
+    for raw_samples, _, _ in loader:
+        seen += len(raw_samples)
+        if seen >= max_samples:
+            break
+    return seen / (time.time() - start)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Benchmark the folder loader against tar shards')
+    parser.add_argument('image_dir', type = str, help = "directory of .jpg frames")
+    parser.add_argument('label_dir', type = str, help = "directory of _drivable_id.png labels")
+    parser.add_argument('shard_dir', type = str, help = "shards of the same split, written by utils.shard_dataset")
+    parser.add_argument('--samples', type = int, default = 500, help = "samples read per setting")
+    parser.add_argument('--batch_size', type = int, default = 1)
+    parser.add_argument('--workers', type = int, nargs = "+", default = [0, 4])
+    parser.add_argument('--open-latency', dest = "open_latency", type = float, default = 0., help = "simulated ms per file open")
+    parser.add_argument('--buffer-size', dest = "buffer_size", type = int, default = 100)
+    args = parser.parse_args()
+    latency = args.open_latency / 1000.
+
+    folder = LatentFolderDataset(args.image_dir, args.label_dir, latency, transform = normalize_pixel_values)
+    shards = LatentShardDataset(args.shard_dir, latency, transform = normalize_pixel_values, shuffle = True, buffer_size = args.buffer_size)
+
+    print('\n workers | folder samples/sec | shard samples/sec | speedup')
+    for num_workers in args.workers:
+        folder_rate = throughput(folder, num_workers, args.batch_size, args.samples)
+        shard_rate = throughput(shards, num_workers, args.batch_size, args.samples)
+        print(' {:7d} | {:18.2f} | {:17.2f} | {:6.2f}x'.format(num_workers, folder_rate, shard_rate, shard_rate / folder_rate))
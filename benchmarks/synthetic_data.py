@@ -0,0 +1,78 @@
+import numpy as np
+import argparse
+import os
+
+from PIL import Image
+
+"""
+Generates a small BDD100K look-alike so the benchmarks run anywhere. Frames are 1280 x 720 JPEGs of a sky gradient,
+a textured road trapezoid with lane markings and noise, and labels are _drivable_id.png maps with background (0), the
+other lanes (1) and the current lane (2), the class order DeepDriveDataset documents, in the same folder layout as the
+real data:
+
+    <root>/images/100k/{train,val}/<name>.jpg
+    <root>/drivable_maps/labels/{train,val}/<name>_drivable_id.png
+
+    python -m benchmarks.synthetic_data /tmp/bdd_synthetic --train 64 --val 16
+"""
+
+WIDTH, HEIGHT = 1280, 720
+
+
+def synthetic_frame(rng):
+    """
+    Returns a (uint8 image (height, width, 3), uint8 label (height, width)) pair with a randomly placed road.
+    """
+    rows, columns = np.mgrid[0:HEIGHT, 0:WIDTH]
+    horizon = rng.randint(300, 420)
+    center = WIDTH / 2. + rng.uniform(-150, 150)
+    # half width of the road grows linearly from the horizon to the bottom of the frame
+    depth = np.clip((rows - horizon) / float(HEIGHT - horizon), 0, 1)
+    road_half_width = depth * rng.uniform(500, 800)
+    lane_half_width = road_half_width / 3.
+    offset = np.abs(columns - center)
+
+    label = np.zeros((HEIGHT, WIDTH), dtype = np.uint8)
+    label[(rows > horizon) & (offset < road_half_width)] = 1
+    label[(rows > horizon) & (offset < lane_half_width)] = 2
+
+    image = np.empty((HEIGHT, WIDTH, 3), dtype = np.float32)
+    sky = np.linspace(200, 120, HEIGHT)[:, None]
+    image[:] = np.stack([sky * .8, sky * .9, sky + 30], axis = 2)
+    image[rows > horizon] = rng.uniform(60, 110, 3)  # grass / buildings
+    road = label > 0
+    image[road] = rng.uniform(70, 100)
+    markings = road & (np.abs(offset - lane_half_width) < 1 + 4 * depth)
+    image[markings] = 230
+    image += rng.normal(0, 12, image.shape)
+    return np.clip(image, 0, 255).astype(np.uint8), label
+
+
+def write_synthetic_dataset(root, splits = (("train", 64), ("val", 16)), seed = 0, quality = 90):
+    """
+    Writes the frames and labels under root and returns (image_dir, label_dir) as load_datasets expects them.
+    """
+    rng = np.random.RandomState(seed)
+    image_dir = os.path.join(root, "images", "100k")
+    label_dir = os.path.join(root, "drivable_maps", "labels")
+    for split, count in splits:
+        os.makedirs(os.path.join(image_dir, split), exist_ok = True)
+        os.makedirs(os.path.join(label_dir, split), exist_ok = True)
+        for index in range(count):
+            name = "{}-{:07d}".format(split, index)
+            image, label = synthetic_frame(rng)
+            Image.fromarray(image).save(os.path.join(image_dir, split, name + ".jpg"), quality = quality)
+            Image.fromarray(label).save(os.path.join(label_dir, split, name + "_drivable_id.png"))
+    return image_dir, label_dir
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Generate a synthetic BDD100K-like dataset')
+    parser.add_argument('root', type = str, help = "directory to write images/ and drivable_maps/ to")
+    parser.add_argument('--train', type = int, default = 64)
+    parser.add_argument('--val', type = int, default = 16)
+    parser.add_argument('--seed', type = int, default = 0)
+    args = parser.parse_args()
+
+    image_dir, label_dir = write_synthetic_dataset(args.root, (("train", args.train), ("val", args.val)), args.seed)
+    print("wrote {} train and {} val frames to {} and {}".format(args.train, args.val, image_dir, label_dir))
@@ -3,26 +3,11 @@ import torch.nn as nn
 import torch.optim as optim
 import torch.nn.functional as F
 from torch.utils.data import DataLoader
-import matplotlib.pyplot as plt
 import numpy as np
 import sys
 import argparse
-import subprocess
-from tqdm import tqdm
 
-from utils.data_loading import DeepDriveDataset, load_datasets
-from training.segmentation_trainer import SegmentationTrainer
-
-from architectures.network1 import Network_1
-from architectures.network2 import Network_2
-from architectures.network3 import Network_3
-from architectures.network4 import Network_4
-from architectures.network5 import Network_5
-from architectures.network6 import Network_6
-from architectures.network7 import Network_7
-from architectures.network8 import Network_8
-from utils.data_stats import DataStats
-from IPython import embed
+from architectures.registry import get_network, network_name_from_path
 
 
 """
@@ -44,28 +29,21 @@ if __name__ == '__main__':
     # ===================================================================================================
     print("Initializing FCN for Segmentation...")
     #intialize model
-    networks = {"network1": Network_1, "network2": Network_2, "network3": Network_3, "network4": Network_4,
-                "network5": Network_5, "network6": Network_6, "network7": Network_7, "network8": Network_8}
-    network = None
-    if args.load_dir:
-        if len(args.load_dir.split("/")) > 1:
-            network_key = args.load_dir.split("/")[1]
-            if network_key in networks:
-                network = networks[network_key]  # second subfolder contains network
-
-    if not network:
+    network_key = network_name_from_path(args.load_dir)  # second subfolder contains network
+    if not network_key:
         raise RuntimeError("Please specify a model folder in which to load the current model.")
 
-    model = network("", NUM_CLASSES)
+    model = get_network(network_key)("", NUM_CLASSES)
 
     if not args.load_dir == '':
         try:
-            segmentation_model.load(args.load_dir, "cpu")
+            model.load(args.load_dir, "cpu")
         except:
             print("Loading Legacy Model")
-            segmentation_model.legacy_load(args.load_dir, "cpu")
+            model.legacy_load(args.load_dir, "cpu")
 
     # ===================================================================================================
     # ===================================================================================================
 
+    from IPython import embed  # only needed once the model is loaded
     embed()
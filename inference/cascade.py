@@ -0,0 +1,172 @@
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+import argparse
+import json
+
+"""
+Cascaded inference: a cheap network (Network_8/Network_7) labels every frame and only frames, or tiles, it is unsure
+about are passed to a heavy network (Network_5/Network_6). Uncertainty is 1 - max softmax probability, averaged over
+the frame or tile.
+
+    python -m inference.cascade models/network8/FinalTrained models/network5/FinalTrained --threshold .05 --mode tile \
+        --image-dir <images/100k> --label-dir <drivable_maps/labels> --frames 500
+
+The report compares the cheap, heavy and cascaded models in ModelStats terms along with their forward time.
+"""
+
+CASCADE_MODES = ["frame", "tile"]
+DEFAULT_TILE_SIZE = (160, 144)  # (width, height), multiples of the 16x downsampling of the FCNs
+ALIGNMENT = 16
+
+
+def is_fully_convolutional(model):
+    """
+    False if model has fully connected layers (e.g. Network_8's full transition), which fix the input size.
+    """
+    return not any(isinstance(module, nn.Linear) for module in model.modules())
+
+
+def align_down(value):
+    return value // ALIGNMENT * ALIGNMENT
+
+
+def align_up(value, limit):
+    return min(-(-value // ALIGNMENT) * ALIGNMENT, limit)
+
+
+class CascadePredictor:
+    """
+    Args:
+        cheap_model (NetworkBase): runs on every frame, in logits mode
+        heavy_model (NetworkBase): runs on uncertain frames or regions, in logits mode. Tile mode needs a fully
+            convolutional network (not Network_8 with its full transition).
+        threshold (float): mean uncertainty above which a frame or tile is escalated
+        mode (string): "frame" escalates whole frames, "tile" runs the heavy model on the 16-aligned bounding box of
+            the uncertain tiles (plus margin pixels of context) and keeps its output for those tiles only
+    """
+    def __init__(self, cheap_model, heavy_model, threshold = .05, mode = "frame", tile_size = DEFAULT_TILE_SIZE, margin = 32):
+        if mode not in CASCADE_MODES:
+            raise ValueError("Expected mode to be one of {}, got {}".format(CASCADE_MODES, mode))
+        if cheap_model.num_classes != heavy_model.num_classes:
+            raise ValueError("Both models of a cascade must predict the same classes")
+        if mode == "tile" and not is_fully_convolutional(heavy_model):
+            raise ValueError("Tile mode runs the heavy model on cropped regions, which needs a fully convolutional network; "
+                             "{} has fully connected layers, use frame mode".format(type(heavy_model).__name__))
+        self.cheap_model = cheap_model
+        self.heavy_model = heavy_model
+        self.num_classes = cheap_model.num_classes
+        self.threshold = threshold
+        self.mode = mode
+        self.tile_size = tile_size
+        self.margin = margin
+        self.escalated_pixels = 0
+        self.total_pixels = 0
+
+    @property
+    def escalated_fraction(self):
+        return self.escalated_pixels / float(max(self.total_pixels, 1))
+
+    def __call__(self, data):
+        """
+        Returns log-probabilities for a (batch, 3, width, height) batch, dims = (batch, num_classes, width, height).
+        """
+        with torch.no_grad():
+            output = F.log_softmax(self.cheap_model(data), dim = 1)
+            uncertainty = 1. - torch.exp(output).max(dim = 1)[0]  # (batch, width, height)
+            self.total_pixels += uncertainty.numel()
+            if self.mode == "frame":
+                self.escalate_frames(data, output, uncertainty)
+            else:
+                for i in range(len(data)):
+                    self.escalate_tiles(data[i:i + 1], output[i:i + 1], uncertainty[i])
+        return output
+
+    def escalate_frames(self, data, output, uncertainty):
+        escalate = (uncertainty.mean(dim = (1, 2)) > self.threshold).nonzero().view(-1)
+        if len(escalate) > 0:
+            output[escalate] = F.log_softmax(self.heavy_model(data[escalate]), dim = 1)
+            self.escalated_pixels += len(escalate) * uncertainty[0].numel()
+
+    def escalate_tiles(self, data, output, uncertainty):
+        """
+        data and output hold one frame; uncertainty has dims (width, height).
+        """
+        width, height = uncertainty.shape
+        tile_width, tile_height = self.tile_size
+        tile_uncertainty = F.avg_pool2d(uncertainty[None, None], (tile_width, tile_height), ceil_mode = True)[0, 0]
+        tiles = (tile_uncertainty > self.threshold).nonzero().tolist()
+        if len(tiles) == 0:
+            return
+
+        columns, rows = [tile[0] for tile in tiles], [tile[1] for tile in tiles]
+        x0 = align_down(max(min(columns) * tile_width - self.margin, 0))
+        x1 = align_up(min((max(columns) + 1) * tile_width + self.margin, width), width)
+        y0 = align_down(max(min(rows) * tile_height - self.margin, 0))
+        y1 = align_up(min((max(rows) + 1) * tile_height + self.margin, height), height)
+        region = F.log_softmax(self.heavy_model(data[:, :, x0:x1, y0:y1]), dim = 1)
+
+        for i, j in tiles:
+            tx0, tx1 = i * tile_width, min((i + 1) * tile_width, width)
+            ty0, ty1 = j * tile_height, min((j + 1) * tile_height, height)
+            output[:, :, tx0:tx1, ty0:ty1] = region[:, :, tx0 - x0:tx1 - x0, ty0 - y0:ty1 - y0]
+            self.escalated_pixels += (tx1 - tx0) * (ty1 - ty0)
+
+
+if __name__ == '__main__':
+    from torch.utils.data import Subset
+
+    from inference.export import load_network
+    from training.multi_evaluation import ModelAccumulator, evaluate_models
+    from utils.data_loading import load_datasets
+    from utils.loader_factory import make_loader
+
+    parser = argparse.ArgumentParser(description = 'Evaluate a cheap -> heavy network cascade')
+    parser.add_argument('cheap', type = str, help = "checkpoint of the cheap model, e.g. models/network8/FinalTrained")
+    parser.add_argument('heavy', type = str, help = "checkpoint of the heavy model, e.g. models/network5/FinalTrained")
+    parser.add_argument('--image-dir', dest = "image_dir", type = str, required = True, help = "directory containing the train/val images")
+    parser.add_argument('--label-dir', dest = "label_dir", type = str, required = True, help = "directory containing the train/val labels")
+    parser.add_argument('--two_class', '-2', action = "store_true", help = "the models were trained on 2 classes")
+    parser.add_argument('--threshold', type = float, default = .05, help = "mean uncertainty above which frames/tiles are escalated")
+    parser.add_argument('--mode', type = str, choices = CASCADE_MODES, default = "frame")
+    parser.add_argument('--tile-size', dest = "tile_size", type = int, nargs = 2, metavar = ("WIDTH", "HEIGHT"), default = list(DEFAULT_TILE_SIZE))
+    parser.add_argument('--frames', type = int, default = None, help = "only evaluate the first frames of the validation set")
+    parser.add_argument('--batch_size', type = int, default = 1)
+    parser.add_argument('--workers', type = int, default = 4)
+    parser.add_argument('--cuda', '-c', action = "store_true")
+    parser.add_argument('--out', type = str, default = None, help = "write the report to this JSON file")
+    args = parser.parse_args()
+    device = "cuda" if args.cuda else "cpu"
+    num_classes = 2 if args.two_class else 3
+
+    models = []
+    for path in (args.cheap, args.heavy):
+        _, model = load_network(path, num_classes, device)
+        model.to(torch.device(device))
+        model.eval()
+        model.set_logits_mode(True)
+        models.append(model)
+    cascade = CascadePredictor(models[0], models[1], args.threshold, args.mode, tuple(args.tile_size))
+    accumulators = [ModelAccumulator("cheap: " + args.cheap, models[0], num_classes),
+                    ModelAccumulator("heavy: " + args.heavy, models[1], num_classes),
+                    ModelAccumulator("cascade ({} > {})".format(args.mode, args.threshold), cascade, num_classes)]
+
+    # 3 class labels, ModelAccumulator derives the 2 class target itself
+    _, test_dataset = load_datasets(args.image_dir, args.label_dir, num_classes = 3)
+    if args.frames is not None:
+        test_dataset = Subset(test_dataset, list(range(min(args.frames, len(test_dataset)))))
+    loader = make_loader(test_dataset, batch_size = args.batch_size, device = device, num_workers = args.workers)
+
+    results = evaluate_models(accumulators, loader, device)
+
+    print('\n Model                                    |  Loss  | Accuracy | Jaccard | Forward ms')
+    for result in results:
+        print(' {:40s} | {:6.4f} | {:7.2f}% | {:7.4f} | {:10.1f}'.format(result["model"], result["loss"], result["accuracy"],
+              result["jaccard"], result["forward_ms"]))
+    speedup = results[1]["forward_ms"] / max(results[2]["forward_ms"], 1e-9)
+    print(' escalated {:.1f}% of the pixels, {:.2f}x the heavy model throughput'.format(100 * cascade.escalated_fraction, speedup))
+    accumulators[2].stats.print_summary()
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"models": results, "escalated_fraction": cascade.escalated_fraction, "speedup": speedup}, f, indent = 2)
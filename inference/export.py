@@ -0,0 +1,87 @@
+import torch
+import argparse
+import json
+
+from architectures.registry import get_network, network_name_from_path
+from inference.runtime import ExportedModel, METADATA_FILE
+
+"""
+Exports a trained network to a frozen TorchScript file that inference/runtime.py can load on its own.
+
+    python -m inference.export models/network7/FinalTrained -o models/network7/FinalTrained.pt -2
+"""
+
+def load_network(load_dir, num_classes, device = "cpu"):
+    """
+    Builds the network named by the second folder of load_dir (e.g. models/network7/...) and loads its weights.
+    """
+    network_key = network_name_from_path(load_dir)
+    if not network_key:
+        raise RuntimeError("Please specify a model inside a models/<network> folder, got " + load_dir)
+
+    model = get_network(network_key)("", num_classes)
+    try:
+        model.load(load_dir, device, weights_only = True)
+    except:
+        print("Loading Legacy Model")
+        model.legacy_load(load_dir, device)
+    return network_key, model
+
+
+def export_network(model, outfile, metadata, batch_size = 1, width = 1280, height = 720, logits = False):
+    """
+    Traces the network (the python loops over sections unroll), freezes it so weights become constants and
+    are folded, and applies the inference graph optimizations.
+
+    Returns:
+        torch.jit.ScriptModule: the exported network
+    """
+    model.eval()
+    model.set_logits_mode(logits)
+    example = torch.randn((batch_size, 3, width, height))
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example)
+    frozen = torch.jit.optimize_for_inference(torch.jit.freeze(traced))
+
+    metadata = dict(metadata, batch_size = batch_size, width = width, height = height, logits = logits)
+    torch.jit.save(frozen, outfile, _extra_files = {METADATA_FILE: json.dumps(metadata)})
+    return frozen
+
+
+def max_difference(model, exported, num_checks = 2, batch_size = 1, width = 1280, height = 720):
+    """
+    Largest absolute difference between the eager and exported outputs, and the fraction of pixels whose
+    predicted class differs, over random inputs.
+    """
+    difference, disagreement = 0., 0.
+    with torch.no_grad():
+        for _ in range(num_checks):
+            data = torch.randn((batch_size, 3, width, height))
+            expected, actual = model(data), exported(data)
+            difference = max(difference, (expected - actual).abs().max().item())
+            disagreement = max(disagreement, (expected.argmax(dim = 1) != actual.argmax(dim = 1)).float().mean().item())
+    return difference, disagreement
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Export a trained network to frozen TorchScript for CPU inference')
+    parser.add_argument('load_dir', type = str, help = "checkpoint to export, inside a models/<network> folder")
+    parser.add_argument('--out', '-o', type = str, required = True, help = "file to write the exported network to")
+    parser.add_argument('--two_class', '-2', action = "store_true", help = "the model was trained on 2 classes")
+    parser.add_argument('--batch_size', type = int, default = 1, help = "batch size to trace with")
+    parser.add_argument('--logits', action = "store_true", help = "export raw logits instead of log-probabilities")
+    parser.add_argument('--tolerance', type = float, default = 1e-3, help = "max allowed difference to the eager model")
+    args = parser.parse_args()
+    num_classes = 2 if args.two_class else 3
+
+    network_key, model = load_network(args.load_dir, num_classes)
+    export_network(model, args.out, {"network": network_key, "num_classes": num_classes, "source": args.load_dir},
+                   batch_size = args.batch_size, logits = args.logits)
+
+    # check the artifact the way a serving host would load it
+    exported = ExportedModel(args.out)
+    difference, disagreement = max_difference(model, exported, batch_size = args.batch_size)
+    print("max abs difference: {:.2e}, pixels with a different class: {:.4f}%".format(difference, 100 * disagreement))
+    if difference > args.tolerance:
+        raise RuntimeError("Exported network differs from the eager model by {} > {}".format(difference, args.tolerance))
+    print("Exported {} to {}".format(args.load_dir, args.out))
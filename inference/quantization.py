@@ -0,0 +1,139 @@
+import torch
+import torch.nn.functional as F
+from torch.utils.data import DataLoader, Subset
+from torch.ao.quantization import get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+import numpy as np
+import argparse
+import copy
+import io
+import json
+import time
+
+from architectures.model_stats import ModelStats
+from inference.export import load_network
+from inference.runtime import METADATA_FILE
+from training.segmentation_trainer import get_per_class_accuracy
+from utils.data_loading import load_datasets
+
+"""
+Post-training static int8 quantization of the FCNs (Network_5, Network_7, Network_8). Uses FX graph mode, which
+traces the python loops over sections so the Conv2d, ConvTranspose2d and ReLU stacks and the skip connection
+torch.cat are quantized without changing the network classes. The quantized network outputs float logits.
+
+    python -m inference.quantization models/network7/FinalTrained -o models/network7/FinalTrained_int8.pt -2 \
+        --image-dir <images/100k> --label-dir <drivable_maps/labels>
+"""
+
+QUANTIZABLE_NETWORKS = ["network5", "network7", "network8"]
+
+
+def quantize_network(model, calibration_loader, backend = "x86"):
+    """
+    Args:
+        model (NetworkBase): trained fp32 network, left untouched
+        calibration_loader (DataLoader): DeepDriveDataset frames used to observe activation ranges
+        backend (string): "x86" (fbgemm) for servers, "qnnpack" for ARM hosts
+    Returns:
+        torch.fx.GraphModule: the int8 network, returning float logits
+    """
+    torch.backends.quantized.engine = "fbgemm" if backend == "x86" else backend
+    model = copy.deepcopy(model)
+    model.eval()
+    model.set_logits_mode(True)  # the log-softmax stays out of the int8 graph
+
+    _, example, _ = next(iter(calibration_loader))
+    prepared = prepare_fx(model, get_default_qconfig_mapping(backend), (example.float(),))
+    with torch.no_grad():
+        for _, data, _ in calibration_loader:
+            prepared(data.float())
+    return convert_fx(prepared)
+
+
+def evaluate(forward, loader, num_classes):
+    """
+    Returns ModelStats holding the confusion matrix, pixel accuracy and Jaccard accuracy of forward over loader.
+    """
+    stats = ModelStats(num_classes)
+    loss = 0.
+    with torch.no_grad():
+        for _, data, target in loader:
+            output = forward(data.float())
+            loss += F.cross_entropy(output, target).item()
+            get_per_class_accuracy(torch.argmax(output, dim = 1), target, stats.confusion)
+
+    correct = np.diagonal(stats.confusion)
+    union = stats.confusion.sum(axis = 0) + stats.confusion.sum(axis = 1) - correct
+    stats.loss.append(loss / len(loader))
+    stats.accuracy.append(100. * correct.sum() / stats.confusion.sum())
+    stats.jaccard_accuracy.append(np.mean(correct / np.maximum(union, 1)))
+    stats.per_class_accuracy.append(correct.copy())
+    return stats
+
+
+def model_size(model):
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell()
+
+
+def latency(forward, batch_size = 1, iters = 5, width = 1280, height = 720):
+    data = torch.randn((batch_size, 3, width, height))
+    with torch.no_grad():
+        forward(data)
+        start = time.time()
+        for _ in range(iters):
+            forward(data)
+    return 1000 * (time.time() - start) / iters
+
+
+def save_quantized(quantized, outfile, metadata, width = 1280, height = 720):
+    """
+    Writes the int8 network as frozen TorchScript, loadable with inference.runtime.ExportedModel.
+    """
+    with torch.no_grad():
+        traced = torch.jit.trace(quantized, torch.randn((1, 3, width, height)))
+    frozen = torch.jit.freeze(traced)
+    metadata = dict(metadata, batch_size = 1, width = width, height = height, logits = True, quantized = "int8")
+    torch.jit.save(frozen, outfile, _extra_files = {METADATA_FILE: json.dumps(metadata)})
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Static int8 quantization of the FCN architectures')
+    parser.add_argument('load_dir', type = str, help = "checkpoint to quantize, inside a models/<network> folder")
+    parser.add_argument('--out', '-o', type = str, required = True, help = "file to write the int8 TorchScript network to")
+    parser.add_argument('--image-dir', dest = "image_dir", type = str, required = True, help = "directory containing the train/val images")
+    parser.add_argument('--label-dir', dest = "label_dir", type = str, required = True, help = "directory containing the train/val labels")
+    parser.add_argument('--two_class', '-2', action = "store_true", help = "the model was trained on 2 classes")
+    parser.add_argument('--calibration-frames', dest = "calibration_frames", type = int, default = 300)
+    parser.add_argument('--eval-frames', dest = "eval_frames", type = int, default = 500)
+    parser.add_argument('--backend', type = str, choices = ["x86", "qnnpack"], default = "x86")
+    args = parser.parse_args()
+    num_classes = 2 if args.two_class else 3
+
+    network_key, model = load_network(args.load_dir, num_classes)
+    model.eval()
+    model.set_logits_mode(True)
+    if network_key not in QUANTIZABLE_NETWORKS:
+        raise RuntimeError("int8 quantization supports {}, got {}".format(", ".join(QUANTIZABLE_NETWORKS), network_key))
+
+    train_dataset, test_dataset = load_datasets(args.image_dir, args.label_dir, num_classes = num_classes)
+    calibration_indices = np.random.RandomState(0).choice(len(train_dataset), min(args.calibration_frames, len(train_dataset)), replace = False)
+    calibration_loader = DataLoader(Subset(train_dataset, calibration_indices.tolist()), batch_size = 1)
+    eval_loader = DataLoader(Subset(test_dataset, list(range(min(args.eval_frames, len(test_dataset))))), batch_size = 1)
+
+    print("Calibrating on {} frames...".format(len(calibration_indices)))
+    quantized = quantize_network(model, calibration_loader, args.backend)
+    save_quantized(quantized, args.out, {"network": network_key, "num_classes": num_classes, "source": args.load_dir})
+
+    print("Evaluating fp32 and int8 on {} frames...".format(len(eval_loader)))
+    results = [("fp32", model, evaluate(model, eval_loader, num_classes)),
+               ("int8", quantized, evaluate(quantized, eval_loader, num_classes))]
+
+    print('\n Model | Accuracy | Jaccard | Size (MB) | Latency (ms)')
+    for name, network, stats in results:
+        print(' {:5s} | {:7.2f}% | {:7.4f} | {:9.2f} | {:12.1f}'.format(name, stats.accuracy[-1], stats.jaccard_accuracy[-1],
+              model_size(network) / 2.**20, latency(network)))
+    for name, _, stats in results:
+        print("\n" + name)
+        stats.print_summary()
@@ -0,0 +1,64 @@
+import torch
+import numpy as np
+import json
+
+"""
+Lightweight runtime for networks written by inference/export.py. Only needs torch and numpy, so serving hosts
+do not have to import architectures/*, matplotlib or the training code.
+"""
+
+METADATA_FILE = "metadata.json"
+
+
+def preprocess(image):
+    """
+    Converts an RGB frame the same way the dataset does before it reaches the network.
+
+    Args:
+        image (np.array): uint8 array with dims (height, width, 3)
+    Returns:
+        torch.tensor: float tensor with dims (1, 3, width, height), each channel with its mean subtracted
+    """
+    image = np.asarray(image, dtype = np.float32)
+    image = image - image.mean(axis = (0, 1), keepdims = True)
+    return torch.from_numpy(np.ascontiguousarray(image.T))[None]
+
+
+class ExportedModel:
+    """
+    A frozen TorchScript network and the metadata it was exported with.
+
+    Args:
+        path (string): file written by inference/export.py
+        device (string): device to load the network on
+    """
+    def __init__(self, path, device = "cpu"):
+        extra_files = {METADATA_FILE: ""}
+        self.module = torch.jit.load(path, map_location = device, _extra_files = extra_files)
+        self.metadata = json.loads(extra_files[METADATA_FILE])
+        self.device = device
+        self.num_classes = self.metadata["num_classes"]
+
+    def __call__(self, data):
+        """
+        Returns the network output (log-probabilities, or logits if exported with --logits) for a
+        (batch, 3, width, height) tensor.
+        """
+        with torch.no_grad():
+            return self.module(data.to(self.device))
+
+    def predict(self, data):
+        """
+        Returns the predicted class of every pixel, dims = (batch, width, height).
+        """
+        return torch.argmax(self(data), dim = 1)
+
+    def predict_image(self, image):
+        return self.predict(preprocess(image))[0]
+
+    def save_prediction(self, image, path):
+        """
+        Predicts the mask of an RGB frame and writes it to path in the compact label format, see utils/label_codec.py.
+        """
+        from utils.label_codec import save_label  # only loaded by hosts that write masks, see the module docstring
+        save_label(path, self.predict_image(image).cpu().numpy().T)
@@ -0,0 +1,228 @@
+import torch
+import numpy as np
+import argparse
+import json
+import os
+import time
+
+from PIL import Image
+
+from inference.runtime import preprocess
+
+"""
+Streaming inference over a dashcam sequence (a video file or a directory of frames). Consecutive frames are nearly
+identical, so instead of running the full network on every frame:
+
+  - frame skipping: the network runs on every skip-th frame, and the frames in between get the last mask shifted by
+    the global camera motion (phase correlation on downscaled grey frames)
+  - deep feature reuse: networks with encode/decode (Network_5/6/7) keep the bottom transition output of a key
+    frame and only recompute the shallow sections feeding the skip connections while the frame stays close to the
+    key frame. The deep features are refreshed once the mean absolute change reaches refresh_threshold or after
+    max_reuse frames.
+
+    python -m inference.streaming models/network7/FinalTrained drive.mp4 --skip 2 --refresh-threshold 6 --frames 600
+
+runs the stream once with per-frame inference as the reference and once with the given settings, and reports
+frames/sec and the drift (agreement and Jaccard against the reference masks).
+"""
+
+FRAME_SIZE = (1280, 720)
+MOTION_SCALE = 8  # frames are downscaled by this much for motion and change estimates
+
+
+def frame_source(path, max_frames = None):
+    """
+    Yields uint8 RGB frames, dims = (height, width, 3), resized to FRAME_SIZE. Directories are read in sorted order;
+    video files need OpenCV.
+    """
+    if os.path.isdir(path):
+        names = sorted(name for name in os.listdir(path) if name.lower().endswith((".jpg", ".jpeg", ".png")))
+        frames = (Image.open(os.path.join(path, name)).convert('RGB') for name in names)
+    else:
+        try:
+            import cv2
+        except ImportError:
+            raise RuntimeError("Reading video files needs OpenCV (pip install opencv-python), or pass a directory of frames")
+        def read_video():
+            capture = cv2.VideoCapture(path)
+            while True:
+                ok, frame = capture.read()
+                if not ok:
+                    break
+                yield Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+            capture.release()
+        frames = read_video()
+
+    for index, frame in enumerate(frames):
+        if max_frames is not None and index >= max_frames:
+            break
+        if frame.size != FRAME_SIZE:
+            frame = frame.resize(FRAME_SIZE, Image.BILINEAR)
+        yield np.asarray(frame, dtype = np.uint8)
+
+
+def grey_thumbnail(frame):
+    return frame[::MOTION_SCALE, ::MOTION_SCALE].mean(axis = 2)
+
+
+def estimate_shift(previous, current):
+    """
+    Global translation (dy, dx) in full frame pixels such that current ~ previous moved by (dy, dx), from phase
+    correlation of two grey thumbnails.
+    """
+    cross_power = np.fft.fft2(current) * np.conj(np.fft.fft2(previous))
+    correlation = np.fft.ifft2(cross_power / (np.abs(cross_power) + 1e-9)).real
+    dy, dx = np.unravel_index(np.argmax(correlation), correlation.shape)
+    # peaks past the middle are negative shifts
+    dy = dy - correlation.shape[0] if dy > correlation.shape[0] // 2 else dy
+    dx = dx - correlation.shape[1] if dx > correlation.shape[1] // 2 else dx
+    return dy * MOTION_SCALE, dx * MOTION_SCALE
+
+
+def shift_mask(mask, dy, dx):
+    """
+    Moves a (width, height) mask by (dy, dx) image pixels, repeating the border into the uncovered area.
+    """
+    width, height = mask.shape
+    pad = ((max(dx, 0), max(-dx, 0)), (max(dy, 0), max(-dy, 0)))
+    padded = np.pad(mask, pad, mode = "edge")
+    x0, y0 = max(-dx, 0), max(-dy, 0)
+    return padded[x0:x0 + width, y0:y0 + height]
+
+
+class StreamingPredictor:
+    """
+    Args:
+        model (NetworkBase): network in logits mode; deep feature reuse needs encode/decode (Network_5/6/7)
+        device (string): device to run the network on
+        skip (int): run the network on every skip-th frame and propagate the mask to the others
+        refresh_threshold (float, optional): mean absolute grey level change (0-255) from the key frame below which
+            deep features are reused. No reuse if None.
+        max_reuse (int): refresh the deep features after this many frames regardless of the change
+    """
+    def __init__(self, model, device = "cpu", skip = 1, refresh_threshold = None, max_reuse = 10):
+        if refresh_threshold is not None and not hasattr(model, "encode"):
+            raise ValueError("{} has no encode/decode split, deep feature reuse needs Network_5/6/7".format(type(model).__name__))
+        self.model = model
+        self.device = device
+        self.skip = max(skip, 1)
+        self.refresh_threshold = refresh_threshold
+        self.max_reuse = max_reuse
+        self.reset()
+
+    def reset(self):
+        self.frame_index = 0
+        self.mask = None
+        self.last_thumbnail = None
+        self.deep_features = None
+        self.key_thumbnail = None
+        self.reuse_count = 0
+        self.counts = {"full": 0, "reused": 0, "propagated": 0}
+
+    def run_network(self, frame, thumbnail):
+        data = preprocess(frame).to(self.device)
+        with torch.no_grad():
+            if self.refresh_threshold is None:
+                self.counts["full"] += 1
+                output = self.model(data)
+            else:
+                change = np.inf if self.key_thumbnail is None else np.abs(thumbnail - self.key_thumbnail).mean()
+                if change < self.refresh_threshold and self.reuse_count < self.max_reuse:
+                    self.counts["reused"] += 1
+                    self.reuse_count += 1
+                    deep_features, skips = self.model.encode(data, self.deep_features)
+                else:
+                    self.counts["full"] += 1
+                    self.reuse_count = 0
+                    self.key_thumbnail = thumbnail
+                    deep_features, skips = self.model.encode(data)
+                    self.deep_features = deep_features
+                output = self.model.decode(deep_features, skips)
+        return torch.argmax(output, dim = 1)[0].cpu().numpy().astype(np.uint8)
+
+    def __call__(self, frame):
+        """
+        Returns the predicted mask of the next frame of the stream, dims = (width, height).
+        """
+        thumbnail = grey_thumbnail(frame)
+        if self.mask is None or self.frame_index % self.skip == 0:
+            self.mask = self.run_network(frame, thumbnail)
+        else:
+            self.counts["propagated"] += 1
+            dy, dx = estimate_shift(self.last_thumbnail, thumbnail)
+            self.mask = shift_mask(self.mask, dy, dx)
+        self.last_thumbnail = thumbnail
+        self.frame_index += 1
+        return self.mask
+
+
+def run_stream(predictor, frames):
+    """
+    Returns the masks of every frame and the frames/sec, frames being a list of decoded frames so that decoding is
+    not timed.
+    """
+    predictor.reset()
+    start = time.time()
+    masks = [predictor(frame) for frame in frames]
+    return masks, len(frames) / (time.time() - start)
+
+
+def drift_report(masks, reference_masks, num_classes):
+    """
+    Agreement of streamed masks with per-frame inference, overall and for the worst frame, and the mean Jaccard
+    with the reference masks as ground truth.
+    """
+    from training.metrics import confusion_matrix, summarize
+
+    confusion = np.zeros((num_classes, num_classes), dtype = np.int64)
+    agreement = []
+    for mask, reference in zip(masks, reference_masks):
+        confusion += confusion_matrix(mask, reference, num_classes)
+        agreement.append((mask == reference).mean())
+    accuracy, jaccard = summarize(confusion)
+    return {"agreement": accuracy / 100., "worst_frame_agreement": float(np.min(agreement)),
+            "worst_frame": int(np.argmin(agreement)), "jaccard": jaccard}
+
+
+if __name__ == '__main__':
+    from inference.export import load_network
+
+    parser = argparse.ArgumentParser(description = 'Streaming dashcam inference with frame skipping and feature reuse')
+    parser.add_argument('load_dir', type = str, help = "checkpoint to run, inside a models/<network> folder")
+    parser.add_argument('source', type = str, help = "video file or directory of frames")
+    parser.add_argument('--two_class', '-2', action = "store_true", help = "the model was trained on 2 classes")
+    parser.add_argument('--skip', type = int, default = 1, help = "run the network on every skip-th frame")
+    parser.add_argument('--refresh-threshold', dest = "refresh_threshold", type = float, default = None,
+                        help = "mean grey level change below which deep features are reused")
+    parser.add_argument('--max-reuse', dest = "max_reuse", type = int, default = 10)
+    parser.add_argument('--frames', type = int, default = 300)
+    parser.add_argument('--cuda', '-c', action = "store_true")
+    parser.add_argument('--out', type = str, default = None, help = "write the report to this JSON file")
+    args = parser.parse_args()
+    device = "cuda" if args.cuda else "cpu"
+    num_classes = 2 if args.two_class else 3
+
+    _, model = load_network(args.load_dir, num_classes, device)
+    model.to(torch.device(device))
+    model.eval()
+    model.set_logits_mode(True)
+
+    frames = list(frame_source(args.source, args.frames))
+    if len(frames) == 0:
+        raise RuntimeError("Found 0 frames in " + args.source)
+    reference_masks, reference_fps = run_stream(StreamingPredictor(model, device), frames)
+    predictor = StreamingPredictor(model, device, args.skip, args.refresh_threshold, args.max_reuse)
+    masks, fps = run_stream(predictor, frames)
+    report = drift_report(masks, reference_masks, num_classes)
+    report.update({"frames": len(frames), "reference_fps": reference_fps, "fps": fps, "counts": predictor.counts})
+
+    print('\n mode        | frames/sec | full | reused | propagated')
+    print(' per frame   | {:10.2f} | {:4d} | {:6d} | {:10d}'.format(reference_fps, len(frames), 0, 0))
+    print(' streaming   | {:10.2f} | {:4d} | {:6d} | {:10d}'.format(fps, predictor.counts["full"], predictor.counts["reused"],
+          predictor.counts["propagated"]))
+    print(' speedup {:.2f}x, agreement {:.2f}% (worst frame {} at {:.2f}%), Jaccard vs per frame {:.4f}'.format(fps / reference_fps,
+          100 * report["agreement"], report["worst_frame"], 100 * report["worst_frame_agreement"], report["jaccard"]))
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent = 2)
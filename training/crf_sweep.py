@@ -0,0 +1,161 @@
+import torch
+from torch.utils.data import DataLoader, Subset
+import numpy as np
+from multiprocessing import Pool
+import argparse
+import itertools
+import json
+import os
+import time
+
+from inference.export import load_network
+from training.metrics import confusion_matrix, summarize
+from training.output_cache import OutputCache
+from utils.crf import crf_parameters, crf_postprocessing
+from utils.data_loading import load_datasets
+
+"""
+Sweeps CRF hyperparameters over validation images. The network runs once per image (outputs go through an
+OutputCache, so later sweeps skip it entirely), then every image is handed to a process pool that runs all CRF
+configurations on it and returns a confusion matrix and the CRF time per configuration.
+
+    python -m training.crf_sweep models/network7/FinalTrained -2 --image-dir <images/100k> --label-dir <labels> \
+        --space space.json --random 20 --frames 200
+
+The search space is a JSON object mapping crf_parameters names to lists of values, e.g.
+    {"location_xy_stdev": [1, 3, 5], "color_rgb_stdev": [5, 13, 20], "num_smoothing_iters": [2, 5]}
+"""
+
+DEFAULT_SPACE = {"location_xy_stdev": [1, 3, 5],
+                 "color_xy_stdev": [40, 80, 120],
+                 "color_rgb_stdev": [5, 13, 20],
+                 "num_smoothing_iters": [2, 5]}
+
+
+def make_configurations(space, num_random = None, seed = 0):
+    """
+    Returns the full grid of configurations in space, or num_random configurations drawn from it without replacement.
+    """
+    names = sorted(space)
+    grid = [dict(zip(names, values)) for values in itertools.product(*[space[name] for name in names])]
+    if num_random is not None and num_random < len(grid):
+        chosen = np.random.RandomState(seed).choice(len(grid), num_random, replace = False)
+        grid = [grid[i] for i in sorted(chosen)]
+    return grid
+
+
+# each pool worker opens the cache once
+worker_cache = None
+
+def init_worker(cache_dir):
+    global worker_cache
+    torch.set_num_threads(1)
+    worker_cache = OutputCache(cache_dir)
+
+
+def sweep_image(task):
+    """
+    Runs every configuration on one cached image.
+
+    Returns:
+        (np.array, np.array): confusion matrix per configuration (the first entry is without CRF), and CRF seconds
+            per configuration
+    """
+    model_key, sample_path, num_classes, configurations = task
+    raw_sample, logits, target = worker_cache.get(model_key, sample_path)
+    image = raw_sample.numpy().astype(np.uint8)
+    probabilities = torch.softmax(logits, dim = 0).numpy().astype(np.float32)
+    target = target.numpy()
+
+    confusions = [confusion_matrix(np.argmax(probabilities, axis = 0), target, num_classes)]
+    times = [0.]
+    for params in configurations:
+        start = time.time()
+        log_probabilities = crf_postprocessing(image, probabilities, num_classes, params)
+        times.append(time.time() - start)
+        confusions.append(confusion_matrix(np.argmax(log_probabilities, axis = 0), target, num_classes))
+    return np.stack(confusions), np.array(times)
+
+
+def cache_outputs(model, loader, output_cache):
+    """
+    Runs the network over loader, storing the outputs in output_cache unless they are already there.
+
+    Returns:
+        (string, list): the model key and the sample paths in loader order
+    """
+    model_key = output_cache.model_key(model)
+    dataset = loader.dataset
+    sample_paths = [dataset.dataset.samples[i][0] for i in dataset.indices]
+    with torch.no_grad():
+        for batch_idx, (raw_samples, data, target) in enumerate(loader):
+            batch_paths = sample_paths[batch_idx * loader.batch_size:(batch_idx + 1) * loader.batch_size]
+            if all(output_cache.contains(model_key, sample_path) for sample_path in batch_paths):
+                continue
+            output_cache.put_batch(model_key, batch_paths, raw_samples, model(data), target)
+    return model_key, sample_paths
+
+
+def run_sweep(model_key, sample_paths, num_classes, configurations, cache_dir, workers):
+    """
+    Returns the summed confusion matrix and the total CRF time of every configuration (index 0 is without CRF).
+    """
+    confusions = np.zeros((len(configurations) + 1, num_classes, num_classes), dtype = np.int64)
+    times = np.zeros(len(configurations) + 1)
+    tasks = [(model_key, sample_path, num_classes, configurations) for sample_path in sample_paths]
+    with Pool(workers, initializer = init_worker, initargs = (cache_dir,)) as pool:
+        for image_confusions, image_times in pool.imap_unordered(sweep_image, tasks):
+            confusions += image_confusions
+            times += image_times
+    return confusions, times
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Parallel sweep over CRF hyperparameters')
+    parser.add_argument('load_dir', type = str, help = "checkpoint to evaluate, inside a models/<network> folder")
+    parser.add_argument('--image-dir', dest = "image_dir", type = str, required = True, help = "directory containing the train/val images")
+    parser.add_argument('--label-dir', dest = "label_dir", type = str, required = True, help = "directory containing the train/val labels")
+    parser.add_argument('--two_class', '-2', action = "store_true", help = "the model was trained on 2 classes")
+    parser.add_argument('--space', type = str, default = None, help = "JSON file with the search space")
+    parser.add_argument('--random', type = int, default = None, help = "number of random configurations instead of the full grid")
+    parser.add_argument('--frames', type = int, default = 200, help = "number of validation frames")
+    parser.add_argument('--workers', type = int, default = os.cpu_count())
+    parser.add_argument('--output-cache', dest = "output_cache", type = str, default = "cache/eval")
+    parser.add_argument('--out', type = str, default = None, help = "write the ranked results to this JSON file")
+    args = parser.parse_args()
+    num_classes = 2 if args.two_class else 3
+
+    space = DEFAULT_SPACE
+    if args.space:
+        with open(args.space) as f:
+            space = json.load(f)
+    configurations = make_configurations(space, args.random)
+
+    _, model = load_network(args.load_dir, num_classes)
+    model.eval()
+    model.set_logits_mode(True)
+    _, test_dataset = load_datasets(args.image_dir, args.label_dir, num_classes = num_classes)
+    loader = DataLoader(Subset(test_dataset, list(range(min(args.frames, len(test_dataset))))), batch_size = 1)
+
+    print("Computing network outputs for {} frames...".format(len(loader)))
+    output_cache = OutputCache(args.output_cache)
+    model_key, sample_paths = cache_outputs(model, loader, output_cache)
+
+    print("Running {} CRF configurations on {} workers...".format(len(configurations), args.workers))
+    confusions, times = run_sweep(model_key, sample_paths, num_classes, configurations, args.output_cache, args.workers)
+
+    results = []
+    for index, params in enumerate([None] + configurations):
+        accuracy, jaccard = summarize(confusions[index])
+        results.append({"params": params, "accuracy": accuracy, "jaccard": jaccard,
+                        "ms_per_image": 1000 * times[index] / len(sample_paths), "confusion": confusions[index].tolist()})
+    results.sort(key = lambda result: result["jaccard"], reverse = True)
+
+    print('\n Rank | Jaccard | Accuracy | CRF ms/image | Parameters')
+    for rank, result in enumerate(results):
+        params = "no CRF" if result["params"] is None else json.dumps(result["params"], sort_keys = True)
+        print(' {:4d} | {:7.4f} | {:7.2f}% | {:12.1f} | {}'.format(rank + 1, result["jaccard"], result["accuracy"], result["ms_per_image"], params))
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"defaults": crf_parameters(num_classes), "results": results}, f, indent = 2)
@@ -0,0 +1,122 @@
+import os
+import numpy as np
+import torch
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data.distributed import DistributedSampler
+
+"""
+Helpers for multi-process data-parallel training with torch.distributed. Defaults to the
+gloo backend so that it runs on CPU-only Linux machines. Processes are expected to be
+launched with torchrun (or anything else that sets RANK, WORLD_SIZE, MASTER_ADDR and MASTER_PORT).
+"""
+
+def init_distributed(backend = "gloo", init_method = "env://", rank = None, world_size = None):
+    """
+    Joins the process group and limits the number of intra-op threads so that the processes
+    sharing a node do not oversubscribe its cores.
+
+    Args:
+        backend (string): torch.distributed backend, gloo for CPU training
+        init_method (string): url used to find the other processes, e.g. "tcp://10.0.0.1:23456"
+        rank (int, optional): rank of this process, read from the RANK env variable if not given
+        world_size (int, optional): total number of processes, read from WORLD_SIZE if not given
+    Returns:
+        (int, int): the rank of this process and the world size
+    """
+    rank = int(os.environ.get("RANK", 0)) if rank is None else rank
+    world_size = int(os.environ.get("WORLD_SIZE", 1)) if world_size is None else world_size
+    dist.init_process_group(backend, init_method = init_method, rank = rank, world_size = world_size)
+
+    local_world_size = int(os.environ.get("LOCAL_WORLD_SIZE", world_size))
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // local_world_size))
+    return rank, world_size
+
+
+def cleanup_distributed():
+    if is_distributed():
+        dist.destroy_process_group()
+
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized()
+
+
+def get_rank():
+    return dist.get_rank() if is_distributed() else 0
+
+
+def get_world_size():
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def is_main_process():
+    """
+    Only the rank 0 process writes checkpoints and prints logs.
+    """
+    return get_rank() == 0
+
+
+def broadcast_object(obj, src = 0):
+    """
+    Returns rank src's obj on every rank, e.g. a setting only rank 0 computes. Any picklable object works.
+    """
+    if not is_distributed():
+        return obj
+    objects = [obj]
+    dist.broadcast_object_list(objects, src = src)
+    return objects[0]
+
+
+def wrap_model(model, device = "cpu"):
+    """
+    Wraps the model so that gradients are all-reduced across ranks during backward. Returns
+    the model untouched when not running distributed.
+    """
+    if not is_distributed():
+        return model
+    if torch.device(device).type == "cuda":
+        return DistributedDataParallel(model, device_ids = [torch.device(device).index])
+    return DistributedDataParallel(model)
+
+
+def make_sampler(dataset, shuffle = True):
+    """
+    Returns a sampler that shards the dataset across ranks, or None when not running distributed
+    so that the DataLoader keeps its default sampling.
+    """
+    if not is_distributed():
+        return None
+    return DistributedSampler(dataset, num_replicas = get_world_size(), rank = get_rank(), shuffle = shuffle)
+
+
+def all_reduce_metrics(class_correct, class_jacard_or, loss, confusion, num_pixels):
+    """
+    Sums the pixel counts, loss and confusion matrix of every rank. The inputs are left untouched
+    so that each rank keeps accumulating only its own shard.
+
+    Args:
+        class_correct (list): correctly classified pixels per class
+        class_jacard_or (list): union of predicted and target pixels per class
+        loss (float): summed loss
+        confusion (np.array): (num_classes x num_classes) confusion matrix
+        num_pixels (int): target pixels seen
+    Returns:
+        (list, list, float, np.array, int): the same metrics summed over all ranks
+    """
+    if not is_distributed():
+        return class_correct, class_jacard_or, loss, confusion, num_pixels
+
+    num_classes = len(class_correct)
+    packed = torch.tensor(np.concatenate([np.asarray(class_correct, dtype = np.float64),
+                                          np.asarray(class_jacard_or, dtype = np.float64),
+                                          [loss, num_pixels], np.asarray(confusion, dtype = np.float64).ravel()]))
+    dist.all_reduce(packed, op = dist.ReduceOp.SUM)
+    packed = packed.numpy()
+
+    reduced_correct = [int(x) for x in packed[:num_classes]]
+    reduced_or = [int(x) for x in packed[num_classes:2 * num_classes]]
+    reduced_loss = float(packed[2 * num_classes])
+    reduced_pixels = int(packed[2 * num_classes + 1])
+    reduced_confusion = packed[2 * num_classes + 2:].reshape(np.asarray(confusion).shape)
+    return reduced_correct, reduced_or, reduced_loss, reduced_confusion, reduced_pixels
@@ -0,0 +1,226 @@
+import torch
+import torch.nn as nn
+import torch.multiprocessing as mp
+from torch.utils.data import Subset
+import numpy as np
+import copy
+import json
+import queue
+import time
+
+from training.metrics import confusion_matrix, summarize
+from utils.loader_factory import make_loader
+
+"""
+Fast validation on a fixed, stratified subset of the validation set, for checking a run far more often than a full
+pass over the 10k validation frames allows (e.g. for early stopping):
+
+  - the subset is drawn once, proportionally from quantile bins of the drivable pixel fraction (from a SampleIndex),
+    so that it covers empty roads, crowded scenes and everything in between like the full set does
+  - optionally only a random fraction of the pixels of every image is scored; the pixels are fixed per image so
+    successive checkpoints are compared on exactly the same pixels
+  - accuracy and Jaccard come with bootstrap confidence intervals over the images, which tell whether a change
+    between two checkpoints is larger than the noise of the subset
+
+The network runs without the prior or the CRF. FastValidator.submit evaluates a checkpoint in a background process
+while training continues, poll collects the finished results:
+
+    validator = FastValidator(test_dataset, stratified_subset(index.fractions(), 500), num_classes = 3)
+    trainer = SegmentationTrainer(..., fast_validator = validator)
+"""
+
+def stratified_subset(class_fractions, num_images, num_strata = 4, seed = 0):
+    """
+    Args:
+        class_fractions (np.array): (num_samples x num_classes) pixel fractions, see SampleIndex.fractions
+        num_images (int): size of the subset, rounded per stratum
+        num_strata (int): number of quantile bins of the drivable (non background) fraction
+    Returns:
+        np.array: sorted dataset indices
+    """
+    drivable = 1. - class_fractions[:, 0]
+    edges = np.quantile(drivable, np.linspace(0, 1, num_strata + 1)[1:-1])
+    strata = np.digitize(drivable, edges)
+    rng = np.random.RandomState(seed)
+    indices = []
+    for stratum in range(num_strata):
+        members = np.flatnonzero(strata == stratum)
+        count = min(int(round(num_images * len(members) / float(len(drivable)))), len(members))
+        indices.extend(rng.choice(members, count, replace = False))
+    return np.sort(np.array(indices, dtype = np.int64))
+
+
+def pixel_subsample(index, num_pixels, fraction, seed = 0):
+    """
+    Flat positions of the pixels scored in image index, the same on every call.
+    """
+    rng = np.random.RandomState((seed * 1000003 + index) % 2**32)
+    return np.flatnonzero(rng.rand(num_pixels) < fraction)
+
+
+def bootstrap_interval(confusions, num_resamples = 1000, confidence = .95, seed = 0):
+    """
+    Args:
+        confusions (np.array): (num_images x num_classes x num_classes) confusion matrix of every image
+    Returns:
+        dict: accuracy (%) and mean Jaccard of the summed confusion, and their (low, high) percentile bootstrap
+            intervals from resampling the images with replacement
+    """
+    num_images = len(confusions)
+    rng = np.random.RandomState(seed)
+    draws = rng.randint(0, num_images, (num_resamples, num_images))
+    weights = np.zeros((num_resamples, num_images))
+    np.add.at(weights, (np.arange(num_resamples)[:, None], draws), 1)
+    resampled = np.tensordot(weights, confusions, axes = 1)
+    accuracies, jaccards = np.array([summarize(confusion) for confusion in resampled]).T
+
+    tail = 100. * (1. - confidence) / 2.
+    accuracy, jaccard = summarize(confusions.sum(axis = 0))
+    return {"accuracy": float(accuracy), "accuracy_ci": np.percentile(accuracies, [tail, 100. - tail]).tolist(),
+            "jaccard": float(jaccard), "jaccard_ci": np.percentile(jaccards, [tail, 100. - tail]).tolist()}
+
+
+class FastValidator:
+    """
+    Args:
+        dataset (DeepDriveDataset): validation set
+        indices (np.array): subset to evaluate, see stratified_subset
+        num_classes (int): number of classes of the network
+        pixel_fraction (float, optional): score only this fraction of the pixels of every image, all pixels if None
+        num_resamples (int): bootstrap resamples
+        confidence (float): coverage of the bootstrap intervals
+        device (string): device of the background process
+        threads (int): torch threads of the background process, so that it does not starve training on the cpu
+        seed (int): seed of the pixel subsample and the bootstrap
+        results_file (string, optional): JSON lines file every reported result is appended to
+    """
+    def __init__(self, dataset, indices, num_classes, pixel_fraction = None, num_resamples = 1000, confidence = .95,
+                 device = "cpu", threads = 2, seed = 0, results_file = None):
+        self.dataset = dataset
+        self.indices = np.asarray(indices)
+        self.num_classes = num_classes
+        self.pixel_fraction = pixel_fraction
+        self.num_resamples = num_resamples
+        self.confidence = confidence
+        self.device = device
+        self.threads = threads
+        self.seed = seed
+        self.results_file = results_file
+        self.process = None
+        self.results = None
+
+    def __getstate__(self):
+        """
+        Pickled into the background process. The dataset goes without its SharedSampleCache, whose lock belongs to
+        the default (fork) context and cannot be shared with a spawned process; the worker decodes every frame.
+        """
+        state = self.__dict__.copy()
+        state["process"] = None
+        state["results"] = None
+        if getattr(self.dataset, "sample_cache", None) is not None:
+            state["dataset"] = copy.copy(self.dataset)
+            state["dataset"].sample_cache = None
+        return state
+
+    def evaluate(self, model, device):
+        """
+        Evaluates model on the subset in this process. Returns the bootstrap_interval dict with the mean loss, the
+        per class accuracy and the number of images and pixels scored.
+        """
+        was_training = model.training
+        model.eval()
+        logits_mode = model.set_logits_mode(True)
+        loss_func = nn.CrossEntropyLoss()
+        loader = make_loader(Subset(self.dataset, self.indices.tolist()), batch_size = 1, device = device)
+        confusions = np.zeros((len(self.indices), self.num_classes, self.num_classes), dtype = np.int64)
+        sum_loss = 0.
+        start = time.time()
+        with torch.no_grad():
+            for position, (_, data, target) in enumerate(loader):
+                output = model(data.to(device, non_blocking = True))
+                target = target.to(device, non_blocking = True)
+                sum_loss += loss_func(output, target).item()
+                pred = torch.argmax(output, dim = 1).cpu().numpy().ravel()
+                target = target.cpu().numpy().ravel()
+                if self.pixel_fraction is not None:
+                    pixels = pixel_subsample(int(self.indices[position]), target.size, self.pixel_fraction, self.seed)
+                    pred, target = pred[pixels], target[pixels]
+                confusions[position] = confusion_matrix(pred, target, self.num_classes)
+        model.set_logits_mode(logits_mode)
+        model.train(was_training)
+
+        result = bootstrap_interval(confusions, self.num_resamples, self.confidence, self.seed)
+        total = confusions.sum(axis = 0)
+        result.update({"loss": sum_loss / max(len(self.indices), 1), "images": len(self.indices), "pixels": int(total.sum()),
+                       "per_class_accuracy": (np.diagonal(total) / np.maximum(total.sum(axis = 1), 1)).tolist(),
+                       "seconds": time.time() - start})
+        return result
+
+    # ============================== background evaluation ==============================
+    def busy(self):
+        return self.process is not None and self.process.is_alive()
+
+    def submit(self, checkpoint_path, step):
+        """
+        Starts evaluating the checkpoint at checkpoint_path in a background process, unless the previous one is
+        still running, in which case this checkpoint is skipped. Returns whether it was started.
+
+        Checkpoints are written by renaming a complete file over the old one and loaded memory-mapped, so the
+        trainer can save over checkpoint_path while it is being evaluated.
+        """
+        if self.busy():
+            return False
+        context = mp.get_context("spawn")  # never fork a process that holds a cuda context
+        if self.results is None:
+            self.results = context.Queue()
+        self.process = context.Process(target = validation_worker, args = (self, checkpoint_path, step, self.results),
+                                       name = "fast validation")
+        self.process.start()
+        return True
+
+    def poll(self):
+        """
+        Returns the results finished since the last call, oldest first.
+        """
+        results = []
+        while self.results is not None:
+            try:
+                results.append(self.results.get_nowait())
+            except queue.Empty:
+                break
+        return results
+
+    def close(self):
+        """
+        Waits for the running evaluation and returns the remaining results.
+        """
+        results = []
+        if self.process is not None:
+            while self.process.is_alive():
+                results.extend(self.poll())
+                self.process.join(timeout = 1)
+            self.process = None
+        return results + self.poll()
+
+
+def validation_worker(validator, checkpoint_path, step, results):
+    from inference.export import load_network
+
+    torch.set_num_threads(validator.threads)
+    _, model = load_network(checkpoint_path, validator.num_classes, validator.device)
+    model.to(torch.device(validator.device))
+    result = validator.evaluate(model, validator.device)
+    result.update({"step": step, "checkpoint": checkpoint_path})
+    results.put(result)
+
+
+def format_result(result):
+    return 'Fast validation ({} images, {} pixels): loss {:.4f}, Accuracy {:.2f}% [{:.2f}, {:.2f}], Jaccard {:.4f} [{:.4f}, {:.4f}]'.format(
+        result["images"], result["pixels"], result["loss"], result["accuracy"], result["accuracy_ci"][0], result["accuracy_ci"][1],
+        result["jaccard"], result["jaccard_ci"][0], result["jaccard_ci"][1])
+
+
+def append_results(path, results):
+    with open(path, "a") as f:
+        for result in results:
+            f.write(json.dumps(result) + "\n")
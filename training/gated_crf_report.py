@@ -0,0 +1,118 @@
+import torch
+from torch.utils.data import DataLoader, Subset
+import numpy as np
+from multiprocessing import Pool
+import argparse
+import json
+import os
+import time
+
+from inference.export import load_network
+from training import crf_sweep
+from training.crf_sweep import cache_outputs, init_worker
+from training.metrics import confusion_matrix, summarize
+from training.output_cache import OutputCache
+from utils.crf import GATE_MODES, DEFAULT_TILE_SIZE, crf_postprocessing, gated_crf_postprocessing
+from utils.data_loading import load_datasets
+
+"""
+Compares the confidence-gated CRF against running the CRF on every pixel. For every gate mode and uncertainty
+threshold it reports the fraction of pixels refined, the CRF time per image, the speedup and the Jaccard change
+relative to always-on CRF. Network outputs come from an OutputCache, the same one training/crf_sweep.py uses.
+
+    python -m training.gated_crf_report models/network7/FinalTrained -2 --image-dir <images/100k> --label-dir <labels> \
+        --thresholds .02 .05 .1 .2 --frames 200
+"""
+
+
+def gate_image(task):
+    """
+    Runs the always-on CRF and every gated setting on one cached image.
+
+    Returns:
+        (np.array, np.array, np.array): confusion matrix, CRF seconds and fraction refined per setting, the first
+            setting being the always-on CRF
+    """
+    model_key, sample_path, num_classes, settings, tile_size = task
+    raw_sample, logits, target = crf_sweep.worker_cache.get(model_key, sample_path)
+    image = raw_sample.numpy().astype(np.uint8)
+    probabilities = torch.softmax(logits, dim = 0).numpy().astype(np.float32)
+    target = target.numpy()
+
+    start = time.time()
+    log_probabilities = crf_postprocessing(image, probabilities, num_classes)
+    times, refined = [time.time() - start], [1.]
+    confusions = [confusion_matrix(np.argmax(log_probabilities, axis = 0), target, num_classes)]
+    for mode, threshold in settings:
+        start = time.time()
+        log_probabilities, fraction = gated_crf_postprocessing(image, probabilities, num_classes, threshold = threshold,
+                                                               mode = mode, tile_size = tile_size)
+        times.append(time.time() - start)
+        refined.append(fraction)
+        confusions.append(confusion_matrix(np.argmax(log_probabilities, axis = 0), target, num_classes))
+    return np.stack(confusions), np.array(times), np.array(refined)
+
+
+def run_report(model_key, sample_paths, num_classes, settings, cache_dir, workers, tile_size = DEFAULT_TILE_SIZE):
+    """
+    Returns one result per setting (the first being always-on CRF) with the refined fraction, ms per image,
+    speedup, accuracy, Jaccard and Jaccard change relative to always-on CRF.
+    """
+    confusions = np.zeros((len(settings) + 1, num_classes, num_classes), dtype = np.int64)
+    times = np.zeros(len(settings) + 1)
+    refined = np.zeros(len(settings) + 1)
+    tasks = [(model_key, sample_path, num_classes, settings, tile_size) for sample_path in sample_paths]
+    with Pool(workers, initializer = init_worker, initargs = (cache_dir,)) as pool:
+        for image_confusions, image_times, image_refined in pool.imap_unordered(gate_image, tasks):
+            confusions += image_confusions
+            times += image_times
+            refined += image_refined
+
+    _, always_jaccard = summarize(confusions[0])
+    results = []
+    for index, (mode, threshold) in enumerate([("always", None)] + settings):
+        accuracy, jaccard = summarize(confusions[index])
+        results.append({"mode": mode, "threshold": threshold, "refined": refined[index] / len(sample_paths),
+                        "ms_per_image": 1000 * times[index] / len(sample_paths), "speedup": times[0] / max(times[index], 1e-9),
+                        "accuracy": accuracy, "jaccard": jaccard, "jaccard_change": jaccard - always_jaccard})
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Compare the confidence-gated CRF against always-on CRF')
+    parser.add_argument('load_dir', type = str, help = "checkpoint to evaluate, inside a models/<network> folder")
+    parser.add_argument('--image-dir', dest = "image_dir", type = str, required = True, help = "directory containing the train/val images")
+    parser.add_argument('--label-dir', dest = "label_dir", type = str, required = True, help = "directory containing the train/val labels")
+    parser.add_argument('--two_class', '-2', action = "store_true", help = "the model was trained on 2 classes")
+    parser.add_argument('--thresholds', type = float, nargs = "+", default = [.02, .05, .1, .2])
+    parser.add_argument('--modes', type = str, nargs = "+", choices = GATE_MODES, default = GATE_MODES)
+    parser.add_argument('--tile-size', dest = "tile_size", type = int, nargs = 2, metavar = ("WIDTH", "HEIGHT"), default = list(DEFAULT_TILE_SIZE))
+    parser.add_argument('--frames', type = int, default = 200, help = "number of validation frames")
+    parser.add_argument('--workers', type = int, default = os.cpu_count())
+    parser.add_argument('--output-cache', dest = "output_cache", type = str, default = "cache/eval")
+    parser.add_argument('--out', type = str, default = None, help = "write the results to this JSON file")
+    args = parser.parse_args()
+    num_classes = 2 if args.two_class else 3
+
+    _, model = load_network(args.load_dir, num_classes)
+    model.eval()
+    model.set_logits_mode(True)
+    _, test_dataset = load_datasets(args.image_dir, args.label_dir, num_classes = num_classes)
+    loader = DataLoader(Subset(test_dataset, list(range(min(args.frames, len(test_dataset))))), batch_size = 1)
+
+    print("Computing network outputs for {} frames...".format(len(loader)))
+    output_cache = OutputCache(args.output_cache)
+    model_key, sample_paths = cache_outputs(model, loader, output_cache)
+
+    settings = [(mode, threshold) for mode in args.modes for threshold in args.thresholds]
+    results = run_report(model_key, sample_paths, num_classes, settings, args.output_cache, args.workers, tuple(args.tile_size))
+
+    print('\n Gate   | Threshold | Refined % | CRF ms/image | Speedup | Jaccard | Change vs always')
+    for result in results:
+        threshold = "-" if result["threshold"] is None else "{:.3f}".format(result["threshold"])
+        print(' {:6s} | {:>9s} | {:9.1f} | {:12.1f} | {:6.2f}x | {:7.4f} | {:+.4f}'.format(result["mode"], threshold, 100 * result["refined"],
+              result["ms_per_image"], result["speedup"], result["jaccard"], result["jaccard_change"]))
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent = 2)
@@ -0,0 +1,34 @@
+import numpy as np
+
+"""
+Vectorized pixel metrics shared by the evaluation tools. Confusion matrices use the same layout as
+get_per_class_accuracy in the trainer: rows are the target class, columns the predicted class.
+"""
+
+def confusion_matrix(pred, target, num_classes):
+    """
+    Args:
+        pred (np.array): predicted class of every pixel
+        target (np.array): target class of every pixel, same shape as pred
+    Returns:
+        np.array: (num_classes x num_classes) pixel counts
+    """
+    pred, target = np.asarray(pred).ravel(), np.asarray(target).ravel()
+    return np.bincount(target * num_classes + pred, minlength = num_classes**2).reshape((num_classes, num_classes))
+
+
+def class_jaccard(confusion):
+    """
+    Intersection over union of every class.
+    """
+    correct = np.diagonal(confusion)
+    union = confusion.sum(axis = 0) + confusion.sum(axis = 1) - correct
+    return correct / np.maximum(union, 1)
+
+
+def summarize(confusion):
+    """
+    Returns (pixel accuracy in %, mean Jaccard) of a confusion matrix.
+    """
+    correct = np.diagonal(confusion)
+    return 100. * correct.sum() / max(confusion.sum(), 1), np.mean(class_jaccard(confusion))
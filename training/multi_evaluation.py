@@ -0,0 +1,122 @@
+import torch
+import torch.nn.functional as F
+from torch.utils.data import Subset
+import numpy as np
+from tqdm import tqdm
+import argparse
+import json
+import time
+
+from architectures.model_stats import ModelStats
+from inference.export import load_network
+from training.metrics import confusion_matrix, class_jaccard, summarize
+from utils.data_loading import load_datasets
+from utils.loader_factory import make_loader
+
+"""
+Evaluates several checkpoints in a single pass over the validation set. Each decoded batch is moved to the device
+once and streamed through every model, with separate metric accumulators per model, so decoding is paid once per
+image no matter how many models are compared. 2 and 3 class models can be mixed: the data is loaded with the 3
+class labels and the 2 class target is derived from it the way preprocess_two_classes does.
+
+    python -m training.multi_evaluation models/network7/FinalTrained:2 models/network8/FinalTrained3:3 \
+        --image-dir <images/100k> --label-dir <drivable_maps/labels>
+"""
+
+class ModelAccumulator:
+    """
+    Running metrics of one model, kept in ModelStats terms.
+    """
+    def __init__(self, name, model, num_classes):
+        self.name = name
+        self.model = model
+        self.num_classes = num_classes
+        self.stats = ModelStats(num_classes)
+        self.sum_loss = 0.
+        self.num_batches = 0
+        self.forward_time = 0.
+
+    def update(self, data, target):
+        start = time.time()
+        output = self.model(data)
+        self.forward_time += time.time() - start
+
+        if self.num_classes == 2:
+            target = (target != 0).long()
+        self.sum_loss += F.cross_entropy(output, target).item()
+        self.num_batches += 1
+        self.stats.confusion += confusion_matrix(torch.argmax(output, dim = 1).cpu().numpy(), target.cpu().numpy(), self.num_classes)
+
+    def finish(self):
+        accuracy, jaccard = summarize(self.stats.confusion)
+        self.stats.loss.append(self.sum_loss / max(self.num_batches, 1))
+        self.stats.accuracy.append(accuracy)
+        self.stats.jaccard_accuracy.append(jaccard)
+        self.stats.per_class_accuracy.append(np.diagonal(self.stats.confusion).copy())
+        return {"model": self.name, "num_classes": self.num_classes, "loss": self.stats.loss[-1], "accuracy": accuracy,
+                "jaccard": jaccard, "class_jaccard": class_jaccard(self.stats.confusion).tolist(),
+                "forward_ms": 1000 * self.forward_time / max(self.num_batches, 1), "confusion": self.stats.confusion.tolist()}
+
+
+def evaluate_models(accumulators, loader, device = "cpu"):
+    """
+    Streams every batch of loader through all accumulators' models and returns their results.
+    """
+    with torch.no_grad():
+        for _, data, target in tqdm(loader):
+            data, target = data.to(device, non_blocking = True), target.to(device, non_blocking = True)
+            for accumulator in accumulators:
+                accumulator.update(data, target)
+    return [accumulator.finish() for accumulator in accumulators]
+
+
+def parse_model_spec(spec):
+    """
+    "models/network7/FinalTrained:2" -> ("models/network7/FinalTrained", 2), defaulting to 3 classes.
+    """
+    path, _, num_classes = spec.rpartition(":")
+    if path and num_classes in ("2", "3"):
+        return path, int(num_classes)
+    return spec, 3
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Evaluate several models in a single pass over the validation set')
+    parser.add_argument('models', type = str, nargs = "+", help = "checkpoints as <path>[:<num classes>]")
+    parser.add_argument('--image-dir', dest = "image_dir", type = str, required = True, help = "directory containing the train/val images")
+    parser.add_argument('--label-dir', dest = "label_dir", type = str, required = True, help = "directory containing the train/val labels")
+    parser.add_argument('--frames', type = int, default = None, help = "only evaluate the first frames of the validation set")
+    parser.add_argument('--batch_size', type = int, default = 1)
+    parser.add_argument('--workers', type = int, default = 4)
+    parser.add_argument('--cuda', '-c', action = "store_true")
+    parser.add_argument('--out', type = str, default = None, help = "write the combined report to this JSON file")
+    args = parser.parse_args()
+    device = "cuda" if args.cuda else "cpu"
+
+    accumulators = []
+    for spec in args.models:
+        path, num_classes = parse_model_spec(spec)
+        _, model = load_network(path, num_classes, device)
+        model.to(torch.device(device))
+        model.eval()
+        model.set_logits_mode(True)
+        accumulators.append(ModelAccumulator(path, model, num_classes))
+
+    _, test_dataset = load_datasets(args.image_dir, args.label_dir, num_classes = 3)
+    if args.frames is not None:
+        test_dataset = Subset(test_dataset, list(range(min(args.frames, len(test_dataset)))))
+    loader = make_loader(test_dataset, batch_size = args.batch_size, device = device, num_workers = args.workers)
+
+    results = evaluate_models(accumulators, loader, device)
+
+    print('\n Model                                    | Classes |  Loss  | Accuracy | Jaccard | Forward ms')
+    for result in results:
+        print(' {:40s} | {:7d} | {:6.4f} | {:7.2f}% | {:7.4f} | {:10.1f}'.format(result["model"], result["num_classes"], result["loss"],
+              result["accuracy"], result["jaccard"], result["forward_ms"]))
+    for accumulator in accumulators:
+        print("\n" + accumulator.name)
+        accumulator.stats.print_summary()
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent = 2)
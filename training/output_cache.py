@@ -0,0 +1,138 @@
+import torch
+import numpy as np
+import hashlib
+import os
+
+from utils.label_codec import encode_label, decode_label
+
+"""
+On-disk cache of per-image network outputs for evaluation. Entries are keyed by a fingerprint of the model
+weights and the sample path, and hold the logits (fp16, or probabilities quantized to uint8), the target (in the
+compact utils/label_codec format) and the raw image the CRF needs, compressed. SegmentationTrainer.test reads the
+cached samples from here, skipping decoding and the forward pass, and only runs the network on the missing ones, so
+sweeps over prior/CRF settings only pay for the post-processing.
+"""
+
+class OutputCache:
+    PRECISIONS = ["fp16", "uint8"]
+
+    def __init__(self, cache_dir, max_bytes = 50 * 2**30, precision = "fp16", store_images = True):
+        """
+        Args:
+            cache_dir (string): directory holding one sub directory per model fingerprint
+            max_bytes (int): least recently used entries are evicted once the cache grows past this size
+            precision (string): "fp16" stores logits, "uint8" stores softmax probabilities scaled to 0-255
+            store_images (bool): also store the raw image, needed to run the CRF from the cache
+        """
+        if precision not in self.PRECISIONS:
+            raise ValueError("Expected precision to be one of {}, got {}".format(self.PRECISIONS, precision))
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.precision = precision
+        self.store_images = store_images
+        self.hits = 0
+        self.misses = 0
+        # entries of this model key are never evicted, set while a pass is reading them
+        self.protected_key = None
+        os.makedirs(cache_dir, exist_ok = True)
+        self.total_bytes = sum(size for _, _, size in self.entries())
+
+    def model_key(self, model):
+        """
+        Fingerprint of the weights and number of classes, so retraining or reloading another checkpoint never
+        reads stale outputs.
+        """
+        digest = hashlib.sha1("{}:{}".format(type(model).__name__, model.num_classes).encode("utf-8"))
+        for name, tensor in sorted(model.state_dict().items()):
+            digest.update(name.encode("utf-8"))
+            digest.update(tensor.detach().cpu().contiguous().numpy().tobytes())
+        return digest.hexdigest()
+
+    def entry_path(self, model_key, sample_path):
+        return os.path.join(self.cache_dir, model_key, hashlib.sha1(sample_path.encode("utf-8")).hexdigest() + ".npz")
+
+    def contains(self, model_key, sample_path):
+        return os.path.exists(self.entry_path(model_key, sample_path))
+
+    def put(self, model_key, sample_path, logits, target, raw_sample = None):
+        """
+        Args:
+            logits (torch.tensor): network output in logits mode, dims = (num_classes, width, height)
+            target (torch.tensor): labels, dims = (width, height)
+            raw_sample (torch.tensor, optional): the raw RGB image, dims = (3, width, height)
+        """
+        if self.precision == "fp16":
+            output = logits.detach().cpu().half().numpy()
+        else:
+            output = np.round(255 * torch.softmax(logits.detach().float(), dim = 0).cpu().numpy()).astype(np.uint8)
+        label = encode_label(target.cpu().numpy().T)  # the codec works on (height, width) labels
+        arrays = {"output": output, "label": np.frombuffer(label, dtype = np.uint8)}
+        if self.store_images and raw_sample is not None:
+            arrays["raw_sample"] = raw_sample.cpu().numpy().astype(np.uint8)
+
+        path = self.entry_path(model_key, sample_path)
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        previous_size = os.path.getsize(path) if os.path.exists(path) else 0
+        with open(path + ".tmp", 'wb') as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(path + ".tmp", path)
+
+        self.total_bytes += os.path.getsize(path) - previous_size
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def get(self, model_key, sample_path):
+        """
+        Returns (raw_sample, logits, target) as tensors, raw_sample is None if images were not stored.
+        """
+        path = self.entry_path(model_key, sample_path)
+        with np.load(path) as entry:
+            output = entry["output"]
+            # entries written before the label codec hold the raw uint8 target
+            target = decode_label(entry["label"].tobytes()).T if "label" in entry else entry["target"]
+            raw_sample = torch.from_numpy(entry["raw_sample"].astype(np.int64)) if "raw_sample" in entry else None
+        os.utime(path, None)  # mark as recently used
+
+        if output.dtype == np.uint8:
+            logits = torch.log(torch.from_numpy(np.maximum(output, .5).astype(np.float32) / 255.))
+        else:
+            logits = torch.from_numpy(output.astype(np.float32))
+        return raw_sample, logits, torch.from_numpy(target.astype(np.int64))
+
+    def put_batch(self, model_key, sample_paths, raw_samples, output, target):
+        for i, sample_path in enumerate(sample_paths):
+            self.put(model_key, sample_path, output[i], target[i], raw_samples[i])
+        self.misses += len(sample_paths)
+
+    def get_batch(self, model_key, sample_paths, device = "cpu"):
+        """
+        Returns a (raw_samples, logits, target) batch stacked the way the DataLoader would.
+        """
+        raw_samples, logits, target = zip(*[self.get(model_key, sample_path) for sample_path in sample_paths])
+        self.hits += len(sample_paths)
+        raw_samples = torch.stack(raw_samples) if raw_samples[0] is not None else None
+        return raw_samples, torch.stack(logits).to(device), torch.stack(target).to(device)
+
+    def entries(self):
+        """
+        Yields (path, last use time, size in bytes) of every cached entry.
+        """
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith(".npz"):
+                    stat = os.stat(os.path.join(root, name))
+                    yield os.path.join(root, name), stat.st_mtime, stat.st_size
+
+    def evict(self):
+        """
+        Deletes least recently used entries until the cache is back under 90% of its byte budget, skipping the
+        entries of protected_key.
+        """
+        protected_dir = os.path.join(self.cache_dir, self.protected_key) if self.protected_key is not None else None
+        for path, _, size in sorted(self.entries(), key = lambda entry: entry[1]):
+            if self.total_bytes <= .9 * self.max_bytes:
+                break
+            if protected_dir is not None and os.path.dirname(path) == protected_dir:
+                continue
+            os.remove(path)
+            self.total_bytes -= size
@@ -0,0 +1,224 @@
+import torch
+import torch.nn.functional as F
+import numpy as np
+from multiprocessing import Pool
+import queue
+import threading
+import time
+
+from training.metrics import confusion_matrix
+from training.segmentation_trainer import unbiased_prior, apply_prior
+
+"""
+Staged evaluation pipeline. SegmentationTrainer.test runs load, transfer, forward, prior, CRF and metrics one after
+the other for every batch; here each stage runs in its own thread, connected by bounded queues, so decoding (in the
+DataLoader workers), inference, the CRF (in a process pool) and metric accumulation overlap:
+
+    decode -> inference (transfer, forward, prior) -> crf (submits to the pool) -> metrics
+
+Every stage records the time it spends working, waiting for input and blocked on a full output queue. The stage
+with the highest busy fraction is the bottleneck.
+"""
+
+END = object()
+
+
+class PipelineStage(threading.Thread):
+    """
+    Thread applying work to every item from in_queue and putting the result on out_queue.
+
+    Args:
+        name (string): stage name used in the utilization report
+        work (callable): function applied to each item
+        in_queue (queue.Queue or iterable): input items, a DataLoader for the first stage
+        out_queue (queue.Queue, optional): where results go, None for the last stage
+    """
+    def __init__(self, name, work, in_queue, out_queue = None):
+        super(PipelineStage, self).__init__(name = name, daemon = True)
+        self.work = work
+        self.in_queue = in_queue
+        self.out_queue = out_queue
+        self.busy_time = 0.
+        self.wait_time = 0.
+        self.blocked_time = 0.
+        self.items = 0
+        self.error = None
+
+    def next_item(self):
+        if isinstance(self.in_queue, queue.Queue):
+            return self.in_queue.get()
+        return next(self.in_queue, END)
+
+    def run(self):
+        try:
+            while True:
+                start = time.time()
+                item = self.next_item()
+                self.wait_time += time.time() - start
+                if item is END:
+                    break
+
+                start = time.time()
+                result = self.work(item)
+                self.busy_time += time.time() - start
+                self.items += 1
+
+                if self.out_queue is not None:
+                    start = time.time()
+                    self.out_queue.put(result)
+                    self.blocked_time += time.time() - start
+        except Exception as error:
+            self.error = error
+            # drain the input so upstream stages never block on a full queue
+            while isinstance(self.in_queue, queue.Queue) and self.next_item() is not END:
+                pass
+        finally:
+            if self.out_queue is not None:
+                self.out_queue.put(END)
+
+
+def crf_task(image, probabilities, num_classes, params, threshold = None, gate = "tile"):
+    """
+    Runs in a CRF pool process. Returns the CRF log-probabilities, the seconds spent and the fraction of pixels
+    refined. With a threshold only uncertain images or tiles are refined, see utils/crf.py gated_crf_postprocessing.
+    """
+    from utils.crf import crf_postprocessing, gated_crf_postprocessing
+    start = time.time()
+    if threshold is None:
+        log_probabilities, refined = crf_postprocessing(image, probabilities, num_classes, params), 1.
+    else:
+        log_probabilities, refined = gated_crf_postprocessing(image, probabilities, num_classes, params, threshold = threshold,
+                                                              mode = gate)
+    return log_probabilities, time.time() - start, refined
+
+
+class PipelinedEvaluator:
+    """
+    Args:
+        trainer (SegmentationTrainer): supplies the model, device, test loader and data statistics
+        use_prior (bool): post process using prior data
+        use_crf (bool): post process with the CRF
+        crf_workers (int): processes in the CRF pool
+        crf_params (dict, optional): CRF hyperparameters overriding the defaults
+        crf_threshold (float, optional): only refine images/tiles whose mean uncertainty exceeds this, as in
+            SegmentationTrainer.test
+        crf_gate (string): "image" or "tile" gating
+        queue_size (int): capacity of the queues between stages
+    """
+    def __init__(self, trainer, use_prior = False, use_crf = False, crf_workers = 4, crf_params = None, crf_threshold = None,
+                 crf_gate = "tile", queue_size = 4):
+        self.trainer = trainer
+        self.model = trainer.model
+        self.device = trainer.device
+        self.num_classes = trainer.num_classes
+        self.use_prior = use_prior
+        self.use_crf = use_crf
+        self.crf_workers = crf_workers
+        self.crf_params = crf_params
+        self.crf_threshold = crf_threshold
+        self.crf_gate = crf_gate
+        self.queue_size = queue_size
+        self.prior = unbiased_prior(trainer.data_statistics, self.num_classes, self.device) if use_prior else None
+        self.pool = None
+        self.crf_time = 0.
+        self.refined = []
+
+    def inference(self, batch):
+        raw_samples, data, target = batch
+        with torch.no_grad():
+            output = self.trainer.network(data.to(self.device, non_blocking = True))
+            if self.use_prior or self.use_crf:
+                output = F.log_softmax(output, dim = 1)
+            if self.use_prior:
+                output = apply_prior(output, self.prior)
+        return raw_samples, output, target
+
+    def submit_crf(self, batch):
+        raw_samples, output, target = batch
+        if not self.use_crf:
+            return None, output, target
+        images = raw_samples.cpu().numpy().astype(np.uint8)
+        probabilities = torch.exp(output).cpu().numpy().astype(np.float32)
+        pending = [self.pool.apply_async(crf_task, (images[i], probabilities[i], self.num_classes, self.crf_params,
+                                                    self.crf_threshold, self.crf_gate))
+                   for i in range(len(images))]
+        return pending, output, target
+
+    def accumulate(self, batch):
+        pending, output, target = batch
+        if pending is not None:
+            results = [result.get() for result in pending]
+            self.crf_time += sum(elapsed for _, elapsed, _ in results)
+            self.refined.extend(refined for _, _, refined in results)
+            output = torch.from_numpy(np.stack([log_probabilities for log_probabilities, _, _ in results]).astype(np.float32))
+
+        output, target = output.cpu(), target.cpu()
+        self.sum_loss += F.cross_entropy(output, target).item()
+        self.confusion += confusion_matrix(torch.argmax(output, dim = 1).numpy(), target.numpy(), self.num_classes)
+
+    def run(self):
+        """
+        Evaluates the whole test set, records the results in model.test_stats and returns the per stage utilization.
+        """
+        self.model.eval()
+        logits_mode = self.model.set_logits_mode(True)
+        self.sum_loss = 0.
+        self.refined = []
+        self.confusion = np.zeros((self.num_classes, self.num_classes), dtype = np.int64)
+        if self.use_crf:
+            self.pool = Pool(self.crf_workers)
+
+        decoded, inferred, submitted = [queue.Queue(self.queue_size) for _ in range(3)]
+        stages = [PipelineStage("decode", lambda batch: batch, iter(self.trainer.test_loader), decoded),
+                  PipelineStage("inference", self.inference, decoded, inferred),
+                  PipelineStage("crf", self.submit_crf, inferred, submitted),
+                  PipelineStage("metrics", self.accumulate, submitted)]
+
+        start = time.time()
+        for stage in stages:
+            stage.start()
+        for stage in stages:
+            stage.join()
+        wall_time = time.time() - start
+
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+        self.model.set_logits_mode(logits_mode)
+        for stage in stages:
+            if stage.error is not None:
+                raise stage.error
+
+        if self.use_crf and self.crf_threshold is not None:
+            print("gated CRF refined {:.1f}% of the pixels".format(100. * np.mean(self.refined or [0.])))
+        self.model.test_stats.confusion += self.confusion
+        correct = np.diagonal(self.confusion)
+        jacard_or = self.confusion.sum(axis = 0) + self.confusion.sum(axis = 1) - correct
+        self.trainer.print_log(correct.tolist(), jacard_or.tolist(), self.sum_loss, stages[-1].items, self.trainer.test_loader.batch_size,
+                               int(self.confusion.sum()), "Test set (pipelined)", True, self.confusion, test = True)
+        return self.utilization(stages, wall_time)
+
+    def utilization(self, stages, wall_time):
+        """
+        Returns {stage: {"busy", "waiting", "blocked"}} as fractions of the wall time. The decode stage is busy while it
+        waits on the DataLoader workers. The CRF pool entry is the fraction of pool capacity used.
+        """
+        report = {}
+        for stage in stages:
+            busy = stage.wait_time if stage.name == "decode" else stage.busy_time
+            waiting = 0. if stage.name == "decode" else stage.wait_time
+            report[stage.name] = {"busy": busy / wall_time, "waiting": waiting / wall_time, "blocked": stage.blocked_time / wall_time}
+        if self.use_crf:
+            report["crf pool"] = {"busy": self.crf_time / (wall_time * self.crf_workers), "waiting": 0., "blocked": 0.}
+        report["wall_time"] = wall_time
+        return report
+
+
+def print_utilization(report):
+    print('\n Stage      | Busy % | Waiting % | Blocked %')
+    for name, usage in report.items():
+        if name == "wall_time":
+            continue
+        print(' {:10s} | {:6.1f} | {:9.1f} | {:9.1f}'.format(name, 100 * usage["busy"], 100 * usage["waiting"], 100 * usage["blocked"]))
+    bottleneck = max((name for name in report if name != "wall_time"), key = lambda name: report[name]["busy"])
+    print(' wall time {:.1f}s, bottleneck: {}'.format(report["wall_time"], bottleneck))
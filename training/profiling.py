@@ -0,0 +1,207 @@
+import torch
+import json
+import threading
+import time
+
+"""
+Opt-in instrumentation of the trainer and the networks. A Profiler records a timeline of named stages (data, h2d,
+forward, loss, backward, step, metrics, crf, checkpoint) and, with attach_layer_hooks, the forward and backward
+time of every layer of a NetworkBase network. On cuda every stage also records the peak memory the allocator
+reached inside it. On cpu no memory is recorded: the only cheap peak there is the lifetime peak RSS of the process,
+which says nothing about a single stage, and tracemalloc does not see the tensor allocations.
+
+    profiler = Profiler(device = "cuda")
+    trainer = SegmentationTrainer(..., profiler = profiler)
+    trainer.train(1)
+    profiler.print_summary()
+    profiler.save_chrome_trace("trace.json")  # open in chrome://tracing or https://ui.perfetto.dev
+
+A disabled profiler (the trainer default) hands out one shared no-op context manager, so the instrumented code
+only pays for a method call per stage.
+"""
+
+class NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_STAGE = NullStage()
+
+
+class Stage:
+    def __init__(self, profiler, name, category):
+        self.profiler = profiler
+        self.name = name
+        self.category = category
+
+    def __enter__(self):
+        self.profiler.synchronize()
+        self.profiler.reset_peak_memory()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.synchronize()
+        self.profiler.record(self.name, self.category, self.start, time.perf_counter(), self.profiler.peak_memory())
+        return False
+
+
+class Profiler:
+    """
+    Args:
+        enabled (bool): a disabled profiler records nothing
+        device (string): "cuda" synchronizes around every stage so that asynchronous kernels are attributed to the
+            stage that launched them, and reads the cuda allocator peak
+        synchronize (bool, optional): override whether to synchronize, defaults to device == "cuda"
+    """
+    def __init__(self, enabled = True, device = "cpu", synchronize = None):
+        self.enabled = enabled
+        self.cuda = torch.device(device).type == "cuda"
+        self.sync = self.cuda if synchronize is None else synchronize
+        self.events = []
+        self.origin = time.perf_counter()
+        self.hook_handles = []
+        self.layer_starts = {}
+
+    def synchronize(self):
+        if self.sync:
+            torch.cuda.synchronize()
+
+    def reset_peak_memory(self):
+        if self.cuda:
+            torch.cuda.reset_peak_memory_stats()
+
+    def peak_memory(self):
+        """
+        Peak allocated bytes since the last reset_peak_memory on cuda, None on cpu.
+        """
+        if self.cuda:
+            return torch.cuda.max_memory_allocated()
+        return None
+
+    def record(self, name, category, start, end, memory = None):
+        self.events.append({"name": name, "cat": category, "start": start - self.origin, "duration": end - start,
+                            "memory": memory, "tid": threading.get_ident()})
+
+    def stage(self, name, category = "stage"):
+        """
+        Context manager timing the code inside it as stage name.
+        """
+        if not self.enabled:
+            return NULL_STAGE
+        return Stage(self, name, category)
+
+    def iterate(self, iterable, name = "data"):
+        """
+        Yields from iterable, timing every next() as stage name, e.g. the wait for the DataLoader.
+        """
+        if not self.enabled:
+            return iterable
+        return self.timed_iterator(iterable, name)
+
+    def timed_iterator(self, iterable, name):
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    # ================================= per layer hooks =================================
+    def attach_layer_hooks(self, model):
+        """
+        Registers forward and backward hooks on every leaf module of model that record per layer timings.
+        """
+        if not self.enabled:
+            return
+        for name, module in model.named_modules():
+            if len(list(module.children())) > 0:
+                continue
+            self.hook_handles.append(module.register_forward_pre_hook(self.layer_start_hook(name, "forward")))
+            self.hook_handles.append(module.register_forward_hook(self.layer_end_hook(name, "forward")))
+            self.hook_handles.append(module.register_full_backward_pre_hook(self.layer_start_hook(name, "backward")))
+            self.hook_handles.append(module.register_full_backward_hook(self.layer_end_hook(name, "backward")))
+
+    def detach_layer_hooks(self):
+        for handle in self.hook_handles:
+            handle.remove()
+        self.hook_handles = []
+
+    def layer_start_hook(self, name, direction):
+        def hook(*args):
+            self.synchronize()
+            self.layer_starts[(name, direction)] = time.perf_counter()
+        return hook
+
+    def layer_end_hook(self, name, direction):
+        def hook(*args):
+            self.synchronize()
+            start = self.layer_starts.pop((name, direction), None)
+            if start is not None:
+                self.record(name, "layer " + direction, start, time.perf_counter())
+        return hook
+
+    # ==================================== reports ======================================
+    def summary(self, category = "stage"):
+        """
+        Returns {name: {"calls", "total", "mean", "fraction", "peak_memory"}} for the events of category, times in
+        seconds and the fraction relative to all events of that category. peak_memory is None if no event of the
+        name recorded memory (cpu, layer events).
+        """
+        events = [event for event in self.events if event["cat"] == category]
+        total_time = max(sum(event["duration"] for event in events), 1e-12)
+        summary = {}
+        for event in events:
+            entry = summary.setdefault(event["name"], {"calls": 0, "total": 0., "peak_memory": None})
+            entry["calls"] += 1
+            entry["total"] += event["duration"]
+            if event["memory"] is not None:
+                entry["peak_memory"] = max(entry["peak_memory"] or 0, event["memory"])
+        for entry in summary.values():
+            entry["mean"] = entry["total"] / entry["calls"]
+            entry["fraction"] = entry["total"] / total_time
+        return summary
+
+    def print_summary(self, top_layers = 15):
+        stages = self.summary("stage")
+        print('\n Stage        |  Calls | Total s | Mean ms |   %   | Peak MB')
+        for name, entry in sorted(stages.items(), key = lambda item: -item[1]["total"]):
+            peak = '    n/a' if entry["peak_memory"] is None else '{:7.1f}'.format(entry["peak_memory"] / 2.**20)
+            print(' {:12s} | {:6d} | {:7.2f} | {:7.2f} | {:5.1f} | {}'.format(name, entry["calls"], entry["total"],
+                  1000 * entry["mean"], 100 * entry["fraction"], peak))
+
+        for direction in ("forward", "backward"):
+            layers = self.summary("layer " + direction)
+            if len(layers) == 0:
+                continue
+            print('\n Layer ({:8s})              |  Calls | Total s | Mean ms |   %'.format(direction))
+            for name, entry in sorted(layers.items(), key = lambda item: -item[1]["total"])[:top_layers]:
+                print(' {:30s} | {:6d} | {:7.2f} | {:7.2f} | {:5.1f}'.format(name, entry["calls"], entry["total"],
+                      1000 * entry["mean"], 100 * entry["fraction"]))
+
+    def chrome_trace(self):
+        """
+        Returns the events in the Chrome trace event format (complete "X" events, microseconds).
+        """
+        threads = {}
+        trace_events = []
+        for event in self.events:
+            args = {} if event["memory"] is None else {"peak_memory_mb": event["memory"] / 2.**20}
+            trace_events.append({"name": event["name"], "cat": event["cat"], "ph": "X", "pid": 0,
+                                 "tid": threads.setdefault(event["tid"], len(threads)),
+                                 "ts": 1e6 * event["start"], "dur": 1e6 * event["duration"], "args": args})
+        return {"traceEvents": trace_events, "displayTimeUnit": "ms"}
+
+    def save_chrome_trace(self, path):
+        with open(path, "w") as f:
+            json.dump(self.chrome_trace(), f)
+
+    def save_summary(self, path):
+        categories = sorted(set(event["cat"] for event in self.events))
+        with open(path, "w") as f:
+            json.dump({category: self.summary(category) for category in categories}, f, indent = 2)
@@ -2,20 +2,23 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import torch.optim as optim
-import matplotlib.pyplot as plt
+from torch.utils.data import Subset
 import numpy as np
 from tqdm import tqdm
 from PIL import Image
 from utils.progress_bar import ProgressBar
 # our own code imports
-from utils.crf import crf_batch_postprocessing
+from training.distributed import wrap_model, all_reduce_metrics, get_world_size, is_main_process
+from training.profiling import Profiler
+from training.fast_validation import format_result, append_results
+from utils.loader_factory import make_loader
 
 class SegmentationTrainer:
     """
     Class to train segmentation model
     """
     def __init__(self, model, device, train_loader, test_loader, optimizer, data_stats,
-                 num_classes = 3, log_spacing = 100, save_spacing = 100, per_class = False):
+                 num_classes = 3, log_spacing = 100, save_spacing = 100, per_class = False, profiler = None, fast_validator = None):
         self.model = model
         self.device = device
         self.train_loader = train_loader
@@ -26,6 +29,12 @@ class SegmentationTrainer:
         self.save_spacing = save_spacing
         self.per_class = per_class
         self.data_statistics = data_stats
+        # gradients are all-reduced by the wrapper when running distributed, self.model keeps the stats
+        self.network = wrap_model(model, device)
+        # per stage timings, see training/profiling.py; the disabled default costs nothing measurable
+        self.profiler = profiler if profiler is not None else Profiler(enabled = False)
+        # evaluates every saved checkpoint on a validation subset in the background, see training/fast_validation.py
+        self.fast_validator = fast_validator
 
     def train(self, epoch, start_index = 0):
         """
@@ -43,174 +52,359 @@ class SegmentationTrainer:
         """
         progress_bar = ProgressBar("Train", len(self.train_loader), self.train_loader.batch_size)
         self.model.train()  # puts it in training mode
+        logits_mode = self.model.set_logits_mode(True)  # CrossEntropyLoss applies the log-softmax itself
         class_correct =  [0] * self.num_classes
         class_jacard_or = [0] * self.num_classes
         sum_loss = 0
+        num_pixels = 0
         num_batches_since_log = 0
         loss_func = nn.CrossEntropyLoss(reduction = "none")
         # run through data in batches, train network on each batch
-        for batch_idx, (_, data, target) in tqdm(enumerate(self.train_loader)):
+        profiler = self.profiler
+        for batch_idx, (_, data, target) in tqdm(enumerate(profiler.iterate(self.train_loader, "data")), total = len(self.train_loader),
+                                                 disable = not is_main_process()):
             #progress_bar.make_progress()
             if batch_idx < start_index: continue
             loss_vec = torch.zeros((self.num_classes), dtype = torch.float32)
-            data, target = data.to(self.device), target.to(self.device)
+            with profiler.stage("h2d"):
+                data, target = data.to(self.device, non_blocking = True), target.to(self.device, non_blocking = True)
             self.optimizer.zero_grad()  # reset gradient to 0 (so doesn't accumulate)
-            output = self.model(data)  # runs batch through the model
-            loss = loss_func(output, target)  # compute loss of output
-
-            # convert into 1 channel image with predicted class values 
-            pred = torch.argmax(output, dim = 1, keepdim = False)
-            #assert(pred.shape == (self.train_loader.batch_size, 1280, 720)), "got incorrect shape of: " + str(pred.shape)
-
-            # record pixel measurements
-            for i in range(self.num_classes):
-                correct_pixels = torch.where(
-                    pred.byte().eq(torch.ones(pred.shape, dtype = torch.uint8).to(self.device) * i)
-                    & target.view_as(pred).byte().eq(torch.ones(pred.shape, dtype = torch.uint8).to(self.device) * i),
-                    torch.ones(pred.shape, dtype = torch.uint8).to(self.device),
-                    torch.zeros(pred.shape, dtype = torch.uint8).to(self.device)).sum().item()
-                class_correct[i] += correct_pixels
-                jaccard_or_pixels = torch.where(
-                    pred.byte().eq(torch.ones(pred.shape, dtype = torch.uint8).to(self.device) * i)
-                    | target.view_as(pred).byte().eq(torch.ones(pred.shape, dtype = torch.uint8).to(self.device) * i),
-                    torch.ones(pred.shape, dtype = torch.uint8).to(self.device),
-                    torch.zeros(pred.shape, dtype = torch.uint8).to(self.device)).sum().item()
-                class_jacard_or[i] += jaccard_or_pixels
-
-            get_per_class_loss(loss, target, loss_vec)
+            with profiler.stage("forward"):
+                output = self.network(data)  # runs batch through the model
+            with profiler.stage("loss"):
+                loss = loss_func(output, target)  # compute loss of output
+            self.record_sample_losses(batch_idx, loss)
+
+            with profiler.stage("metrics"):
+                # convert into 1 channel image with predicted class values 
+                pred = torch.argmax(output, dim = 1, keepdim = False)
+                #assert(pred.shape == (self.train_loader.batch_size, 1280, 720)), "got incorrect shape of: " + str(pred.shape)
+
+                # record pixel measurements
+                for i in range(self.num_classes):
+                    correct_pixels = torch.where(
+                        pred.byte().eq(torch.ones(pred.shape, dtype = torch.uint8).to(self.device) * i)
+                        & target.view_as(pred).byte().eq(torch.ones(pred.shape, dtype = torch.uint8).to(self.device) * i),
+                        torch.ones(pred.shape, dtype = torch.uint8).to(self.device),
+                        torch.zeros(pred.shape, dtype = torch.uint8).to(self.device)).sum().item()
+                    class_correct[i] += correct_pixels
+                    jaccard_or_pixels = torch.where(
+                        pred.byte().eq(torch.ones(pred.shape, dtype = torch.uint8).to(self.device) * i)
+                        | target.view_as(pred).byte().eq(torch.ones(pred.shape, dtype = torch.uint8).to(self.device) * i),
+                        torch.ones(pred.shape, dtype = torch.uint8).to(self.device),
+                        torch.zeros(pred.shape, dtype = torch.uint8).to(self.device)).sum().item()
+                    class_jacard_or[i] += jaccard_or_pixels
+
+                get_per_class_loss(loss, target, loss_vec)
+                num_pixels += target.numel()
             loss = torch.sum(loss_vec)
-            self.model.train_stats.per_class_loss.append(loss_vec)
 
             sum_loss += loss.item()
-            loss.backward()  # take loss object and calculate gradient; updates optimizer
-            self.optimizer.step()  # update model parameters with loss gradient
+            with profiler.stage("backward"):
+                loss.backward()  # take loss object and calculate gradient; updates optimizer
+            with profiler.stage("step"):
+                self.optimizer.step()  # update model parameters with loss gradient
+            self.model.train_stats.step += 1
 
             #update per-class accuracies
-            get_per_class_accuracy(pred, target, self.model.train_stats.confusion)
+            with profiler.stage("metrics"):
+                get_per_class_accuracy(pred, target, self.model.train_stats.confusion)
 
             if batch_idx % self.log_spacing == 0:
-                self.model.train_stats.per_class_accuracy.append(np.diagonal(self.model.train_stats.confusion).copy())
-                print("Loss Vec: {}".format(loss_vec))
-                self.print_log(class_correct, class_jacard_or, sum_loss, batch_idx + 1, self.train_loader.batch_size,
-                          "Training Set", self.per_class, self.model.train_stats.confusion)
-
-            if batch_idx % self.save_spacing == 0:
+                if is_main_process():
+                    print("Loss Vec: {}".format(loss_vec))
+                log_correct, log_jacard_or, log_loss, log_confusion, log_pixels = all_reduce_metrics(
+                    class_correct, class_jacard_or, sum_loss, self.model.train_stats.confusion, num_pixels)
+                self.print_log(log_correct, log_jacard_or, log_loss, batch_idx + 1, self.train_loader.batch_size * get_world_size(), log_pixels,
+                          "Training Set", self.per_class, log_confusion, per_class_loss = loss_vec.tolist())
+
+            if batch_idx % self.save_spacing == 0 and is_main_process():
                 print('Saving Model to: ' + str(self.model.save_dir))
-                self.model.save()
+                with profiler.stage("checkpoint"):
+                    self.model.save()
+                # the first save comes after a single step, nothing worth validating yet
+                if self.fast_validator is not None and self.model.train_stats.step > 1:
+                    self.fast_validator.submit(self.model.save_dir, self.model.train_stats.step)
+
+            if batch_idx % self.log_spacing == 0 and self.fast_validator is not None and is_main_process():
+                self.report_fast_validation(self.fast_validator.poll())
+
+        self.model.set_logits_mode(logits_mode)
+
+    def fast_test(self):
+        """
+        Evaluates the current model on the fast validation subset in this process and reports it.
+        """
+        result = self.fast_validator.evaluate(self.model, self.device)
+        self.report_fast_validation([result])
+        return result
+
+    def report_fast_validation(self, results):
+        """
+        Prints fast validation results and appends them to the validator's results file and the metrics log of the
+        test stats, if there are any.
+        """
+        if self.fast_validator.results_file is not None:
+            append_results(self.fast_validator.results_file, results)
+        metrics_log = self.model.test_stats.metrics_log
+        for result in results:
+            print(format_result(result))
+            if metrics_log is not None:
+                metrics_log.log("fast_val", result.get("step"), result["loss"], result["accuracy"], result["jaccard"],
+                                result["per_class_accuracy"])
+
+    def record_sample_losses(self, batch_idx, loss):
+        """
+        Hands the mean per-pixel loss of each image in the batch to samplers that mine hard examples.
+
+        Args:
+            batch_idx (int): index of the batch in the current epoch
+            loss (torch.tensor): unreduced loss of the batch, dims = (batch, width, height)
+        """
+        sampler = self.train_loader.sampler
+        if not hasattr(sampler, "record_loss"):
+            return
+        indices = sampler.batch_indices(batch_idx, self.train_loader.batch_size)
+        sampler.record_loss(indices, loss.detach().view(loss.shape[0], -1).mean(dim = 1).cpu().numpy())
+
+    def test_outputs(self, output_cache = None):
+        """
+        Yields (raw_samples, output, target) for every test batch, with the network output in logits mode. With an
+        output cache, cached samples are read from it (no decoding or forward pass) and the network only runs on
+        the samples that are missing, whose outputs are then stored.
 
-    def test(self, dataset_name= "Test set", use_crf = True, iters_per_log = 100, visualize = False, use_prior = True):
+        Args:
+            output_cache (OutputCache, optional): cache of per-image outputs, see training/output_cache.py
+        """
+        profiler = self.profiler
+        if output_cache is None:
+            for raw_samples, data, target in profiler.iterate(self.test_loader, "data"):
+                with profiler.stage("h2d"):
+                    data, target = data.to(self.device, non_blocking = True), target.to(self.device, non_blocking = True)
+                with profiler.stage("forward"):
+                    output = self.network(data)
+                yield raw_samples, output, target
+            return
+
+        model_key = output_cache.model_key(self.model)
+        dataset = self.test_loader.dataset
+        indices = list(self.test_loader.sampler)
+        cached = [output_cache.contains(model_key, dataset.samples[i][0]) for i in indices]
+        computed = self.cache_outputs(output_cache, model_key, [i for i, hit in zip(indices, cached) if not hit])
+
+        # cached samples are read back, the others come from the network in the same order. Writing the misses must
+        # not evict the hits this pass has yet to read, so eviction skips this model until the pass is over.
+        output_cache.protected_key = model_key
+        try:
+            batch_size = self.test_loader.batch_size
+            for start in range(0, len(indices), batch_size):
+                items = []
+                for index, hit in zip(indices[start:start + batch_size], cached[start:start + batch_size]):
+                    items.append(self.cached_output(output_cache, model_key, index) if hit else next(computed))
+                raw_samples, output, target = zip(*items)
+                raw_samples = torch.stack(raw_samples) if all(raw is not None for raw in raw_samples) else None
+                yield (raw_samples, torch.stack([logits.to(self.device) for logits in output]),
+                       torch.stack([labels.to(self.device) for labels in target]))
+        finally:
+            output_cache.protected_key = None
+            if output_cache.total_bytes > output_cache.max_bytes:
+                output_cache.evict()
+
+    def cached_output(self, output_cache, model_key, index):
+        """
+        Returns (raw_sample, output, target) of test sample index from output_cache, or runs the network on it if
+        the entry has disappeared since the pass started (e.g. evicted by another process).
+        """
+        sample_path = self.test_loader.dataset.samples[index][0]
+        try:
+            with self.profiler.stage("cache read"):
+                item = output_cache.get(model_key, sample_path)
+            output_cache.hits += 1
+            return item
+        except FileNotFoundError:
+            raw_sample, data, target = self.test_loader.dataset[index]
+            with self.profiler.stage("forward"):
+                output = self.network(data[None].to(self.device))
+            with self.profiler.stage("cache write"):
+                output_cache.put_batch(model_key, [sample_path], raw_sample[None], output, target[None])
+            return raw_sample, output[0], target
+
+    def cache_outputs(self, output_cache, model_key, indices):
+        """
+        Runs the network over the test samples at indices only, stores the outputs in output_cache and yields
+        (raw_sample, output, target) for every sample in order.
+        """
+        if len(indices) == 0:
+            return
+        profiler = self.profiler
+        dataset = self.test_loader.dataset
+        loader = make_loader(Subset(dataset, indices), batch_size = self.test_loader.batch_size, device = self.device,
+                             num_workers = self.test_loader.num_workers)
+        position = 0
+        for raw_samples, data, target in profiler.iterate(loader, "data"):
+            batch_paths = [dataset.samples[i][0] for i in indices[position:position + len(data)]]
+            position += len(data)
+            with profiler.stage("forward"):
+                output = self.network(data.to(self.device, non_blocking = True))
+            with profiler.stage("cache write"):
+                output_cache.put_batch(model_key, batch_paths, raw_samples, output, target)
+            for i in range(len(data)):
+                yield raw_samples[i], output[i], target[i]
+
+    def test(self, dataset_name= "Test set", use_crf = True, iters_per_log = 100, visualize = False, use_prior = True,
+             output_cache = None, crf_threshold = None, crf_gate = "tile"):
+        """
+        Args:
+            crf_threshold (float, optional): only refine images/tiles whose mean uncertainty exceeds this with the CRF,
+                see utils/crf.py gated_crf_postprocessing. The CRF runs on every pixel if None.
+            crf_gate (string): "image" or "tile" gating
+        """
         self.model.eval()
+        # probabilities are only needed by the prior and the CRF, argmax and the loss work on logits
+        logits_mode = self.model.set_logits_mode(True)
         test_loss = 0
+        num_pixels = 0
         class_correct =  [0] * self.num_classes
         class_jacard_or = [0] * self.num_classes
         loss_func = nn.CrossEntropyLoss()
         batches_done = 0
+        refined_fraction = 0.
         progress_bar = ProgressBar("Test", len(self.train_loader), self.train_loader.batch_size)
         with torch.no_grad():            
-            # calculate an UNBIASED prior
-            prior = self.data_statistics.get_distribution().to(self.device)
-            for i in range(self.num_classes):
-                prior[i] = prior[i] / (torch.mean(prior[i]))  #  scales relative probs to have mean of 1
-            normalization = torch.sum(prior, dim = 0)  # sum along classes
-            prior /= normalization
-            prior = torch.ones(prior.shape).to(self.device) - prior
-
-            for batch_idx, (raw_samples, data, target) in tqdm(enumerate(self.test_loader)):  # runs through trainer
-                data, target = data.to(self.device), target.to(self.device)
+            prior = unbiased_prior(self.data_statistics, self.num_classes, self.device)
+
+            for batch_idx, (raw_samples, output, target) in tqdm(enumerate(self.test_outputs(output_cache)), total = len(self.test_loader),
+                                                                 disable = not is_main_process()):  # runs through trainer
                 #progress_bar.make_progress()
-                output = self.model(data)
-                if use_prior:
-                    output = np.e**(output)
-                    for i in range(len(output)): # could be multiple images in output batch
-                        output[i] = output[i] - prior
-                        output[i] = torch.sigmoid(output[i])
-                        normalization = torch.sum(output[i], dim = 0)
-                        output[i] /= normalization
-                        output = np.log(output)
+                if use_prior or use_crf:
+                    output = F.log_softmax(output, dim = 1)
 
-                if use_crf:
-                    output = crf_batch_postprocessing(raw_samples, output, self.num_classes)
+                if use_prior:
+                    output = apply_prior(output, prior)
+
+                with self.profiler.stage("crf"):
+                    if use_crf and crf_threshold is not None:
+                        from utils.crf import gated_crf_batch_postprocessing
+                        output, fraction = gated_crf_batch_postprocessing(raw_samples, output, self.num_classes, threshold = crf_threshold,
+                                                                          mode = crf_gate)
+                        refined_fraction += fraction
+                    elif use_crf:
+                        from utils.crf import crf_batch_postprocessing  # pydensecrf is only loaded when the CRF is used
+                        output = crf_batch_postprocessing(raw_samples, output, self.num_classes)
 
                 output = output.to(self.device)
-                test_loss += loss_func(output, target).item()
-
-                #convert into 1 channel image with values 
-                pred = torch.argmax(output, dim = 1, keepdim = False)
-                #assert(pred.shape == (self.test_loader.batch_size, 1280, 720)), "got incorrect shape of: " + str(pred.shape)
-
-                # record pixel measurements
-                for i in range(self.num_classes):
-                    correct_pixels = torch.where(pred.byte().eq(torch.ones(pred.shape, dtype = torch.uint8).to(self.device)*i)
-                                                 & target.view_as(pred).byte().eq(torch.ones(pred.shape, dtype = torch.uint8).to(self.device)*i),
-                                                 torch.ones(pred.shape, dtype=torch.uint8).to(self.device),
-                                                 torch.zeros(pred.shape, dtype=torch.uint8).to(self.device)).sum().item()
-                    class_correct[i] += correct_pixels
-                    jaccard_or_pixels = torch.where(pred.byte().eq(torch.ones(pred.shape, dtype = torch.uint8).to(self.device)*i)
-                                                 | target.view_as(pred).byte().eq(torch.ones(pred.shape, dtype = torch.uint8).to(self.device)*i),
-                                                 torch.ones(pred.shape, dtype=torch.uint8).to(self.device),
-                                                 torch.zeros(pred.shape, dtype=torch.uint8).to(self.device)).sum().item()
-                    class_jacard_or[i] += jaccard_or_pixels
-
-                get_per_class_accuracy(pred, target, self.model.test_stats.confusion)
+                with self.profiler.stage("loss"):
+                    test_loss += loss_func(output, target).item()
+
+                with self.profiler.stage("metrics"):
+                    #convert into 1 channel image with values 
+                    pred = torch.argmax(output, dim = 1, keepdim = False)
+                    #assert(pred.shape == (self.test_loader.batch_size, 1280, 720)), "got incorrect shape of: " + str(pred.shape)
+
+                    # record pixel measurements
+                    for i in range(self.num_classes):
+                        correct_pixels = torch.where(pred.byte().eq(torch.ones(pred.shape, dtype = torch.uint8).to(self.device)*i)
+                                                     & target.view_as(pred).byte().eq(torch.ones(pred.shape, dtype = torch.uint8).to(self.device)*i),
+                                                     torch.ones(pred.shape, dtype=torch.uint8).to(self.device),
+                                                     torch.zeros(pred.shape, dtype=torch.uint8).to(self.device)).sum().item()
+                        class_correct[i] += correct_pixels
+                        jaccard_or_pixels = torch.where(pred.byte().eq(torch.ones(pred.shape, dtype = torch.uint8).to(self.device)*i)
+                                                     | target.view_as(pred).byte().eq(torch.ones(pred.shape, dtype = torch.uint8).to(self.device)*i),
+                                                     torch.ones(pred.shape, dtype=torch.uint8).to(self.device),
+                                                     torch.zeros(pred.shape, dtype=torch.uint8).to(self.device)).sum().item()
+                        class_jacard_or[i] += jaccard_or_pixels
+
+                    get_per_class_accuracy(pred, target, self.model.test_stats.confusion)
+                    num_pixels += target.numel()
                 batches_done += 1
 
                 if(batches_done % self.log_spacing == 0):
-                    self.model.test_stats.per_class_accuracy.append(np.diagonal(self.model.test_stats.confusion).copy())
-                    self.print_log(class_correct, class_jacard_or, test_loss, batches_done, self.test_loader.batch_size, dataset_name, True, self.model.test_stats.confusion, test = True)
+                    log_correct, log_jacard_or, log_loss, log_confusion, log_pixels = all_reduce_metrics(
+                        class_correct, class_jacard_or, test_loss, self.model.test_stats.confusion, num_pixels)
+                    self.print_log(log_correct, log_jacard_or, log_loss, batches_done, self.test_loader.batch_size * get_world_size(), log_pixels,
+                                   dataset_name, True, log_confusion, test = True)
+                    if not is_main_process():
+                        continue
                     print("saving model to {}".format(self.model.save_dir))
-                    self.model.save()
+                    with self.profiler.stage("checkpoint"):
+                        self.model.save()
 
                     if visualize:
                         visualize_output(pred, target, raw_samples)
 
+        if use_crf and crf_threshold is not None and is_main_process():
+            print("gated CRF refined {:.1f}% of the pixels".format(100. * refined_fraction / max(batches_done, 1)))
+        if output_cache is not None and is_main_process():
+            print("output cache: {} hits, {} misses, {:.1f} MB".format(output_cache.hits, output_cache.misses, output_cache.total_bytes / 2.**20))
+        self.model.set_logits_mode(logits_mode)
+
 
 
-    def print_log(self, class_correct_pixels, class_jacard_or, loss, num_samples, batch_size, name, use_acc_dict = False, acc_dict = None, test = False):
+    def print_log(self, class_correct_pixels, class_jacard_or, loss, num_samples, batch_size, num_pixels, name, use_acc_dict = False, acc_dict = None,
+                  test = False, per_class_loss = None):
+        """
+        num_pixels is the number of target pixels seen, which is smaller than num_samples*batch_size*1280*720 when
+        frames are cropped or decoded at a lower resolution.
+        """
         loss = loss/(num_samples*batch_size)
-        total_samples = num_samples*batch_size*1280*720
+        total_samples = max(num_pixels, 1)
         accuracy = 100. * sum(class_correct_pixels) / total_samples
         jaccard_accuracy = np.mean(list(map(lambda x, y: x/y, class_correct_pixels, class_jacard_or)))
-        print('\n--------------------------------------------------------------')
-        print('\n{}: Average loss: {:.4f}, Accuracy: {}/{} ({:.0f}%), Jaccard: {}\n'.format(
-            name, loss, sum(class_correct_pixels), total_samples, accuracy, jaccard_accuracy))
-        
-        if test:
-            self.model.test_stats.loss.append(loss)
-            self.model.test_stats.accuracy.append(accuracy)
-            try:
-                self.model.test_stats.jaccard_accuracy.append(jaccard_accuracy)
-            except AttributeError:
-                pass  # models trained before jaccard accuracy was involved
-        else:
-            self.model.train_stats.loss.append(loss)
-            self.model.train_stats.accuracy.append(accuracy)
-            try:
-                self.model.test_stats.jaccard_accuracy.append(jaccard_accuracy)
-            except AttributeError:
-                pass
 
+        # the stats keep the recent values, an attached MetricsLog gets the full history, indexed by the global
+        # training step so that epochs and test passes line up
+        stats = self.model.test_stats if test else self.model.train_stats
+        per_class_accuracy = None if acc_dict is None else np.diagonal(acc_dict).copy()
+        stats.record(self.model.train_stats.step, loss, accuracy, jaccard_accuracy, per_class_accuracy, per_class_loss)
+
+        # every rank records the (already reduced) stats, but only rank 0 prints them
+        if not is_main_process():
+            return
+
+        # one line per log step; the per class columns go to the metrics log, ModelStats.print_summary prints the
+        # full confusion table on demand
+        line = '{}: Average loss: {:.4f}, Accuracy: {}/{} ({:.2f}%), Jaccard: {:.4f}'.format(
+            name, loss, sum(class_correct_pixels), total_samples, accuracy, jaccard_accuracy)
         if use_acc_dict:
-            if acc_dict.shape[0] == 3:
-                print('\n Class |  Samples  | % Class 0 | % Class 1 | %Class 2 |')
-                for class_type in range(len(acc_dict)):
-                    total = acc_dict[class_type][0] + acc_dict[class_type][1] + acc_dict[class_type][2]
-                    if total == 0: 
-                        print(' {}     |     0     |    n/a    |    n/a    |    n/a    |'.format(class_type))
-                    else: 
-                        print(' {}     | {} |   {}   |   {}   |   {}   |'.format(class_type, total, 100*acc_dict[class_type][0]/total, 
-                        100*acc_dict[class_type][1]/total, 100*acc_dict[class_type][2]/total))
-
-            else:
-                print('\n Class |  Samples  | % Class 0 | % Class 1 |')
-                for class_type in range(len(acc_dict)):
-                    total = acc_dict[class_type][0] + acc_dict[class_type][1]
-                    if total == 0:
-                        print(' {}     |     0     |    n/a    |    n/a    |'.format(class_type))
-                    else:
-                        print(' {}     | {} |   {}   |   {}   |'.format(class_type, total, 100*acc_dict[class_type][0]/total,
-                        100*acc_dict[class_type][1]/total))
-                
-            print('--------------------------------------------------------------')
+            class_accuracy = 100. * np.diagonal(acc_dict) / np.maximum(acc_dict.sum(axis = 1), 1)
+            line += ', per class: ' + ' '.join('{:.1f}%'.format(value) for value in class_accuracy)
+        print(line)
+
+        loader = self.test_loader if test else self.train_loader
+        sample_cache = getattr(loader.dataset, "sample_cache", None)
+        if sample_cache is not None:
+            print(sample_cache.summary())
+
+def unbiased_prior(data_statistics, num_classes, device):
+    """
+    Turns the per-pixel class distribution of the training set into the prior subtracted from the network's
+    probabilities, dims = (num_classes, width, height).
+    """
+    # calculate an UNBIASED prior
+    prior = data_statistics.get_distribution().clone().to(device)
+    for i in range(num_classes):
+        prior[i] = prior[i] / (torch.mean(prior[i]))  #  scales relative probs to have mean of 1
+    normalization = torch.sum(prior, dim = 0)  # sum along classes
+    prior /= normalization
+    return torch.ones(prior.shape).to(device) - prior
+
+
+def apply_prior(output, prior):
+    """
+    Args:
+        output (torch.tensor): log-softmax network output, dims = (batch, num_classes, width, height)
+        prior (torch.tensor): prior from unbiased_prior
+    Returns:
+        torch.tensor: log-probabilities corrected by the prior
+    """
+    output = torch.exp(output)
+    for i in range(len(output)): # could be multiple images in output batch
+        output[i] = output[i] - prior
+        output[i] = torch.sigmoid(output[i])
+        normalization = torch.sum(output[i], dim = 0)
+        output[i] /= normalization
+    return torch.log(output)
+
 
 def get_per_class_loss(loss, target, loss_vec):
     for i in range(len(loss_vec)):
@@ -2,26 +2,24 @@ import torch
 import torch.nn as nn
 import torch.optim as optim
 import torch.nn.functional as F
-from torch.utils.data import DataLoader
-import matplotlib.pyplot as plt
 import numpy as np
 import sys
 import argparse
-import subprocess
-from tqdm import tqdm
 
 from utils.data_loading import DeepDriveDataset, load_datasets
 from training.segmentation_trainer import SegmentationTrainer
-
-from architectures.network1 import Network_1
-from architectures.network2 import Network_2
-from architectures.network3 import Network_3
-from architectures.network4 import Network_4
-from architectures.network5 import Network_5
-from architectures.network6 import Network_6
-from architectures.network7 import Network_7
-from architectures.network8 import Network_8
+from training.output_cache import OutputCache
+from training.profiling import Profiler
+from training.fast_validation import FastValidator, stratified_subset
+from training.pipelined_evaluation import PipelinedEvaluator, print_utilization
+from training.distributed import init_distributed, cleanup_distributed, make_sampler, is_main_process, broadcast_object
+
+from architectures.registry import get_network, network_name_from_path
+from architectures.metrics_log import MetricsLog
 from utils.data_stats import DataStats
+from utils.loader_factory import make_loader, autotune_loader
+from utils.shard_dataset import load_shard_datasets
+from utils.sampling import SampleIndex, ClassBalancedSampler, HardExampleSampler
 
 
 
@@ -43,10 +41,38 @@ if __name__ == '__main__':
     parser.add_argument('--batch_size', type = int, action= "store", help = "set the batch size for training and testing", default=1)
     parser.add_argument('--visualize_output', "-vis", action = "store_true", help = "visualize the output every <log_iters> for testing")
     parser.add_argument('--use_crf', "-crf", action = "store_true", help = "postprocess data with the CRF for testing")
+    parser.add_argument('--crf-threshold', action = "store", dest = "crf_threshold", type = float, help = "only run the CRF where the mean uncertainty exceeds this", default = None)
+    parser.add_argument('--crf-gate', action = "store", dest = "crf_gate", type = str, choices = ["image", "tile"], help = "gate the CRF per image or per tile", default = "tile")
     parser.add_argument('--two_class', '-2', action = "store_true", help = "train on just 2 classes")
     parser.add_argument('--prior', action = "store_true", help = "post process using prior data")
     parser.add_argument('--L2', action = "store", dest = "l2", type = float, help = "sets how much l2 regularization to add", default = 0)
     parser.add_argument('--start-idx', action = "store", dest = "start_idx", type = int, help = "tells where to resume in data", default = 0)
+    parser.add_argument('--crop', action = "store", type = int, nargs = 2, metavar = ("WIDTH", "HEIGHT"), help = "randomly crop training frames to this size", default = None)
+    parser.add_argument('--scale-range', action = "store", dest = "scale_range", type = float, nargs = 2, metavar = ("MIN", "MAX"), help = "random zoom range for multi-scale training", default = [1., 1.])
+    parser.add_argument('--image-size', action = "store", dest = "image_size", type = int, nargs = 2, metavar = ("WIDTH", "HEIGHT"), help = "decode training frames at this resolution (draft mode)", default = None)
+    parser.add_argument('--flip', action = "store_true", help = "randomly flip training frames horizontally")
+    parser.add_argument('--sampling', action = "store", type = str, choices = ["uniform", "balanced", "hard"], help = "how training frames are drawn", default = "uniform")
+    parser.add_argument('--sample-index', action = "store", dest = "sample_index", type = str, help = "file caching the per-sample class fractions", default = "priors/sample_index.npz")
+    parser.add_argument('--epoch-samples', action = "store", dest = "epoch_samples", type = int, help = "frames drawn per epoch by the balanced/hard samplers", default = None)
+    parser.add_argument('--no-full-transition', action = "store_true", dest = "no_full_transition", help = "build network8 without its fully connected bottleneck")
+    parser.add_argument('--output-cache', action = "store", dest = "output_cache", type = str, help = "directory caching network outputs between test runs", default = None)
+    parser.add_argument('--cache-size', action = "store", dest = "cache_size", type = float, help = "output cache budget in GB", default = 50)
+    parser.add_argument('--cache-precision', action = "store", dest = "cache_precision", type = str, choices = OutputCache.PRECISIONS, help = "how cached outputs are stored", default = "fp16")
+    parser.add_argument('--pipelined', action = "store_true", help = "test with overlapping decode, inference, CRF and metric stages")
+    parser.add_argument('--crf-workers', action = "store", dest = "crf_workers", type = int, help = "CRF processes used by --pipelined", default = 4)
+    parser.add_argument('--sample-cache', action = "store", dest = "sample_cache", type = float, help = "GB of shared memory per dataset caching decoded frames across workers", default = 0)
+    parser.add_argument('--shards', action = "store", type = str, help = "read train/val from tar shards in this directory (see utils/shard_dataset.py)", default = None)
+    parser.add_argument('--workers', action = "store", type = int, help = "DataLoader worker processes, defaults to 4 with cuda and 0 otherwise", default = None)
+    parser.add_argument('--prefetch', action = "store", type = int, help = "batches prefetched by each DataLoader worker", default = 2)
+    parser.add_argument('--autotune-loader', action = "store_true", dest = "autotune_loader", help = "pick workers and prefetch depth by measuring throughput (cached per machine)")
+    parser.add_argument('--metrics-log', action = "store", dest = "metrics_log", type = str, help = "CSV file the loss and accuracy history is appended to, defaults to <save-to>.metrics.csv", default = None)
+    parser.add_argument('--fast-val', action = "store", dest = "fast_val", type = int, help = "evaluate every saved checkpoint on a stratified subset of this many validation frames in the background; with --test, only run this evaluation", default = 0)
+    parser.add_argument('--fast-val-pixels', action = "store", dest = "fast_val_pixels", type = float, help = "fraction of the pixels of every frame scored by --fast-val", default = None)
+    parser.add_argument('--val-sample-index', action = "store", dest = "val_sample_index", type = str, help = "file caching the per-sample class fractions of the validation set", default = "priors/val_sample_index.npz")
+    parser.add_argument('--profile', action = "store", type = str, help = "record per stage timings and write <profile>.trace.json and <profile>.summary.json", default = None)
+    parser.add_argument('--profile-layers', action = "store_true", dest = "profile_layers", help = "with --profile, also time every layer's forward and backward pass")
+    parser.add_argument('--distributed', action = "store_true", help = "data-parallel training across processes, launch with torchrun")
+    parser.add_argument('--dist-backend', action = "store", dest = "dist_backend", type = str, help = "torch.distributed backend", default = "gloo")
     args = parser.parse_args()
 
     # ====================================== Parameters From Command Line ================================
@@ -56,6 +82,10 @@ if __name__ == '__main__':
     NUM_CLASSES = 2 if args.two_class else 3
     # ====================================================================================================
 
+    if args.distributed:
+        rank, world_size = init_distributed(backend = args.dist_backend)
+        print("rank {} of {} joined the process group".format(rank, world_size))
+
     print("using " + DEFAULT_DEVICE + " ---- batch_size = " + str(DEFAULT_BATCH) + " ----- number_of_classes = " + str(NUM_CLASSES))
 
     # =================================== More Parameters =============================================
@@ -76,11 +106,39 @@ if __name__ == '__main__':
 
     print("Initializing Dataset ... ")
     #load datasets
-    train_dataset, test_dataset = load_datasets(IMG_PATH, TEST_PATH, num_classes = NUM_CLASSES)
-    train_loader = DataLoader(train_dataset, batch_size = DEFAULT_BATCH, shuffle = False,
-                             num_workers = 4 if USE_CUDA else 0)
-    test_loader = DataLoader(test_dataset, batch_size = DEFAULT_BATCH, shuffle = False,
-                             num_workers = 4 if USE_CUDA else 0)
+    if args.shards:
+        if args.sampling != "uniform" or args.output_cache or args.fast_val:
+            raise RuntimeError("--shards streams samples in shard order and supports neither --sampling, --output-cache nor --fast-val")
+        train_dataset, test_dataset = load_shard_datasets(args.shards, num_classes = NUM_CLASSES, crop_size = args.crop,
+                                                          scale_range = args.scale_range, flip = args.flip, image_size = args.image_size)
+    else:
+        train_dataset, test_dataset = load_datasets(IMG_PATH, TEST_PATH, num_classes = NUM_CLASSES,
+                                                    crop_size = args.crop, scale_range = args.scale_range, flip = args.flip,
+                                                    image_size = args.image_size, cache_bytes = int(args.sample_cache * 2**30))
+    # samplers are None unless running distributed, in which case each rank sees its own shard.
+    # Shard datasets split themselves across ranks and workers and take no sampler.
+    train_sampler = make_sampler(train_dataset, shuffle = True) if not args.shards else None
+    if args.sampling != "uniform":
+        if train_sampler is not None:
+            raise RuntimeError("--sampling {} is not supported with --distributed".format(args.sampling))
+        if args.sampling == "balanced":
+            sample_index = SampleIndex.load_or_build(args.sample_index, train_dataset)
+            train_sampler = ClassBalancedSampler(sample_index, NUM_CLASSES, num_samples = args.epoch_samples)
+        else:
+            train_sampler = HardExampleSampler(len(train_dataset), num_samples = args.epoch_samples)
+    test_sampler = make_sampler(test_dataset, shuffle = False) if not args.shards else None
+    num_workers = args.workers if args.workers is not None else (4 if USE_CUDA else 0)
+    prefetch_factor = args.prefetch
+    if args.autotune_loader:
+        # rank 0 tunes (and writes the per machine cache), every rank uses its result
+        loader_config = autotune_loader(train_dataset, DEFAULT_BATCH) if is_main_process() else None
+        loader_config = broadcast_object(loader_config)
+        num_workers, prefetch_factor = loader_config["num_workers"], loader_config["prefetch_factor"]
+        print("loader: {} workers, prefetch {} ({:.2f} samples/sec)".format(num_workers, prefetch_factor, loader_config["samples_per_sec"]))
+    train_loader = make_loader(train_dataset, batch_size = DEFAULT_BATCH, sampler = train_sampler, device = DEFAULT_DEVICE,
+                               num_workers = num_workers, prefetch_factor = prefetch_factor)
+    test_loader = make_loader(test_dataset, batch_size = DEFAULT_BATCH, sampler = test_sampler, device = DEFAULT_DEVICE,
+                              num_workers = num_workers, prefetch_factor = prefetch_factor)
 
     # load dataset statistics
     data_statistics = DataStats(train_dataset, NUM_CLASSES)
@@ -89,25 +147,14 @@ if __name__ == '__main__':
     print("Initializing FCN for Segmentation...")
 
     #intialize model
-    networks = {"network1": Network_1, "network2": Network_2, "network3": Network_3, "network4": Network_4, "network5": Network_5, "network6": Network_6, "network7": Network_7, "network8": Network_8}
-    network = None
-    if args.load_dir:
-        if len(args.load_dir.split("/")) > 1:
-            network_key = args.load_dir.split("/")[1]
-            if network_key in networks:
-                network = networks[network_key]  # second subfolder contains network
-    if args.save_dir:
-        if len(args.save_dir.split("/")) > 1:
-            network_key = args.save_dir.split("/")[1]
-            if network_key in networks:
-                network = networks[network_key]
-         
-                
-
-    if not network:
+    # second subfolder contains network, the save location wins over the load location
+    network_key = network_name_from_path(args.save_dir) or network_name_from_path(args.load_dir)
+    if not network_key:
         raise RuntimeError("Please specify a model folder in which to save the current model.")
+    network = get_network(network_key)
 
-    segmentation_model = network(args.save_dir, NUM_CLASSES)
+    network_kwargs = {"full_transition": False} if network_key == "network8" and args.no_full_transition else {}
+    segmentation_model = network(args.save_dir, NUM_CLASSES, **network_kwargs)
 
     if not args.load_dir == '':
         try:
@@ -116,22 +163,77 @@ if __name__ == '__main__':
             print("Loading Legacy Model")
             segmentation_model.legacy_load(args.load_dir, DEFAULT_DEVICE)
     
+    metrics_log = None
+    if is_main_process():
+        metrics_log = MetricsLog(args.metrics_log or args.save_dir + ".metrics.csv", NUM_CLASSES)
+        segmentation_model.attach_metrics_log(metrics_log)
+
     # push model to either cpu or gpu
     segmentation_model.to(torch.device(DEFAULT_DEVICE))
     optimizer = optim.Adam(segmentation_model.parameters(), lr = args.lr, weight_decay = args.l2)
+    fast_validator = None
+    if args.fast_val and is_main_process():
+        val_index = SampleIndex.load_or_build(args.val_sample_index, test_dataset)
+        fast_validator = FastValidator(test_dataset, stratified_subset(val_index.fractions(NUM_CLASSES), args.fast_val), NUM_CLASSES,
+                                       pixel_fraction = args.fast_val_pixels, device = DEFAULT_DEVICE,
+                                       results_file = args.save_dir + ".fast_val.jsonl")
+    profiler = Profiler(enabled = args.profile is not None, device = DEFAULT_DEVICE)
+    if args.profile_layers:
+        profiler.attach_layer_hooks(segmentation_model)
     trainer = SegmentationTrainer(segmentation_model, DEFAULT_DEVICE, train_loader, test_loader, optimizer, data_statistics,
-                 num_classes = NUM_CLASSES, log_spacing = args.log_iters, per_class = args.per_class)
+                 num_classes = NUM_CLASSES, log_spacing = args.log_iters, per_class = args.per_class, profiler = profiler,
+                 fast_validator = fast_validator)
     print("Successful initialization!")
 
-    if not args.test:        
-        #train the model for a set number of epochs
-        for epoch in range(EPOCHS):
-            trainer.train(EPOCHS, args.start_idx)
-            segmentation_model.save()
-            #trainer.test(use_crf = args.use_crf, iters_per_log = args.log_iters, visualize = args.visualize_output, use_prior = args.prior)
-
-    else:
-        print("testing...")
-        trainer.test(use_crf = args.use_crf, iters_per_log = args.log_iters, visualize = args.visualize_output, use_prior = args.prior)
-        segmentation_model.save()
+    # the metrics log writes from a daemon thread, close it even if the run fails so queued rows reach the disk
+    try:
+        if not args.test:        
+            #train the model for a set number of epochs
+            for epoch in range(EPOCHS):
+                if hasattr(train_sampler, "set_epoch"):
+                    train_sampler.set_epoch(epoch)
+                if hasattr(train_dataset, "set_epoch"):
+                    train_dataset.set_epoch(epoch)
+                trainer.train(EPOCHS, args.start_idx)
+                if is_main_process():
+                    with profiler.stage("checkpoint"):
+                        segmentation_model.save()
+                #trainer.test(use_crf = args.use_crf, iters_per_log = args.log_iters, visualize = args.visualize_output, use_prior = args.prior)
+
+            if fast_validator is not None:
+                # finish the running evaluation, then evaluate the final checkpoint
+                trainer.report_fast_validation(fast_validator.close())
+                fast_validator.submit(segmentation_model.save_dir, segmentation_model.train_stats.step)
+                trainer.report_fast_validation(fast_validator.close())
+
+        elif fast_validator is not None:
+            print("fast validation...")
+            trainer.fast_test()
+
+        else:
+            print("testing...")
+            output_cache = None
+            if args.output_cache:
+                output_cache = OutputCache(args.output_cache, max_bytes = int(args.cache_size * 2**30), precision = args.cache_precision)
+            if args.pipelined:
+                if output_cache is not None:
+                    raise RuntimeError("--pipelined always runs the network and does not support --output-cache")
+                evaluator = PipelinedEvaluator(trainer, use_prior = args.prior, use_crf = args.use_crf, crf_workers = args.crf_workers,
+                                               crf_threshold = args.crf_threshold, crf_gate = args.crf_gate)
+                print_utilization(evaluator.run())
+            else:
+                trainer.test(use_crf = args.use_crf, iters_per_log = args.log_iters, visualize = args.visualize_output, use_prior = args.prior,
+                             output_cache = output_cache, crf_threshold = args.crf_threshold, crf_gate = args.crf_gate)
+            if is_main_process():
+                segmentation_model.save()
+
+        if args.profile is not None and is_main_process():
+            profiler.print_summary()
+            profiler.save_chrome_trace(args.profile + ".trace.json")
+            profiler.save_summary(args.profile + ".summary.json")
+    finally:
+        if metrics_log is not None:
+            metrics_log.close()
+
+    cleanup_distributed()
 
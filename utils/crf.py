@@ -3,13 +3,52 @@ import pydensecrf.densecrf as dcrf
 from pydensecrf.utils import unary_from_softmax
 from PIL import Image
 
-from utils.data_loading import load_datasets
 import torch
 
-def crf_batch_postprocessing(image_batch, output_batch, num_classes):
+# ===================================== Hyperparameters ========================================
+# define a compatability matrix for misclassifying objects
+# this matrix says it is 5x worse to classify drivable as not drivable
+# vs current lane as other lane
+CRF_DEFAULTS = {
+    3: {"compatability_matrix": [[0., .25, .25],
+                                 [.25, 0., .25],
+                                 [.25, 3., .25]],
+        "location_xy_stdev": 3,
+        "color_xy_stdev": 80,
+        "color_rgb_stdev": 13,
+        "bilateral_compat_scale": 1.5,
+        "num_smoothing_iters": 4},
+    2: {"compatability_matrix": [[0., .25],
+                                 [.25, 0.]],
+        "location_xy_stdev": 3,
+        "color_xy_stdev": 80,
+        "color_rgb_stdev": 13,
+        "bilateral_compat_scale": 1.5,
+        "num_smoothing_iters": 5},
+}
+# ==============================================================================================
+
+# gating: the CRF only runs where the network is unsure, see gated_crf_postprocessing
+GATE_MODES = ["image", "tile"]
+DEFAULT_TILE_SIZE = (160, 90)  # (width, height), an 8 x 8 grid on 1280 x 720 frames
+DEFAULT_TILE_MARGIN = 32  # pixels of context the CRF sees around uncertain tiles
+
+
+def crf_parameters(num_classes, params = None):
+    """
+    Returns the default CRF hyperparameters for num_classes, with any entries of params overriding them.
+    """
+    assert(num_classes in CRF_DEFAULTS), "CRF postprocessing only supports 2 and 3 classes"
+    parameters = dict(CRF_DEFAULTS[num_classes])
+    parameters.update(params or {})
+    return parameters
+
+
+def crf_batch_postprocessing(image_batch, output_batch, num_classes, params = None):
     """
     fcn_output (torch.tensor): a 3D pytorch log-softmax encoded tensor. The dimensions must be (k, num_classes = 3, width, height).
     original_image (torch.tensor): an RBG image represented as a torch tensor with dimensions (k, 3, width, height)
+    params (dict, optional): CRF hyperparameters overriding CRF_DEFAULTS
     """
 
     original_type = type(output_batch)
@@ -23,7 +62,7 @@ def crf_batch_postprocessing(image_batch, output_batch, num_classes):
     # run CRF on each image and output from the batch
     processed_batch = np.empty(output_batch.shape)
     for i in range(len(images)):
-        processed_batch[i, :, :, :] = crf_postprocessing(images[i, :, :, :], output_batch[i, :, :, :], num_classes)
+        processed_batch[i, :, :, :] = crf_postprocessing(images[i, :, :, :], output_batch[i, :, :, :], num_classes, params)
 
     return original_type(processed_batch).cuda() if use_cuda else original_type(processed_batch)
 
@@ -34,54 +73,146 @@ a processed, equivalent pytorch tensor.
 Args:
     fcn_output (np.array): a 3D numpy array that's one output of our FCN. The dimensions must be (num_classes = 3, width, height).
     original_image (np.array): the corresponding RBG image to our output; has with dimensions (3, width, height)
+    params (dict, optional): CRF hyperparameters overriding CRF_DEFAULTS, see crf_parameters
 
 Return:
     np.array: the new probability of each class for every pixel of the input. Output is formatted as
         a 3D log-softmax numpy array, with dimensions (num_classes = 3, width, height)
 """
-def crf_postprocessing(original_image, fcn_output, num_classes):
+def crf_postprocessing(original_image, fcn_output, num_classes, params = None):
+    params = crf_parameters(num_classes, params)
+    width, height = fcn_output.shape[1], fcn_output.shape[2]
+
     # create our CRF model
-    dense_crf = dcrf.DenseCRF2D(1280, 720, num_classes)  # width, height, nlabels
+    dense_crf = dcrf.DenseCRF2D(width, height, num_classes)  # width, height, nlabels
 
     # convert our softmax output into the unary PDF of our model
     unary_potentials = unary_from_softmax(fcn_output)
     dense_crf.setUnaryEnergy(unary_potentials.astype(np.float32))
 
-    # ===================================== Hyperparameters ========================================
-    # define a compatability matrix for misclassifying objects
-    # this matrix says it is 5x worse to classify drivable as not drivable
-    # vs current lane as other lane
-    if num_classes == 3:
-        compatability_matrix = np.array([[0., .25, .25],
-                                        [.25, 0., .25],
-                                        [.25, 3., .25]]).astype(np.float32)
-        location_xy_stdev = 3
-        color_xy_stdev = 80
-        color_rgb_stdev = 13
-        num_smoothing_iters = 4
-
-    elif num_classes == 2:
-        compatability_matrix = np.array([[0., .25],
-                                     [.25, 0.]]).astype(np.float32)
-        location_xy_stdev = 3
-        color_xy_stdev = 80
-        color_rgb_stdev = 13
-        num_smoothing_iters = 5
-
-    else:
-        assert(False), "CRF postprocessing only supports 2 and 3 classes"
-    
-    # ==============================================================================================
+    compatability_matrix = np.array(params["compatability_matrix"]).astype(np.float32)
+    location_xy_stdev = params["location_xy_stdev"]
+    color_xy_stdev = params["color_xy_stdev"]
+    color_rgb_stdev = params["color_rgb_stdev"]
+    num_smoothing_iters = params["num_smoothing_iters"]
 
     # add pairwise connections for smoothing pixel location in CRF
     dense_crf.addPairwiseGaussian(sxy = location_xy_stdev, compat = compatability_matrix)
 
     # add pairwise connections for Color similarity in CRF
-    dense_crf.addPairwiseBilateral(sxy = color_xy_stdev, srgb = color_rgb_stdev, rgbim = original_image.T.copy(order = 'C'), compat = compatability_matrix*1.5)
+    dense_crf.addPairwiseBilateral(sxy = color_xy_stdev, srgb = color_rgb_stdev, rgbim = original_image.T.copy(order = 'C'), compat = compatability_matrix*params["bilateral_compat_scale"])
 
     # run 5 iterations of the dense CRF filtering
     Q = dense_crf.inference(num_smoothing_iters)
-    log_probabilities = np.log(np.array(Q).reshape((num_classes, 1280, 720)))
+    log_probabilities = np.log(np.array(Q).reshape((num_classes, width, height)))
 
     # convert our output to be the same type as the original pytorch tensor
     return log_probabilities
+
+
+def uncertainty_map(probabilities):
+    """
+    Per pixel uncertainty 1 - max class probability, 0 when the network is sure and 1 - 1/num_classes at most.
+
+    Args:
+        probabilities (np.array): softmax output, dims = (num_classes, width, height)
+    Returns:
+        np.array: dims = (width, height)
+    """
+    return 1. - probabilities.max(axis = 0)
+
+
+def uncertain_regions(tile_uncertainty, threshold):
+    """
+    Groups the tiles whose mean uncertainty exceeds threshold into 4-connected regions.
+
+    Returns:
+        list: (tiles, (first column, last column + 1, first row, last row + 1)) per region, tiles being the
+            list of (column, row) tiles in the region
+    """
+    uncertain = tile_uncertainty > threshold
+    seen = np.zeros(uncertain.shape, dtype = bool)
+    regions = []
+    for start in zip(*np.nonzero(uncertain)):
+        if seen[start]:
+            continue
+        seen[start] = True
+        tiles, stack = [], [start]
+        while stack:
+            i, j = stack.pop()
+            tiles.append((i, j))
+            for neighbour in ((i - 1, j), (i + 1, j), (i, j - 1), (i, j + 1)):
+                if 0 <= neighbour[0] < uncertain.shape[0] and 0 <= neighbour[1] < uncertain.shape[1] \
+                        and uncertain[neighbour] and not seen[neighbour]:
+                    seen[neighbour] = True
+                    stack.append(neighbour)
+        columns, rows = [tile[0] for tile in tiles], [tile[1] for tile in tiles]
+        regions.append((tiles, (min(columns), max(columns) + 1, min(rows), max(rows) + 1)))
+    return regions
+
+
+def gated_crf_postprocessing(original_image, fcn_output, num_classes, params = None, threshold = .1, mode = "tile",
+                             tile_size = DEFAULT_TILE_SIZE, margin = DEFAULT_TILE_MARGIN):
+    """
+    Runs the dense CRF only where the network is uncertain; confident pixels keep the network prediction.
+
+    Args:
+        original_image (np.array): see crf_postprocessing
+        fcn_output (np.array): softmax probabilities, dims = (num_classes, width, height)
+        threshold (float): mean uncertainty (see uncertainty_map) above which an image or tile is refined
+        mode (string): "image" refines whole images, "tile" refines the bounding box of every group of uncertain
+            tiles, with margin pixels of context, and keeps the result for the uncertain tiles only
+        tile_size (tuple): (width, height) of the tiles
+    Return:
+        (np.array, float): log-probabilities like crf_postprocessing, and the fraction of pixels refined
+    """
+    if mode not in GATE_MODES:
+        raise ValueError("Expected mode to be one of {}, got {}".format(GATE_MODES, mode))
+    log_probabilities = np.log(np.maximum(fcn_output, 1e-10))
+    uncertainty = uncertainty_map(fcn_output)
+    width, height = uncertainty.shape
+
+    if mode == "image":
+        if uncertainty.mean() <= threshold:
+            return log_probabilities, 0.
+        return crf_postprocessing(original_image, fcn_output, num_classes, params), 1.
+
+    tile_width, tile_height = tile_size
+    columns, rows = -(-width // tile_width), -(-height // tile_height)
+    tile_uncertainty = np.zeros((columns, rows))
+    for i in range(columns):
+        for j in range(rows):
+            tile_uncertainty[i, j] = uncertainty[i * tile_width:(i + 1) * tile_width, j * tile_height:(j + 1) * tile_height].mean()
+
+    refined_pixels = 0
+    for tiles, (i0, i1, j0, j1) in uncertain_regions(tile_uncertainty, threshold):
+        x0, x1 = max(i0 * tile_width - margin, 0), min(i1 * tile_width + margin, width)
+        y0, y1 = max(j0 * tile_height - margin, 0), min(j1 * tile_height + margin, height)
+        region = crf_postprocessing(original_image[:, x0:x1, y0:y1], np.ascontiguousarray(fcn_output[:, x0:x1, y0:y1]),
+                                    num_classes, params)
+        for i, j in tiles:
+            tx0, tx1 = i * tile_width, min((i + 1) * tile_width, width)
+            ty0, ty1 = j * tile_height, min((j + 1) * tile_height, height)
+            log_probabilities[:, tx0:tx1, ty0:ty1] = region[:, tx0 - x0:tx1 - x0, ty0 - y0:ty1 - y0]
+            refined_pixels += (tx1 - tx0) * (ty1 - ty0)
+    return log_probabilities, refined_pixels / float(width * height)
+
+
+def gated_crf_batch_postprocessing(image_batch, output_batch, num_classes, params = None, threshold = .1, mode = "tile",
+                                   tile_size = DEFAULT_TILE_SIZE, margin = DEFAULT_TILE_MARGIN):
+    """
+    Batch version of gated_crf_postprocessing taking the same tensors as crf_batch_postprocessing.
+
+    Returns:
+        (torch.tensor, float): the log-probabilities on the device of output_batch, and the mean fraction of
+            pixels refined
+    """
+    images = image_batch.cpu().numpy().astype(np.uint8)
+    probabilities = torch.exp(output_batch).cpu().numpy()
+    processed_batch = np.empty(probabilities.shape, dtype = np.float32)
+    refined = []
+    for i in range(len(images)):
+        processed_batch[i], fraction = gated_crf_postprocessing(images[i], probabilities[i], num_classes, params, threshold,
+                                                                mode, tile_size, margin)
+        refined.append(fraction)
+    return torch.from_numpy(processed_batch).to(output_batch.device), float(np.mean(refined))
@@ -1,8 +1,6 @@
-from torchvision import transforms
 import torch.utils.data as data
 import torch
 
-import matplotlib.pyplot as plt
 import numpy as np
 from PIL import Image
 
@@ -10,6 +8,8 @@ import os
 import os.path
 import sys
 
+from utils.sample_cache import SharedSampleCache
+
 IMG_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.ppm', '.bmp', '.pgm', '.tif']
 
 # ======================================================================================#
@@ -87,19 +87,80 @@ def make_dataset(image_dir, semantic_image_labels_dir):
 # =====================================================================================#
 # =========================== Loaders used to load images =============================#
 # =====================================================================================#
-def pil_loader(path):
+def output_size(full_size, size = None, box = None):
+    """
+    Size of a loaded image given the full (width, height) of the file, the (width, height) the full
+    frame is requested at and the (left, upper, right, lower) box to keep in full frame coordinates.
+    """
+    if box is None:
+        box = (0, 0, full_size[0], full_size[1])
+    if size is None:
+        size = full_size
+    return (int(round((box[2] - box[0]) * size[0] / float(full_size[0]))),
+            int(round((box[3] - box[1]) * size[1] / float(full_size[1]))))
+
+
+def pil_loader(path, size = None, box = None):
+    """
+    Args:
+        path (string): path to the image
+        size (tuple, optional): (width, height) to load the full frame at. JPEGs are put in draft mode so
+            libjpeg downscales by 1/2, 1/4 or 1/8 in the DCT domain instead of decoding every pixel.
+        box (tuple, optional): (left, upper, right, lower) region to keep, in full frame coordinates. It is
+            cut out before the RGB conversion so only the region is converted.
+    """
     # open path as file to avoid ResourceWarning (https://github.com/python-pillow/Pillow/issues/835)
     with open(path, 'rb') as f:
-        img = Image.open(f)
+        return pil_decode(f, size, box)
+
+
+def pil_decode(f, size = None, box = None):
+    """
+    Decodes an image from an open binary file object, see ``pil_loader``.
+    """
+    img = Image.open(f)
+    if size is None and box is None:
         return img.convert('RGB')
 
+    full_size = img.size
+    if size is not None and img.format == 'JPEG':
+        img.draft('RGB', tuple(size))  # picks the smallest DCT scale that is still >= size
 
-def pil_black_and_white_loader(path):
+    if box is not None:
+        draft_x, draft_y = img.size[0] / float(full_size[0]), img.size[1] / float(full_size[1])
+        img = img.crop((int(round(box[0] * draft_x)), int(round(box[1] * draft_y)),
+                        int(round(box[2] * draft_x)), int(round(box[3] * draft_y))))
+    img = img.convert('RGB')
+
+    target_size = output_size(full_size, size, box)
+    if img.size != target_size:
+        img = img.resize(target_size, Image.BILINEAR)
+    return img
+
+
+def pil_black_and_white_loader(path, size = None, box = None):
+    """
+    Loads a label image. ``size`` and ``box`` match ``pil_loader``, but the label is downscaled with nearest
+    neighbour so that it only contains valid class ids.
+    """
     with open(path, 'rb') as f:
-        img = Image.open(f)
-        x = img.crop((0, 0, 1, 1))
-        #x.show()
-        return img
+        return pil_label_decode(f, size, box)
+
+
+def pil_label_decode(f, size = None, box = None):
+    """
+    Decodes a label image from an open binary file object, see ``pil_black_and_white_loader``.
+    """
+    img = Image.open(f)
+    img.load()  # the file may be closed once we return
+    full_size = img.size
+    if box is not None:
+        img = img.crop(box)
+
+    target_size = output_size(full_size, size, box)
+    if img.size != target_size:
+        img = img.resize(target_size, Image.NEAREST)
+    return img
 
 
 def accimage_loader(path):
@@ -111,12 +172,12 @@ def accimage_loader(path):
         return pil_loader(path)
 
 
-def default_loader(path):
+def default_loader(path, size = None, box = None):
     from torchvision import get_image_backend
-    if get_image_backend() == 'accimage':
+    if get_image_backend() == 'accimage' and size is None and box is None:
         return accimage_loader(path)
     else:
-        return pil_loader(path)
+        return pil_loader(path, size, box)
 
 # ======================================================================================#
 # ======================================================================================#
@@ -125,6 +186,28 @@ def default_loader(path):
 # =====================================================================================#
 # =============================== Create Dataset Class ================================#
 # =====================================================================================#
+def make_sample(raw_sample, target, transform = None, augmentation = None):
+    """
+    Turns a decoded uint8 image (height, width, 3) and label (height, width) into the (raw_sample, sample, target)
+    tensors every dataset returns, with dims (3, width, height) and (width, height).
+    """
+    # crop/scale/flip BOTH image and target while they are still uint8
+    if augmentation is not None:
+        raw_sample, target = augmentation(raw_sample, target)
+
+    # perform equivalent transform on BOTH image and target
+    if transform is not None:
+        sample, target = transform(raw_sample.astype(np.float64), target)
+    else:
+        sample = raw_sample
+
+    raw_sample = torch.LongTensor(raw_sample.T)
+    target = torch.LongTensor(target.T)
+    sample = torch.FloatTensor(sample.T)
+
+    return raw_sample, sample, target
+
+
 class DeepDriveDataset(data.Dataset):
     # loaders for Deep Drive Images and Drivable Maps Labels
     IMAGE_LOADER = default_loader
@@ -141,11 +224,20 @@ class DeepDriveDataset(data.Dataset):
         semantic_image_labels_dir (string): Root directory path of image-labels
         transform (callable, optional): A function/transform that  takes in an PIL image
             and returns a transformed version. E.g, ``transforms.RandomCrop``
+        augmentation (callable, optional): A function that takes in the uint8 image and label arrays and
+            returns them with the same geometric change applied, e.g. ``make_augmentation``. It runs
+            before ``transform`` so the float conversion only touches the augmented region. With an
+            ``Augmentation`` and no sample_cache, only the cropped region of the files is decoded.
+        image_size (tuple, optional): (width, height) to load frames at. Images are draft decoded and labels
+            downscaled with nearest neighbour; full resolution if None.
+        sample_cache (SharedSampleCache, optional): shared cache of decoded frames, consulted before decoding.
+            Augmentation and transforms run after it, so random crops still differ between epochs.
 
      Attributes:
         samples (list): List of (image path, class_index) tuples
     """
-    def __init__(self, image_dir, semantic_image_labels_dir, transform = None):
+    def __init__(self, image_dir, semantic_image_labels_dir, transform = None, augmentation = None, image_size = None,
+                 sample_cache = None):
         # get all of our data
         samples = make_dataset(image_dir, semantic_image_labels_dir)
         if len(samples) == 0:
@@ -155,6 +247,9 @@ class DeepDriveDataset(data.Dataset):
         self.root = image_dir
         self.samples = samples
         self.transform = transform
+        self.augmentation = augmentation
+        self.image_size = image_size
+        self.sample_cache = sample_cache
         self.target_transform = None
 
     def __getitem__(self, index):
@@ -167,21 +262,36 @@ class DeepDriveDataset(data.Dataset):
             each pixel labeled as 0 or 1 for the 3 classes: not drivable area, drivable other lanes, and drivable
             current lane.
         """
-        sample_path, target_path = self.samples[index]
-        raw_sample = default_loader(sample_path)
-        target = pil_black_and_white_loader(target_path)
+        if self.sample_cache is None and isinstance(self.augmentation, Augmentation):
+            return self.load_region(index)
 
-        # perform equivalent transform on BOTH image and target 
-        if self.transform is not None:
-            sample, target = self.transform(np.array(raw_sample, dtype = np.float64), np.array(target))
+        cached = self.sample_cache.get(index) if self.sample_cache is not None else None
+        if cached is not None:
+            raw_sample, target = cached
         else:
-            sample, target = np.array(sample), np.array(target)
-
-        raw_sample = torch.LongTensor(np.array(raw_sample).T)
-        target = torch.LongTensor(target.T)
-        sample = torch.FloatTensor(sample.T)
-
-        return raw_sample, sample, target
+            sample_path, target_path = self.samples[index]
+            raw_sample = np.array(default_loader(sample_path, self.image_size), dtype = np.uint8)
+            target = np.array(pil_black_and_white_loader(target_path, self.image_size), dtype = np.uint8)
+            if self.sample_cache is not None:
+                self.sample_cache.put(index, raw_sample, target)
+        return make_sample(raw_sample, target, self.transform, self.augmentation)
+
+    def load_region(self, index):
+        """
+        Draws the augmentation's crop first and decodes only that region of the image and label, instead of
+        decoding the whole frame and cropping it afterwards.
+        """
+        sample_path, target_path = self.samples[index]
+        with Image.open(target_path) as label:  # only reads the header
+            full_size = label.size
+        size = tuple(self.image_size) if self.image_size is not None else full_size
+        box, flip = self.augmentation.sample(size[0], size[1])
+        # the loaders take the box in full frame coordinates
+        full_box = tuple(int(round(box[i] * full_size[i % 2] / float(size[i % 2]))) for i in range(4))
+        raw_sample = np.array(pil_loader(sample_path, self.image_size, full_box), dtype = np.uint8)
+        target = np.array(pil_black_and_white_loader(target_path, self.image_size, full_box), dtype = np.uint8)
+        raw_sample, target = self.augmentation.finish(raw_sample, target, flip, self.augmentation.output_size(size[0], size[1]))
+        return make_sample(raw_sample, target, self.transform)
 
 
     '''
@@ -199,6 +309,7 @@ class DeepDriveDataset(data.Dataset):
         fmt_str += '    Root Location: {}\n'.format(self.root)
         tmp = '    Transforms (if any): '
         fmt_str += '{0}{1}\n'.format(tmp, self.transform.__repr__().replace('\n', '\n' + ' ' * len(tmp)))
+        fmt_str += '    Augmentation (if any): {}\n'.format(self.augmentation.__repr__())
         return fmt_str
 
 # ======================================================================================#
@@ -212,26 +323,98 @@ class DeepDriveDataset(data.Dataset):
 '''
 Takes in the width and height of all images, as well as the width and height for each
 image to be cropped to. Returns a function that, given a tuple of images, returns a tuple
-of each image cropped to the same random section. The random section has (crop_width by crop_height).
+of each image cropped to the same random section. The random section has (crop_width by crop_height)
+and is drawn again on every call.
 '''
 def random_crop_images(width, height, crop_width, crop_height):
     if crop_width > width or crop_height > height:
         raise ValueError("The crop size must be smaller than the image size.")
 
-    i = np.random.randint(0, width - crop_width) if width != crop_width else 0
-    j = np.random.randint(0, height - crop_height) if height != crop_height else 0
-
     """
-    Obsolete: takes in image and target as PIL images, and not numpy arrays --> does not work
-        with current code!
+    Takes in image and target as numpy arrays with dims (height, width, 3) and (height, width).
+    Slicing returns views, so nothing is copied until the arrays are converted.
     """
     def crop_images(image, target):
-        cropped_image = transforms.functional.crop(image, i, j, crop_height, crop_width)
-        cropped_target = target.crop((i, j, i + crop_height, j + crop_width))
-        return (cropped_image, cropped_target)
+        i = np.random.randint(0, width - crop_width + 1)
+        j = np.random.randint(0, height - crop_height + 1)
+        return (image[j:j + crop_height, i:i + crop_width], target[j:j + crop_height, i:i + crop_width])
 
     return crop_images
 
+
+class Augmentation:
+    '''
+    Applies a random crop, scale and horizontal flip to an image and its label with identical geometry. Works on
+    uint8 numpy arrays, and crops before resizing so that only the needed region is ever resized or converted to
+    floats. The label is resized with nearest neighbour so it only ever contains valid class ids.
+
+    Calling it augments already decoded arrays. DeepDriveDataset instead draws the region with sample, decodes only
+    that region of the files, and finishes the resize and flip with finish.
+
+    Note that the FCNs downsample by 16, so crop sizes should be multiples of 16 (Network_8 only supports
+    full 1280 x 720 frames).
+
+    Args:
+        crop_size (tuple, optional): (crop_width, crop_height) of the output, the full frame if None
+        scale_range (tuple): (min_scale, max_scale) zoom factor drawn uniformly for every sample. A scale
+            above 1 crops a smaller region and enlarges it to the crop size.
+        flip (bool): flip the image and label horizontally with probability 0.5
+    '''
+    def __init__(self, crop_size = None, scale_range = (1., 1.), flip = False):
+        if scale_range[0] <= 0 or scale_range[0] > scale_range[1]:
+            raise ValueError("Expected 0 < min_scale <= max_scale, got {}".format(scale_range))
+        self.crop_size = crop_size
+        self.scale_range = scale_range
+        self.flip = flip
+
+    def output_size(self, width, height):
+        return tuple(self.crop_size) if self.crop_size is not None else (width, height)
+
+    def sample(self, width, height):
+        """
+        Draws the (left, upper, right, lower) source region of a (width x height) frame and whether to flip it.
+        """
+        crop_width, crop_height = self.output_size(width, height)
+        # size of the region in the source image that ends up as the crop
+        scale = np.random.uniform(self.scale_range[0], self.scale_range[1])
+        source_width = min(width, int(round(crop_width / scale)))
+        source_height = min(height, int(round(crop_height / scale)))
+        if crop_width > width or crop_height > height:
+            raise ValueError("The crop size must be smaller than the image size.")
+        left = np.random.randint(0, width - source_width + 1)
+        upper = np.random.randint(0, height - source_height + 1)
+        return (left, upper, left + source_width, upper + source_height), self.flip and np.random.rand() < .5
+
+    def finish(self, image, target, flip, output_size):
+        """
+        Resizes a cropped image and label to output_size (width, height) and flips them.
+        """
+        if target.shape[:2] != (output_size[1], output_size[0]):
+            image = np.asarray(Image.fromarray(np.ascontiguousarray(image)).resize(output_size, Image.BILINEAR))
+            target = np.asarray(Image.fromarray(np.ascontiguousarray(target)).resize(output_size, Image.NEAREST))
+
+        if flip:
+            image, target = image[:, ::-1], target[:, ::-1]
+
+        return (np.ascontiguousarray(image), np.ascontiguousarray(target))
+
+    def __call__(self, image, target):
+        height, width = target.shape[:2]
+        (left, upper, right, lower), flip = self.sample(width, height)
+        # slicing returns views, so nothing is copied until the arrays are resized or made contiguous
+        image, target = image[upper:lower, left:right], target[upper:lower, left:right]
+        return self.finish(image, target, flip, self.output_size(width, height))
+
+    def __repr__(self):
+        return "Augmentation(crop_size = {}, scale_range = {}, flip = {})".format(self.crop_size, self.scale_range, self.flip)
+
+
+def make_augmentation(crop_size = None, scale_range = (1., 1.), flip = False):
+    '''
+    Returns an Augmentation that applies a random crop, scale and horizontal flip, see ``Augmentation``.
+    '''
+    return Augmentation(crop_size, scale_range, flip)
+
 def normalize_pixel_values(image, target):
     """
     Subtracts out the mean for each RGB value of the image, and returns a new
@@ -269,7 +452,7 @@ def preprocess_two_classes(image, target):
 
 def load_datasets(image_dir = "C:/Users/cstea/Documents/6.867 Final Project/bdd100k_images/bdd100k/images/100k",
                  label_dir = "C:/Users/cstea/Documents/6.867 Final Project/bdd100k_drivable_maps/bdd100k/drivable_maps/labels",
-                 num_classes = 3):
+                 num_classes = 3, crop_size = None, scale_range = (1., 1.), flip = False, image_size = None, cache_bytes = 0):
     '''
     Loads the Berkeley Deep Drive Datasets into a pytorch data.Dataset class. Currently has structure of Berkeley Data Folders
     hard coded into loading scheme, and therefore, this function will fail if one modifies the folder structure of the data.
@@ -278,20 +461,38 @@ def load_datasets(image_dir = "C:/Users/cstea/Documents/6.867 Final Project/bdd1
         image_dir (string): the local machine's directory containing the "100k" images
         label_dir (string): the local machine's directory containing the "100k" drivable map --> labels (Note that these png images
             have pixel values of 0 if that pixel is not drivable road area, and 1 if it is)
+        crop_size (tuple, optional): (crop_width, crop_height) to randomly crop training samples to. The test set
+            always uses full frames.
+        scale_range (tuple): (min_scale, max_scale) for multi-scale training, see ``make_augmentation``
+        flip (bool): randomly flip training samples horizontally
+        image_size (tuple, optional): (width, height) to decode training frames at, e.g. (640, 360). Crops are
+            taken from the downscaled frame. The test set stays at full resolution since the prior and
+            CRF assume 1280 x 720.
+        cache_bytes (int): if > 0, each dataset gets a SharedSampleCache of this many bytes for decoded frames
     '''
+    augmentation = None
+    if crop_size is not None or tuple(scale_range) != (1., 1.) or flip:
+        augmentation = make_augmentation(crop_size, scale_range, flip)
 
     # load train and test datasets given my PC's folder paths
     if num_classes == 3:
-        train_dataset = DeepDriveDataset(image_dir + "/train", label_dir + "/train", transform = normalize_pixel_values) 
+        train_dataset = DeepDriveDataset(image_dir + "/train", label_dir + "/train", transform = normalize_pixel_values,
+                                         augmentation = augmentation, image_size = image_size)
         test_dataset = DeepDriveDataset(image_dir + "/val", label_dir + "/val", transform = normalize_pixel_values)
 
     elif num_classes == 2:
-        train_dataset = DeepDriveDataset(image_dir + "/train", label_dir + "/train", transform = preprocess_two_classes) 
+        train_dataset = DeepDriveDataset(image_dir + "/train", label_dir + "/train", transform = preprocess_two_classes,
+                                         augmentation = augmentation, image_size = image_size)
         test_dataset = DeepDriveDataset(image_dir + "/val", label_dir + "/val", transform = preprocess_two_classes)
 
     else:
         assert(False), "Expected num classes to be either 2 or 3"
 
+    # allocated here, before any DataLoader worker starts, so that all workers share the same memory
+    if cache_bytes > 0:
+        train_dataset.sample_cache = SharedSampleCache(len(train_dataset), cache_bytes, image_size or (1280, 720))
+        test_dataset.sample_cache = SharedSampleCache(len(test_dataset), cache_bytes)
+
     return train_dataset, test_dataset
 
 
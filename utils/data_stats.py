@@ -1,8 +1,6 @@
-from torchvision import transforms
 import torch.utils.data as data
 import torch
 from utils.data_loading import DeepDriveDataset, load_datasets
-import dill
 from tqdm import tqdm
 import sys
 import pickle
@@ -76,6 +74,7 @@ class DataStats:
         self.class_distribution /= len(self.dataset)
         self.mean_rgb /= len(self.dataset)
 
+        import dill
         with open(outfile, "wb") as ofile:
             #save statistics
             dill.dump([self.class_distribution, self.mean_rgb], ofile)
@@ -84,6 +83,7 @@ class DataStats:
         r"""
         Loads statistics stored in infile
         """
+        import dill
         with open(infile, "rb") as ifile:
             self.class_distribution, self.mean_rgb = dill.load(ifile)
         
@@ -0,0 +1,108 @@
+import torch
+import numpy as np
+import struct
+
+"""
+Compact encodings of drivable-area labels. Labels only hold 2 or 3 class ids with long horizontal runs, so a frame
+takes 1 bit (2 classes) or 2 bits (3 classes) per pixel, or a few hundred runs with run length encoding, instead of
+a PNG that has to be inflated and then widened to int64. Every encoding decodes with a handful of vectorized numpy
+operations straight into the uint8 (height, width) array or the int64 (width, height) tensor the trainer uses.
+
+    bits  1 bit per pixel, 2 class labels only
+    2bit  2 bits per pixel, up to 4 classes
+    rle   (value, run length) pairs over the row-major pixels
+
+An encoded label starts with a header of magic, method, height and width.
+"""
+
+MAGIC = b"LBL1"
+HEADER = struct.Struct("<4sBHH")
+METHODS = ["bits", "2bit", "rle"]
+
+
+def choose_method(label):
+    """
+    Picks the smallest encoding: run length when there are few runs, bit-packing otherwise.
+    """
+    flat = label.ravel()
+    num_runs = 1 + np.count_nonzero(flat[1:] != flat[:-1])
+    packed_bytes = flat.size // 8 if flat.max() < 2 else flat.size // 4
+    if num_runs * 5 + 4 < packed_bytes:  # uint8 value + uint32 length per run, uint32 count
+        return "rle"
+    return "bits" if flat.max() < 2 else "2bit"
+
+
+def encode_label(label, method = None):
+    """
+    Args:
+        label (np.array): class ids, dims = (height, width)
+        method (string, optional): one of METHODS, picked by ``choose_method`` if None
+    Returns:
+        bytes: the encoded label
+    """
+    label = np.ascontiguousarray(label, dtype = np.uint8)
+    height, width = label.shape
+    flat = label.ravel()
+    method = method or choose_method(label)
+
+    if method == "bits":
+        if flat.max() > 1:
+            raise ValueError("bit packing only supports 2 class labels, found class {}".format(flat.max()))
+        payload = np.packbits(flat).tobytes()
+    elif method == "2bit":
+        if flat.max() > 3:
+            raise ValueError("2 bit packing supports up to 4 classes, found class {}".format(flat.max()))
+        padded = np.zeros(-(-flat.size // 4) * 4, dtype = np.uint8)
+        padded[:flat.size] = flat
+        quads = padded.reshape(-1, 4)
+        payload = (quads[:, 0] | (quads[:, 1] << 2) | (quads[:, 2] << 4) | (quads[:, 3] << 6)).astype(np.uint8).tobytes()
+    elif method == "rle":
+        starts = np.concatenate([[0], np.flatnonzero(flat[1:] != flat[:-1]) + 1])
+        lengths = np.diff(np.append(starts, flat.size)).astype(np.uint32)
+        payload = struct.pack("<I", len(starts)) + flat[starts].tobytes() + lengths.tobytes()
+    else:
+        raise ValueError("Expected method to be one of {}, got {}".format(METHODS, method))
+
+    return HEADER.pack(MAGIC, METHODS.index(method), height, width) + payload
+
+
+def decode_label(buffer, dtype = np.uint8):
+    """
+    Returns the (height, width) label array encoded in buffer.
+    """
+    magic, method, height, width = HEADER.unpack_from(buffer)
+    if magic != MAGIC:
+        raise ValueError("Not an encoded label")
+    payload = np.frombuffer(buffer, dtype = np.uint8, offset = HEADER.size)
+    size = height * width
+
+    if METHODS[method] == "bits":
+        flat = np.unpackbits(payload, count = size)
+    elif METHODS[method] == "2bit":
+        flat = np.stack([(payload >> shift) & 3 for shift in (0, 2, 4, 6)], axis = 1).ravel()[:size]
+    else:
+        num_runs = struct.unpack_from("<I", buffer, HEADER.size)[0]
+        values = payload[4:4 + num_runs]
+        lengths = np.frombuffer(buffer, dtype = np.uint32, count = num_runs, offset = HEADER.size + 4 + num_runs)
+        flat = np.repeat(values, lengths)
+    return flat.reshape(height, width).astype(dtype, copy = False)
+
+
+def decode_label_tensor(buffer):
+    """
+    Returns the encoded label as the int64 (width, height) tensor DeepDriveDataset produces.
+    """
+    return torch.from_numpy(decode_label(buffer, np.int64).T)
+
+
+def save_label(path, label, method = None):
+    """
+    Writes a label or a predicted mask, dims = (height, width), to path in the compact format.
+    """
+    with open(path, "wb") as f:
+        f.write(encode_label(label, method))
+
+
+def load_label(path, dtype = np.uint8):
+    with open(path, "rb") as f:
+        return decode_label(f.read(), dtype)
@@ -0,0 +1,112 @@
+import torch
+from torch.utils.data import DataLoader, IterableDataset
+import argparse
+import itertools
+import json
+import os
+import platform
+import time
+
+"""
+Central place to build DataLoaders for the DeepDriveDataset. Enables pinned memory when training on the GPU,
+keeps worker processes alive between epochs and sets the prefetch depth. The worker count and prefetch factor can be
+autotuned on the current machine; the best configuration is cached per host so it is only measured once.
+
+    python -m utils.loader_factory <image_dir> <label_dir> --batch_size 1
+"""
+
+DEFAULT_CONFIG_FILE = os.path.join(os.path.expanduser("~"), ".cache", "deepdrive_loader.json")
+
+
+def make_loader(dataset, batch_size = 1, shuffle = False, sampler = None, device = "cpu", num_workers = 0, prefetch_factor = 2):
+    """
+    Args:
+        dataset (data.Dataset): dataset to load from
+        device (string): where batches go; pinned memory is only used for cuda, where it enables non-blocking copies
+        num_workers (int): decode processes, 0 decodes in the main process
+        prefetch_factor (int): batches loaded ahead by each worker
+    """
+    loader_kwargs = {}
+    if num_workers > 0:
+        loader_kwargs = {"persistent_workers": True, "prefetch_factor": prefetch_factor}
+    return DataLoader(dataset, batch_size = batch_size, shuffle = shuffle, sampler = sampler, num_workers = num_workers,
+                      pin_memory = torch.device(device).type == "cuda", **loader_kwargs)
+
+
+def measure_throughput(dataset, batch_size, num_workers, prefetch_factor, num_batches = 20, warmup = 3):
+    """
+    Returns samples per second of a loader with the given settings, leaving out worker start up. Stops early on
+    datasets with fewer than warmup + num_batches batches and times only the batches it saw, 0 if fewer than two.
+    """
+    shuffle = not isinstance(dataset, IterableDataset)  # iterable datasets shuffle themselves
+    loader = make_loader(dataset, batch_size = batch_size, shuffle = shuffle, num_workers = num_workers, prefetch_factor = prefetch_factor)
+    samples, timed_batches = 0, 0
+    start = time.time()  # restarted once the warmup batches are in, so only fetches after them are timed
+    for batch_idx, batch in enumerate(loader):
+        if batch_idx < warmup:
+            start = time.time()
+            continue
+        samples += len(batch[0])
+        timed_batches += 1
+        if timed_batches >= num_batches:
+            break
+    elapsed = time.time() - start
+    del loader
+    return samples / elapsed if timed_batches >= 2 and elapsed > 0 else 0.
+
+
+def config_key(dataset, batch_size):
+    return "{}:{}:{}:{}".format(platform.node(), os.cpu_count(), type(dataset).__name__, batch_size)
+
+
+def autotune_loader(dataset, batch_size = 1, worker_counts = None, prefetch_factors = (2, 4, 8), num_batches = 20,
+                    config_file = DEFAULT_CONFIG_FILE, retune = False, verbose = True):
+    """
+    Measures samples/sec across worker counts and prefetch depths and returns the fastest as
+    {"num_workers", "prefetch_factor", "samples_per_sec"}. Results are cached in config_file per host, dataset type
+    and batch size.
+    """
+    cache = {}
+    if os.path.exists(config_file):
+        with open(config_file) as f:
+            cache = json.load(f)
+    key = config_key(dataset, batch_size)
+    if key in cache and not retune:
+        return cache[key]
+
+    if worker_counts is None:
+        cpus = os.cpu_count() or 1
+        worker_counts = sorted(set([0] + [count for count in (1, 2, 4, 8, 16, 32) if count <= cpus]))
+
+    best = None
+    for num_workers, prefetch_factor in itertools.product(worker_counts, prefetch_factors):
+        if num_workers == 0 and prefetch_factor != prefetch_factors[0]:
+            continue  # prefetching only applies to worker processes
+        samples_per_sec = measure_throughput(dataset, batch_size, num_workers, prefetch_factor, num_batches)
+        if verbose:
+            print(" workers {:2d} | prefetch {} | {:8.2f} samples/sec".format(num_workers, prefetch_factor, samples_per_sec))
+        if best is None or samples_per_sec > best["samples_per_sec"]:
+            best = {"num_workers": num_workers, "prefetch_factor": prefetch_factor, "samples_per_sec": samples_per_sec}
+
+    cache[key] = best
+    os.makedirs(os.path.dirname(config_file), exist_ok = True)
+    with open(config_file, "w") as f:
+        json.dump(cache, f, indent = 2, sort_keys = True)
+    return best
+
+
+if __name__ == '__main__':
+    from utils.data_loading import load_datasets
+
+    parser = argparse.ArgumentParser(description = 'Autotune DataLoader workers and prefetch depth on this machine')
+    parser.add_argument('image_dir', type = str, help = "directory containing the train/val images")
+    parser.add_argument('label_dir', type = str, help = "directory containing the train/val labels")
+    parser.add_argument('--batch_size', type = int, default = 1)
+    parser.add_argument('--batches', type = int, default = 20, help = "timed batches per setting")
+    parser.add_argument('--config-file', dest = "config_file", type = str, default = DEFAULT_CONFIG_FILE)
+    args = parser.parse_args()
+
+    train_dataset, _ = load_datasets(args.image_dir, args.label_dir)
+    best = autotune_loader(train_dataset, args.batch_size, num_batches = args.batches, config_file = args.config_file, retune = True)
+    print("best: {} workers, prefetch {} ({:.2f} samples/sec), saved to {}".format(best["num_workers"], best["prefetch_factor"],
+          best["samples_per_sec"], args.config_file))
@@ -0,0 +1,100 @@
+import torch
+import torch.multiprocessing as mp
+
+"""
+Shared-memory LRU cache of decoded samples. DeepDriveDataset decodes a JPEG and a PNG for every __getitem__, so
+short epochs and repeated evaluations over the same subset decode the same frames again in every DataLoader
+worker. The cache holds the decoded uint8 image and label in fixed size slots of one shared memory buffer that is
+allocated before the workers start, so a frame decoded by one worker is a hit for all of them.
+
+All state (slots, the index -> slot table, last use ticks and counters) lives in shared tensors guarded by one
+lock. The lock comes from the default multiprocessing context, so the cache is shared with DataLoader workers
+started by fork (the default on Linux) only; a spawned process has to drop it, see FastValidator.__getstate__.
+"""
+
+class SharedSampleCache:
+    """
+    Args:
+        num_samples (int): length of the dataset, indices are looked up in a table of this size
+        max_bytes (int): byte budget of the slots, least recently used samples are evicted past it
+        frame_size (tuple): (width, height) samples are decoded at. Samples of any other size are not cached.
+    """
+    def __init__(self, num_samples, max_bytes, frame_size = (1280, 720)):
+        width, height = frame_size
+        self.image_shape = (height, width, 3)
+        self.label_shape = (height, width)
+        self.image_bytes = height * width * 3
+        self.slot_bytes = self.image_bytes + height * width
+        self.num_slots = int(min(max_bytes // self.slot_bytes, num_samples))
+        if self.num_slots < 1:
+            raise ValueError("A cache of {} bytes cannot hold a single {}x{} sample".format(max_bytes, width, height))
+
+        self.slots = torch.zeros((self.num_slots, self.slot_bytes), dtype = torch.uint8).share_memory_()
+        self.slot_of_index = torch.full((num_samples,), -1, dtype = torch.int64).share_memory_()
+        self.index_of_slot = torch.full((self.num_slots,), -1, dtype = torch.int64).share_memory_()
+        self.last_used = torch.zeros(self.num_slots, dtype = torch.int64).share_memory_()
+        # tick, hits, misses, evictions
+        self.counters = torch.zeros(4, dtype = torch.int64).share_memory_()
+        self.lock = mp.Lock()
+
+    def tick(self):
+        self.counters[0] += 1
+        return self.counters[0].item()
+
+    def get(self, index):
+        """
+        Returns copies of the cached (image, label) uint8 arrays of sample index, or None on a miss.
+        """
+        with self.lock:
+            slot = self.slot_of_index[index].item()
+            if slot < 0:
+                self.counters[2] += 1
+                return None
+            self.counters[1] += 1
+            self.last_used[slot] = self.tick()
+            entry = self.slots[slot].numpy().copy()
+        return entry[:self.image_bytes].reshape(self.image_shape), entry[self.image_bytes:].reshape(self.label_shape)
+
+    def put(self, index, image, label):
+        """
+        Stores a decoded sample, evicting the least recently used one when all slots are taken.
+        """
+        if image.shape != self.image_shape or label.shape != self.label_shape:
+            return
+        with self.lock:
+            if self.slot_of_index[index].item() >= 0:
+                return  # another worker decoded it first
+            free = (self.index_of_slot < 0).nonzero()
+            if len(free) > 0:
+                slot = free[0].item()
+            else:
+                slot = torch.argmin(self.last_used).item()
+                self.slot_of_index[self.index_of_slot[slot]] = -1
+                self.counters[3] += 1
+            slot_view = self.slots[slot].numpy()
+            slot_view[:self.image_bytes] = image.reshape(-1)
+            slot_view[self.image_bytes:] = label.reshape(-1)
+            self.index_of_slot[slot] = index
+            self.slot_of_index[index] = slot
+            self.last_used[slot] = self.tick()
+
+    @property
+    def hits(self):
+        return self.counters[1].item()
+
+    @property
+    def misses(self):
+        return self.counters[2].item()
+
+    @property
+    def evictions(self):
+        return self.counters[3].item()
+
+    def used_bytes(self):
+        return int((self.index_of_slot >= 0).sum().item()) * self.slot_bytes
+
+    def summary(self):
+        lookups = max(self.hits + self.misses, 1)
+        return "sample cache: {} hits, {} misses ({:.1f}% hit rate), {} evictions, {:.1f} / {:.1f} MB".format(
+            self.hits, self.misses, 100. * self.hits / lookups, self.evictions,
+            self.used_bytes() / 2.**20, self.num_slots * self.slot_bytes / 2.**20)
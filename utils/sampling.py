@@ -0,0 +1,153 @@
+import torch
+from torch.utils.data import Sampler
+import numpy as np
+from tqdm import tqdm
+import abc
+import os
+
+from utils.data_loading import pil_black_and_white_loader
+
+"""
+Label-aware sampling for the DeepDriveDataset. A SampleIndex holds the fraction of pixels of every class
+in every sample's label, built once from the label pngs and cached to disk. The samplers below
+use it to draw frames instead of sampling uniformly over DeepDriveDataset.samples.
+"""
+
+class SampleIndex:
+    # labels are decoded at 1/4 resolution, which is plenty for pixel fractions
+    INDEX_LABEL_SIZE = (320, 180)
+    RAW_CLASSES = 3
+
+    def __init__(self, label_paths, class_fractions):
+        """
+        Args:
+            label_paths (list): path of the label png of every sample, in dataset order
+            class_fractions (np.array): (num_samples x 3) fraction of pixels of each raw class
+        """
+        self.label_paths = list(label_paths)
+        self.class_fractions = np.asarray(class_fractions, dtype = np.float32)
+
+    @classmethod
+    def build(cls, dataset):
+        print("Building sample index over {} labels...".format(len(dataset.samples)))
+        class_fractions = np.zeros((len(dataset.samples), cls.RAW_CLASSES), dtype = np.float32)
+        for idx, (_, target_path) in tqdm(enumerate(dataset.samples)):
+            target = np.asarray(pil_black_and_white_loader(target_path, cls.INDEX_LABEL_SIZE))
+            counts = np.bincount(target.ravel(), minlength = cls.RAW_CLASSES)[:cls.RAW_CLASSES]
+            class_fractions[idx] = counts / float(target.size)
+        return cls([target_path for _, target_path in dataset.samples], class_fractions)
+
+    def save(self, outfile):
+        np.savez_compressed(outfile, label_paths = np.array(self.label_paths), class_fractions = self.class_fractions)
+
+    @classmethod
+    def load(cls, infile):
+        with np.load(infile) as index:
+            return cls(index["label_paths"].tolist(), index["class_fractions"])
+
+    @classmethod
+    def load_or_build(cls, index_file, dataset):
+        """
+        Loads the index from index_file if it matches the dataset, otherwise builds it and saves it there.
+        """
+        if os.path.exists(index_file):
+            index = cls.load(index_file)
+            if index.label_paths == [target_path for _, target_path in dataset.samples]:
+                return index
+            print("Sample index {} is stale, rebuilding".format(index_file))
+        index = cls.build(dataset)
+        index.save(index_file)
+        return index
+
+    def fractions(self, num_classes = 3):
+        """
+        Returns (num_samples x num_classes) pixel fractions. For 2 classes both drivable classes are merged,
+        matching preprocess_two_classes.
+        """
+        if num_classes == 3:
+            return self.class_fractions
+        elif num_classes == 2:
+            return np.stack([self.class_fractions[:, 0], self.class_fractions[:, 1] + self.class_fractions[:, 2]], axis = 1)
+        else:
+            assert(False), "Expected num classes to be either 2 or 3"
+
+    def __len__(self):
+        return len(self.label_paths)
+
+
+class RecordingSampler(Sampler, metaclass = abc.ABCMeta):
+    """
+    Base class for samplers that draw a new list of indices every epoch. The order is kept so the trainer can
+    map a batch index back to the samples it contains (the DataLoader preserves sampler order).
+    """
+    def __init__(self, num_samples):
+        self.num_samples = num_samples
+        self.order = []
+
+    @abc.abstractmethod
+    def draw(self):
+        """
+        Returns the np.array of dataset indices for the next epoch.
+        """
+
+    def batch_indices(self, batch_idx, batch_size):
+        return self.order[batch_idx * batch_size:(batch_idx + 1) * batch_size]
+
+    def __iter__(self):
+        self.order = self.draw().tolist()
+        return iter(self.order)
+
+    def __len__(self):
+        return self.num_samples
+
+
+class ClassBalancedSampler(RecordingSampler):
+    """
+    Draws samples with replacement, weighting every sample by its pixel fractions divided by the
+    dataset-wide fraction of each class, so frames containing rare classes are seen more often.
+
+    Args:
+        index (SampleIndex): precomputed class fractions
+        num_classes (int): 2 or 3
+        num_samples (int, optional): samples per epoch, the size of the dataset if None
+        power (float): 0 is uniform sampling, 1 fully balances the expected pixel counts
+    """
+    def __init__(self, index, num_classes = 3, num_samples = None, power = 1.):
+        super(ClassBalancedSampler, self).__init__(num_samples or len(index))
+        fractions = index.fractions(num_classes).astype(np.float64)
+        class_frequency = np.maximum(fractions.mean(axis = 0), 1e-6)
+        weights = np.sum(fractions / class_frequency, axis = 1) ** power
+        self.weights = torch.as_tensor(weights / weights.sum(), dtype = torch.double)
+
+    def draw(self):
+        return torch.multinomial(self.weights, self.num_samples, replacement = True)
+
+
+class HardExampleSampler(RecordingSampler):
+    """
+    Draws samples with probability proportional to the last loss recorded for them during training, mixed with
+    uniform sampling so that every frame keeps being revisited. Frames that have not been seen yet get the
+    largest recorded loss.
+
+    Args:
+        num_dataset_samples (int): size of the dataset
+        num_samples (int, optional): samples per epoch, the size of the dataset if None
+        uniform_mix (float): fraction of the probability mass spread uniformly over all frames
+    """
+    def __init__(self, num_dataset_samples, num_samples = None, uniform_mix = .5):
+        super(HardExampleSampler, self).__init__(num_samples or num_dataset_samples)
+        self.losses = np.full(num_dataset_samples, np.nan)
+        self.uniform_mix = uniform_mix
+
+    def record_loss(self, indices, losses):
+        self.losses[np.asarray(indices)] = np.asarray(losses)
+
+    def draw(self):
+        seen = ~np.isnan(self.losses)
+        if not seen.any():
+            return torch.randint(0, len(self.losses), (self.num_samples,))
+        losses = np.where(seen, self.losses, np.nanmax(self.losses))
+        if losses.sum() <= 0:
+            return torch.randint(0, len(self.losses), (self.num_samples,))
+        probabilities = (1 - self.uniform_mix) * losses / losses.sum() + self.uniform_mix / len(losses)
+        return torch.multinomial(torch.as_tensor(probabilities, dtype = torch.double), self.num_samples, replacement = True)
@@ -0,0 +1,239 @@
+import torch.utils.data as data
+import torch.distributed as dist
+
+import numpy as np
+
+import argparse
+import io
+import itertools
+import json
+import os
+import tarfile
+
+from utils.data_loading import (make_dataset, make_sample, pil_decode, pil_label_decode, make_augmentation,
+                                normalize_pixel_values, preprocess_two_classes)
+
+"""
+Streams (jpg, _drivable_id.png) pairs out of large tar shards instead of opening two small files per sample, which
+is what kills throughput on NFS and object store mounts. Each shard is read front to back; samples are shuffled
+within a buffer, and the epoch is split evenly across distributed ranks and DataLoader workers.
+
+Convert the folder layout once (train and val) with
+
+    python -m utils.shard_dataset <images/100k> <drivable_maps/labels> <shards> --samples-per-shard 1000
+
+which writes <shards>/train/shard-00000.tar, ... and an index.json with the sample count of every shard.
+"""
+
+INDEX_FILE = "index.json"
+LABEL_SUFFIX = "_drivable_id.png"
+
+
+def write_shards(image_dir, label_dir, out_dir, samples_per_shard = 1000, shuffle = True, seed = 0):
+    """
+    Packs the image/label pairs of make_dataset(image_dir, label_dir) into tar shards in out_dir. The encoded
+    bytes are copied as is, so nothing is re-compressed. Pairs are shuffled across shards so that every shard holds
+    a representative mix of frames.
+
+    Returns:
+        dict: the index written to out_dir/index.json
+    """
+    samples = make_dataset(image_dir, label_dir)
+    if shuffle:
+        order = np.random.RandomState(seed).permutation(len(samples))
+        samples = [samples[i] for i in order]
+    os.makedirs(out_dir, exist_ok = True)
+
+    shards = []
+    for start in range(0, len(samples), samples_per_shard):
+        name = "shard-{:05d}.tar".format(len(shards))
+        path = os.path.join(out_dir, name)
+        with tarfile.open(path + ".tmp", "w") as tar:
+            for sample_path, target_path in samples[start:start + samples_per_shard]:
+                key = os.path.splitext(os.path.basename(sample_path))[0]
+                tar.add(sample_path, arcname = key + ".jpg")
+                tar.add(target_path, arcname = key + LABEL_SUFFIX)
+        os.replace(path + ".tmp", path)
+        shards.append({"name": name, "samples": len(samples[start:start + samples_per_shard])})
+
+    index = {"samples_per_shard": samples_per_shard, "shards": shards}
+    with open(os.path.join(out_dir, INDEX_FILE), "w") as f:
+        json.dump(index, f, indent = 2)
+    return index
+
+
+def read_shard(path):
+    """
+    Yields (key, image bytes, label bytes) from one shard, reading it sequentially.
+    """
+    pending = {}
+    with tarfile.open(path, "r|") as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            if member.name.endswith(LABEL_SUFFIX):
+                key, kind = member.name[:-len(LABEL_SUFFIX)], "label"
+            else:
+                key, kind = os.path.splitext(member.name)[0], "image"
+            pending.setdefault(key, {})[kind] = tar.extractfile(member).read()
+            if len(pending[key]) == 2:
+                entry = pending.pop(key)
+                yield key, entry["image"], entry["label"]
+
+
+def shuffle_buffer(items, buffer_size, rng):
+    """
+    Yields items in a random order using a buffer of buffer_size, the way a sequential reader can shuffle.
+    """
+    buffer = []
+    for item in items:
+        if len(buffer) < buffer_size:
+            buffer.append(item)
+            continue
+        index = rng.randint(buffer_size)
+        yield buffer[index]
+        buffer[index] = item
+    rng.shuffle(buffer)
+    for item in buffer:
+        yield item
+
+
+class ShardDataset(data.IterableDataset):
+    """
+    Iterable counterpart of DeepDriveDataset reading from the shards written by ``write_shards``. It returns the
+    same (raw_sample, sample, target) tensors.
+
+    Args:
+        shard_dir (string): directory with the shards and their index.json
+        transform (callable, optional): see DeepDriveDataset
+        augmentation (callable, optional): see DeepDriveDataset
+        image_size (tuple, optional): see DeepDriveDataset
+        shuffle (bool): shuffle the shard order and the samples within a buffer, reseeded by ``set_epoch``
+        buffer_size (int): number of encoded samples held for shuffling
+        seed (int): base seed, identical on all ranks so they agree on the shard order
+    """
+    def __init__(self, shard_dir, transform = None, augmentation = None, image_size = None, shuffle = False,
+                 buffer_size = 1000, seed = 0):
+        with open(os.path.join(shard_dir, INDEX_FILE)) as f:
+            index = json.load(f)
+        if len(index["shards"]) == 0:
+            raise RuntimeError("Found 0 shards in folder of: " + shard_dir)
+
+        self.root = shard_dir
+        self.shards = [(os.path.join(shard_dir, shard["name"]), shard["samples"]) for shard in index["shards"]]
+        self.transform = transform
+        self.augmentation = augmentation
+        self.image_size = image_size
+        self.shuffle = shuffle
+        self.buffer_size = buffer_size
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def world(self):
+        """
+        Returns (rank, world_size, worker_id, num_workers) of the calling DataLoader worker.
+        """
+        rank, world_size = 0, 1
+        if dist.is_available() and dist.is_initialized():
+            rank, world_size = dist.get_rank(), dist.get_world_size()
+        worker_info = data.get_worker_info()
+        worker_id, num_workers = (worker_info.id, worker_info.num_workers) if worker_info is not None else (0, 1)
+        return rank, world_size, worker_id, num_workers
+
+    def assigned_ranges(self):
+        """
+        (shard path, samples to skip, samples to read) of every shard this worker of this rank reads. The shards
+        are laid end to end in the (epoch) order every rank agrees on, and every rank takes the same number of
+        samples, floor(total / world_size), as a contiguous range, like DistributedSampler with drop_last. Every
+        rank therefore runs the same number of steps, the remainder of the epoch is dropped, and no sample is read
+        twice. A rank's range is split over its workers the same way.
+        """
+        rank, world_size, worker_id, num_workers = self.world()
+        order = np.arange(len(self.shards))
+        if self.shuffle:
+            np.random.RandomState(self.seed + self.epoch).shuffle(order)
+
+        quota = self.total_samples() // world_size
+        per_worker = [quota // num_workers + (1 if worker < quota % num_workers else 0) for worker in range(num_workers)]
+        start = rank * quota + sum(per_worker[:worker_id])
+        end = start + per_worker[worker_id]
+
+        ranges, offset = [], 0
+        for i in order:
+            path, samples = self.shards[i]
+            low, high = max(start, offset), min(end, offset + samples)
+            if low < high:
+                ranges.append((path, low - offset, high - low))
+            offset += samples
+        return ranges
+
+    def total_samples(self):
+        return sum(samples for _, samples in self.shards)
+
+    def read_shard(self, path):
+        return read_shard(path)
+
+    def __iter__(self):
+        rank, _, worker_id, _ = self.world()
+        rng = np.random.RandomState((self.seed + self.epoch) * 1000 + rank * 100 + worker_id)
+
+        samples = (sample for path, skip, count in self.assigned_ranges()
+                   for sample in itertools.islice(self.read_shard(path), skip, skip + count))
+        if self.shuffle and self.buffer_size > 1:
+            samples = shuffle_buffer(samples, self.buffer_size, rng)
+
+        for _, image_bytes, label_bytes in samples:
+            raw_sample = np.array(pil_decode(io.BytesIO(image_bytes), self.image_size), dtype = np.uint8)
+            target = np.array(pil_label_decode(io.BytesIO(label_bytes), self.image_size))
+            yield make_sample(raw_sample, target, self.transform, self.augmentation)
+
+    def __len__(self):
+        """
+        Samples seen by one rank per epoch, the same on every rank.
+        """
+        return self.total_samples() // self.world()[1]
+
+    def __repr__(self):
+        fmt_str = 'Dataset ' + self.__class__.__name__ + '\n'
+        fmt_str += '    Number of datapoints: {}\n'.format(self.__len__())
+        fmt_str += '    Number of shards: {}\n'.format(len(self.shards))
+        fmt_str += '    Root Location: {}\n'.format(self.root)
+        return fmt_str
+
+
+def load_shard_datasets(shard_dir, num_classes = 3, crop_size = None, scale_range = (1., 1.), flip = False,
+                        image_size = None, buffer_size = 1000):
+    '''
+    Sharded equivalent of load_datasets, reading shard_dir/train and shard_dir/val. Only the training set is
+    shuffled and augmented.
+    '''
+    if num_classes not in (2, 3):
+        raise ValueError("Expected num classes to be either 2 or 3")
+    transform = normalize_pixel_values if num_classes == 3 else preprocess_two_classes
+
+    augmentation = None
+    if crop_size is not None or tuple(scale_range) != (1., 1.) or flip:
+        augmentation = make_augmentation(crop_size, scale_range, flip)
+
+    train_dataset = ShardDataset(os.path.join(shard_dir, "train"), transform = transform, augmentation = augmentation,
+                                 image_size = image_size, shuffle = True, buffer_size = buffer_size)
+    test_dataset = ShardDataset(os.path.join(shard_dir, "val"), transform = transform)
+    return train_dataset, test_dataset
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Convert the image/label folders into sequential tar shards')
+    parser.add_argument('image_dir', type = str, help = "directory containing the train/val images")
+    parser.add_argument('label_dir', type = str, help = "directory containing the train/val labels")
+    parser.add_argument('out_dir', type = str, help = "directory to write <split>/shard-*.tar to")
+    parser.add_argument('--samples-per-shard', dest = "samples_per_shard", type = int, default = 1000)
+    parser.add_argument('--splits', type = str, nargs = "+", default = ["train", "val"])
+    args = parser.parse_args()
+
+    for split in args.splits:
+        index = write_shards(os.path.join(args.image_dir, split), os.path.join(args.label_dir, split),
+                             os.path.join(args.out_dir, split), args.samples_per_shard, shuffle = split == "train")
+        print("{}: {} samples in {} shards".format(split, sum(shard["samples"] for shard in index["shards"]), len(index["shards"])))